@@ -0,0 +1,265 @@
+import os
+import queue
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+# Seconds between two looks at the sheets completed in the workers
+PROGRESS_INTERVAL = 0.2
+
+_progress = None  # queue for (file, current_sheet, total_sheets) in worker processes
+
+
+def process_one(filepath, config, cancel_token=None, sheet_callback=None):
+    """Process a single file and report the outcome as a plain dict.
+
+    Runs inside worker processes, so it never raises and only returns
+    picklable values. Without ``cancel_token`` the token installed in the
+    worker process is used. Completed sheets go to
+    ``sheet_callback(file, current_sheet, total_sheets)``, or in a worker
+    to the parent's ``iter_batch``.
+    """
+    from cancellation import ProcessingStopped, worker_token
+    from excel_processor import ExcelProcessor
+
+    start = time.perf_counter()
+    result = {
+        "file": str(filepath),
+        "ok": False,
+        "error": None,
+        "traceback": None,
+        "output_folder": None,
+        "sheets": 0,
+        "seconds": 0.0,
+        "stopped": False,
+    }
+
+    def sheet_completed(current_sheet, total_sheets):
+        result["sheets"] += 1
+        if sheet_callback:
+            sheet_callback(str(filepath), current_sheet, total_sheets)
+        elif _progress is not None:
+            _progress.put((str(filepath), current_sheet, total_sheets))
+
+    processor = ExcelProcessor(config)
+    processor.set_sheet_progress_callback(sheet_completed)
+    processor.set_cancel_token(cancel_token or worker_token())
+    try:
+        processor.process_file(filepath)
+        result["ok"] = True
+        if config.dry_run:
+            result["report"] = processor.report
+        output_folder = Path(filepath).parent / "Deeva"
+        if output_folder.exists():
+            result["output_folder"] = str(output_folder)
+    except ProcessingStopped as e:
+        result["error"] = str(e)
+        result["stopped"] = True
+    except Exception as e:
+        result["error"] = str(e)
+        result["traceback"] = traceback.format_exc()
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _init_worker(cancel_token, log_queue, progress, level):
+    """Initializer of the worker processes of ``iter_batch``."""
+    global _progress
+    from cancellation import install_worker_token
+    from logger import log_to_queue
+
+    install_worker_token(cancel_token)
+    log_to_queue(log_queue, level)
+    _progress = progress
+
+
+def resolve_workers(config, workers=None):
+    workers = workers or config.workers or os.cpu_count() or 1
+    return max(1, workers)
+
+
+def iter_batch(files, config, workers=None, should_continue=None, cancel_token=None,
+               sheet_callback=None):
+    """Yield ``process_one`` results as files finish, in completion order.
+
+    At most ``workers`` files are processed at the same time, each in its
+    own process. ``should_continue()`` is asked before a file is handed
+    out; it may block (to pause) and returns ``False`` to stop handing out
+    files. Files that are already running are finished and reported.
+
+    ``cancel_token`` (a ``cancellation.CancelToken``) also reaches the
+    files that are running: they stop within milliseconds and, being
+    neither done nor failed, are not reported.
+
+    The workers log through this process's sinks, and the sheets they
+    complete are passed to ``sheet_callback(file, current_sheet,
+    total_sheets)`` on the calling thread, before the file's result.
+    """
+    from multiprocessing import Manager
+
+    from logger import forward_worker_logs
+
+    if should_continue is None and cancel_token is not None:
+        should_continue = cancel_token.wait
+    files, duplicates = _split_duplicates([str(file) for file in files], config)
+    workers = min(resolve_workers(config, workers), len(files) or 1)
+
+    if workers == 1:
+        for file in files:
+            if should_continue and not should_continue():
+                return
+            result = process_one(file, config, cancel_token, sheet_callback)
+            if result["stopped"]:
+                return
+            yield result
+            yield from _duplicate_results(result, duplicates.get(file, ()), config)
+        return
+
+    # Manager queues work with forked and spawned workers alike
+    with Manager() as manager:
+        log_queue, progress = manager.Queue(), manager.Queue()
+        stop_forwarding = forward_worker_logs(log_queue)
+        try:
+            yield from _iter_pool(files, config, workers, should_continue, cancel_token,
+                                  sheet_callback, duplicates, log_queue, progress)
+        finally:
+            stop_forwarding()
+
+
+def _iter_pool(files, config, workers, should_continue, cancel_token, sheet_callback,
+               duplicates, log_queue, progress):
+    from logger import get_logger
+
+    initargs = (cancel_token, log_queue, progress, get_logger().getEffectiveLevel())
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=initargs) as executor:
+        pending = {}
+        remaining = iter(files)
+        stopped = False
+
+        while True:
+            while not stopped and len(pending) < workers:
+                file = next(remaining, None)
+                if file is None or (should_continue and not should_continue()):
+                    stopped = True
+                    break
+                pending[executor.submit(process_one, file, config)] = file
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            _report_sheets(progress, sheet_callback)
+            for future in done:
+                file = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker process died, e.g. killed or out of memory
+                    result = {
+                        "file": file, "ok": False, "error": str(e),
+                        "traceback": traceback.format_exc(), "output_folder": None,
+                        "sheets": 0, "seconds": 0.0, "stopped": False,
+                    }
+                if result["stopped"]:
+                    stopped = True
+                    continue
+                yield result
+                yield from _duplicate_results(result, duplicates.get(file, ()), config)
+
+
+def _report_sheets(progress, sheet_callback):
+    while True:
+        try:
+            item = progress.get_nowait()
+        except queue.Empty:
+            return
+        if sheet_callback:
+            sheet_callback(*item)
+
+
+def _split_duplicates(files, config):
+    """Keep only the first of every group of byte-identical inputs.
+
+    Returns the files to process and ``{first: [(duplicate, key), ...]}``.
+    Only files whose size equals another file's size are hashed.
+    """
+    if not config.cache or config.dry_run:
+        return files, {}
+
+    from output_cache import cache_key
+
+    by_size = {}
+    for file in files:
+        try:
+            by_size.setdefault(os.path.getsize(file), []).append(file)
+        except OSError:
+            pass
+
+    duplicates = {}
+    skipped = set()
+    for same_size in by_size.values():
+        if len(same_size) < 2:
+            continue
+        first_of = {}
+        for file in same_size:
+            key = cache_key(file, config)
+            if key in first_of:
+                duplicates.setdefault(first_of[key], []).append((file, key))
+                skipped.add(file)
+            else:
+                first_of[key] = file
+
+    return [file for file in files if file not in skipped], duplicates
+
+
+def _duplicate_results(result, duplicates, config):
+    """Give each duplicate of a processed file that file's output."""
+    from output_cache import OutputCache, link_or_copy
+
+    source = Path(result["file"])
+    for file, key in duplicates:
+        start = time.perf_counter()
+        duplicate = dict(result, file=file, sheets=0)
+        if result["ok"]:
+            try:
+                output_folder = Path(file).parent / "Deeva"
+                output_folder.mkdir(exist_ok=True)
+                output_file = output_folder / Path(file).name
+                source_output = source.parent / "Deeva" / source.name
+                if output_file.resolve() != source_output.resolve():
+                    link_or_copy(source_output, output_file)
+                OutputCache(output_folder, config.cache_dir).store(key, output_file)
+                duplicate["output_folder"] = str(output_folder)
+            except Exception as e:
+                duplicate.update(ok=False, error=str(e), traceback=traceback.format_exc())
+        duplicate["seconds"] = time.perf_counter() - start
+        yield duplicate
+
+
+def process_batch(files, config, workers=None, progress_callback=None, should_continue=None,
+                  cancel_token=None):
+    """Process ``files`` in parallel and return the summary ``results`` dict.
+
+    ``progress_callback(done, total, result)`` is called for every finished
+    file. The summary has the same ``success``/``failed``/``output_folder``
+    keys as ``ProcessorThread`` reports, plus the per-file ``errors``.
+    """
+    files = list(files)
+    results = {"success": 0, "failed": 0, "output_folder": None, "errors": []}
+
+    for done, result in enumerate(iter_batch(files, config, workers, should_continue, cancel_token), 1):
+        if result["ok"]:
+            results["success"] += 1
+            if not results["output_folder"]:
+                results["output_folder"] = result["output_folder"]
+        else:
+            results["failed"] += 1
+            results["errors"].append((result["file"], result["error"]))
+
+        if progress_callback:
+            progress_callback(done, len(files), result)
+
+    return results
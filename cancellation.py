@@ -0,0 +1,86 @@
+import multiprocessing
+
+STOPPED_MESSAGE = "Processing stopped by user"
+
+
+class ProcessingStopped(Exception):
+    """Raised by ``CancelToken.check`` once processing was stopped."""
+
+    def __init__(self, message=STOPPED_MESSAGE):
+        super().__init__(message)
+
+
+class CancelToken:
+    """Stop and pause requests, shared with the code doing the work.
+
+    The GUI calls ``stop``, ``pause`` and ``resume``; the engines call
+    ``check`` between groups, chunks and every few hundred rows, so a stop
+    takes effect within milliseconds instead of after the current file.
+    The token is made of ``multiprocessing`` events: passed to a process
+    pool as initializer argument (see ``install_worker_token``) it stops
+    and pauses the worker processes too.
+    """
+
+    def __init__(self):
+        self._stopped = multiprocessing.Event()
+        self._running = multiprocessing.Event()
+        self._running.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._running.set()
+
+    def pause(self):
+        self._running.clear()
+        if self._stopped.is_set():
+            # A stop that raced the pause must not leave workers blocked
+            self._running.set()
+
+    def resume(self):
+        self._running.set()
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def wait(self):
+        """Block while paused; return ``False`` once stopped."""
+        self._running.wait()
+        return not self._stopped.is_set()
+
+    def check(self):
+        """Block while paused; raise ``ProcessingStopped`` once stopped."""
+        if not self.wait():
+            raise ProcessingStopped()
+
+
+class _NeverCancelled:
+    """Token of code that was not handed one; costs nothing to check."""
+
+    stopped = False
+    paused = False
+
+    def wait(self):
+        return True
+
+    def check(self):
+        pass
+
+
+NO_CANCEL = _NeverCancelled()
+
+_worker_token = NO_CANCEL
+
+
+def install_worker_token(token):
+    """Process pool initializer making ``token`` this process's ``worker_token``."""
+    global _worker_token
+    _worker_token = token or NO_CANCEL
+
+
+def worker_token():
+    return _worker_token
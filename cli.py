@@ -0,0 +1,137 @@
+"""Process Excel files without the GUI.
+
+    python -m cli [options] PATH [PATH ...]
+
+PATH may be a file, a directory (its Excel files, ``Deeva`` output folders
+excluded) or a glob pattern. One JSON object per processed file is written
+to stdout. Exit codes: 0 all files processed, 1 some files failed, 2 bad
+arguments, 3 no Excel files found, 130 interrupted.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+from config import Config
+
+EXCEL_SUFFIXES = (".xlsx", ".xlsm", ".xls")
+# Engines that drive Excel, so they only run on Windows
+EXCEL_ENGINES = ("vbs", "com")
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_NO_INPUT = 3
+EXIT_INTERRUPTED = 130
+
+
+def collect_files(paths, recursive=False):
+    """Expand files, directories and glob patterns into Excel files, in order."""
+    files = []
+    seen = set()
+
+    def add(path):
+        path = Path(path)
+        if (path.suffix.lower() in EXCEL_SUFFIXES and not path.name.startswith("~$")
+                and path.parent.name != "Deeva"):
+            key = str(path.resolve())
+            if key not in seen:
+                seen.add(key)
+                files.append(str(path))
+
+    for arg in paths:
+        path = Path(arg)
+        if path.is_dir():
+            pattern = "**/*" if recursive else "*"
+            for child in sorted(path.glob(pattern)):
+                if child.is_file():
+                    add(child)
+        elif path.is_file():
+            add(path)
+        else:
+            for match in sorted(glob.glob(arg, recursive=True)):
+                if Path(match).is_file():
+                    add(match)
+    return files
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m cli",
+        description="Restructure Excel files without the GUI. Outputs go to a "
+                    "Deeva folder next to each input.",
+    )
+    parser.add_argument("paths", nargs="+", metavar="PATH",
+                        help="files, directories or glob patterns")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="include Excel files in subdirectories")
+    parser.add_argument("-e", "--engine", choices=("vbs", "openpyxl", "stream", "com"),
+                        default=default_engine(),
+                        help="vbs and com need Windows and Excel (default: vbs on "
+                             "Windows, stream elsewhere)")
+    parser.add_argument("-w", "--workers", type=int, default=Config.workers,
+                        help="files processed in parallel, 0 for one per CPU (default 1)")
+    parser.add_argument("--sheet-workers", type=int, default=Config.sheet_workers,
+                        help="sheets of one file rewritten in parallel")
+    parser.add_argument("--header-color", type=int, default=Config.header_color,
+                        help="header fill as an Excel BGR color (default yellow)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="analyse the files without writing anything")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always process, even when the input did not change")
+    parser.add_argument("--cache-dir", default=Config.cache_dir,
+                        help="shared folder for cached outputs")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="log to stderr (-v info, -vv debug)")
+    return parser
+
+
+def default_engine():
+    return Config.engine if os.name == "nt" else "stream"
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.workers < 0 or args.sheet_workers < 0:
+        parser.error("worker counts cannot be negative")
+    if args.engine in EXCEL_ENGINES and os.name != "nt" and not args.dry_run:
+        parser.error(f"the {args.engine} engine needs Windows and Excel; "
+                     f"use --engine stream or openpyxl")
+
+    level = {0: logging.WARNING, 1: logging.INFO}.get(args.verbose, logging.DEBUG)
+    logging.basicConfig(level=level, stream=sys.stderr,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+
+    files = collect_files(args.paths, args.recursive)
+    if not files:
+        print("No Excel files found", file=sys.stderr)
+        return EXIT_NO_INPUT
+
+    config = Config(
+        header_color=args.header_color,
+        dry_run=args.dry_run,
+        engine=args.engine,
+        workers=args.workers,
+        sheet_workers=args.sheet_workers,
+        cache=not args.no_cache,
+        cache_dir=args.cache_dir,
+    )
+
+    from batch import iter_batch
+
+    failed = 0
+    try:
+        for result in iter_batch(files, config):
+            failed += not result["ok"]
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+from itertools import accumulate
+
+from ooxml import column_letter
+
+
+class ComSheetScan:
+    """Snapshot of a sheet read through COM with a handful of bulk calls.
+
+    ``Value2`` and ``Formula`` of the used area are fetched as two 2D arrays,
+    so block detection runs in Python memory. Which cells hold a value is
+    computed once as a boolean matrix (with NumPy when it is installed).
+    Fill colors are not available in bulk; ``header_mask`` probes the
+    ``Interior.Color`` of whole row spans, which is ``None`` when the span
+    mixes fills, and only splits mixed spans further. Single cells are only
+    read for mixed rows, and only for cells that hold a value.
+    """
+
+    HEADER_COLUMNS = 9
+
+    def __init__(self, sheet, header_color, max_rows=None):
+        self.sheet = sheet
+        self.header_color = header_color
+
+        used_range = sheet.UsedRange
+        self.last_row = used_range.Row + used_range.Rows.Count - 1
+        self.cols_count = used_range.Columns.Count
+        if max_rows is not None:
+            self.last_row = min(self.last_row, max_rows)
+
+        area = sheet.Range(sheet.Cells(1, 1), sheet.Cells(self.last_row, self.cols_count))
+        self.values = as_grid(area.Value2)
+        self.formulas = as_grid(area.Formula)
+
+        self._filled = _filled_matrix(self.values)
+        self._span_colors = {}
+        self._cell_colors = {}
+
+    def row_values(self, row):
+        return [_normalize_value(value) for value in self.values[row - 1]]
+
+    def data_mask(self):
+        """Per-row flags: the row holds a value or a formula."""
+        mask = _any_per_row(self._filled, self.cols_count)
+        for index, filled in enumerate(mask):
+            # A formula may evaluate to an empty string
+            if not filled:
+                mask[index] = any(
+                    isinstance(formula, str) and formula.startswith("=")
+                    for formula in self.formulas[index]
+                )
+        return mask
+
+    def header_mask(self):
+        """Per-row flags: the row is a header, see ``is_header``."""
+        last_col = min(self.HEADER_COLUMNS, self.cols_count)
+        candidates = _any_per_row(self._filled, last_col)
+        counts = [0] + list(accumulate(candidates))
+        self._probe_spans(1, self.last_row, last_col, counts)
+        return [
+            candidate and self.is_header(row)
+            for row, candidate in enumerate(candidates, 1)
+        ]
+
+    def has_data(self, row):
+        if any(self._filled[row - 1]):
+            return True
+        return any(
+            isinstance(formula, str) and formula.startswith("=")
+            for formula in self.formulas[row - 1]
+        )
+
+    def is_header(self, row, columns=HEADER_COLUMNS):
+        """Whether ``row`` has a non-empty header colored cell in ``columns``."""
+        last_col = min(columns, self.cols_count)
+        filled = self._filled[row - 1]
+        candidates = [col for col in range(1, last_col + 1) if filled[col - 1]]
+        if not candidates:
+            return False
+
+        color = self._span_color(row, last_col)
+        if color is not None:
+            return color == self.header_color
+        return any(self.cell_color(row, col) == self.header_color for col in candidates)
+
+    def _probe_spans(self, first_row, last_row, last_col, counts):
+        """Resolve the fill of every candidate row in ``first_row..last_row``.
+
+        ``counts`` are prefix sums of the candidate rows; spans without any
+        candidate are skipped. A uniform span answers all its rows at once,
+        a mixed one is split in half until few candidates are left.
+        """
+        candidates = counts[last_row] - counts[first_row - 1]
+        if not candidates:
+            return
+        if candidates <= 2:
+            # Splitting further would cost more probes than it saves
+            for row in range(first_row, last_row + 1):
+                if counts[row] != counts[row - 1]:
+                    self._span_color(row, last_col)
+            return
+
+        span = self.sheet.Range(f"A{first_row}:{column_letter(last_col)}{last_row}")
+        color = span.Interior.Color
+        if color is not None:
+            for row in range(first_row, last_row + 1):
+                self._span_colors[(row, last_col)] = color
+            return
+
+        middle = (first_row + last_row) // 2
+        self._probe_spans(first_row, middle, last_col, counts)
+        self._probe_spans(middle + 1, last_row, last_col, counts)
+
+    def is_colored_row(self, row):
+        """Whether every cell of the used columns of ``row`` has the header fill."""
+        return self._span_color(row, self.cols_count) == self.header_color
+
+    def duplicate_header_rows(self):
+        """Rows below the first header that repeat it in values and fill.
+
+        Rows are keyed by their normalized values, so the candidates are a
+        single dict lookup; only those cost a row-wide color probe.
+        """
+        header_row = None
+        for row in range(1, self.last_row + 1):
+            if self.is_header(row, self.cols_count):
+                header_row = row
+                break
+
+        if not header_row:
+            return set()
+
+        # Only rows with the header's pattern of filled cells can repeat it,
+        # so only those are normalized and keyed by their values
+        rows_by_values = {}
+        for row in _matching_rows(self._filled, header_row, self.last_row):
+            rows_by_values.setdefault(tuple(self.row_values(row)), []).append(row)
+
+        candidates = rows_by_values.get(tuple(self.row_values(header_row)), [])
+        return {row for row in candidates if self.is_colored_row(row)}
+
+    def cell_color(self, row, col):
+        key = (row, col)
+        if key not in self._cell_colors:
+            self._cell_colors[key] = self.sheet.Cells(row, col).Interior.Color
+        return self._cell_colors[key]
+
+    def _span_color(self, row, last_col):
+        key = (row, last_col)
+        if key not in self._span_colors:
+            span = self.sheet.Range(f"A{row}:{column_letter(last_col)}{row}")
+            self._span_colors[key] = span.Interior.Color
+        return self._span_colors[key]
+
+
+class ComShapeIndex:
+    """Shapes of a sheet indexed by the row of their top left cell.
+
+    Built with a single pass over ``sheet.Shapes``; each entry keeps the
+    shape with its offset inside the anchor cell, so copying the shapes of a
+    group needs no further lookups. ``insert_rows`` keeps the index in step
+    with rows inserted into the sheet.
+    """
+
+    def __init__(self, sheet=None):
+        self.rows = {}
+        for shape in (sheet.Shapes if sheet is not None else ()):
+            cell = shape.TopLeftCell
+            self.rows.setdefault(cell.Row, []).append({
+                'shape': shape,
+                'top_offset': shape.Top - cell.Top,
+                'left': shape.Left,
+            })
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.rows.values())
+
+    def shapes_in(self, start_row, end_row):
+        """Yield ``(row, entry)`` for shapes anchored in ``start_row..end_row``."""
+        if end_row - start_row > len(self.rows):
+            rows = sorted(row for row in self.rows if start_row <= row <= end_row)
+        else:
+            rows = [row for row in range(start_row, end_row + 1) if row in self.rows]
+        for row in rows:
+            for entry in self.rows[row]:
+                yield row, entry
+
+    def insert_rows(self, row, count):
+        """Shift shapes anchored at or below ``row`` down by ``count`` rows."""
+        self.rows = {
+            (shape_row + count if shape_row >= row else shape_row): entries
+            for shape_row, entries in self.rows.items()
+        }
+
+
+def as_grid(data):
+    """COM returns a scalar for single cells and tuples of rows otherwise."""
+    if isinstance(data, (tuple, list)):
+        return [list(row) for row in data]
+    return [[data]]
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _filled_matrix(values):
+    """Return which cells of ``values`` are not blank, per row."""
+    try:
+        import numpy as np
+    except ImportError:
+        return [[not _is_blank(value) for value in row] for row in values]
+
+    grid = np.array(values, dtype=object).reshape(len(values), -1)
+    return ~np.frompyfunc(_is_blank, 1, 1)(grid).astype(bool)
+
+
+def _any_per_row(filled, columns):
+    if isinstance(filled, list):
+        return [any(row[:columns]) for row in filled]
+    return filled[:, :columns].any(axis=1).tolist()
+
+
+def _matching_rows(filled, row, last_row):
+    """Rows below ``row`` whose filled cells are exactly those of ``row``."""
+    if isinstance(filled, list):
+        pattern = filled[row - 1]
+        return [r for r in range(row + 1, last_row + 1) if filled[r - 1] == pattern]
+    matches = (filled[row:last_row] == filled[row - 1]).all(axis=1)
+    return (matches.nonzero()[0] + row + 1).tolist()
+
+
+def _normalize_value(value):
+    if value is None:
+        return ""
+    return str(value).strip()
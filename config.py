@@ -4,4 +4,10 @@ from dataclasses import dataclass
 @dataclass
 class Config:
     header_color: int = 65535  # Yellow
-    dry_run: bool = False
\ No newline at end of file
+    dry_run: bool = False
+    engine: str = "vbs"  # "vbs", "openpyxl", "stream" or "com" (V2 in a warm Excel, see excel_pool.py)
+    bulk_scan: bool = True  # read COM sheets with array reads instead of per cell
+    workers: int = 1  # files processed in parallel; 0 uses every CPU
+    sheet_workers: int = 1  # sheets of one file rewritten in parallel (Python engines); 0 uses every CPU
+    cache: bool = True  # reuse outputs of unchanged inputs, see output_cache.py
+    cache_dir: str = ""  # shared cache folder; empty keeps the cache in each Deeva folder
\ No newline at end of file
@@ -0,0 +1,159 @@
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from cancellation import NO_CANCEL
+from excel_colors import bgr_to_rgb
+from excel_styles import StyleResolver
+from ooxml import DRAWING_REL, part_rels, worksheet_parts
+from sheet_scan import blank_shared_strings, scan_sheet
+from transform_plan import build_plan
+
+# Engines that lay sheets out like RestructureSheet in excel_processor.vbs;
+# the others duplicate the header blocks of ExcelProcessorV2
+RESTRUCTURE_ENGINES = ("vbs", "stream")
+
+# Rows written per second, counting every row of the processed sheets.
+# Measured on a 50,000 row sheet that grows to 80,000 rows; Excel driven
+# through the VBScript has no comparable figure
+ROWS_PER_SECOND = {
+    "stream": 19000,
+    "openpyxl": 7000,
+}
+
+_ANCHOR_ROW_RE = re.compile(rb"<(?:\w+:)?from>.*?<(?:\w+:)?row>(\d+)</", re.DOTALL)
+
+
+def analyze_workbook(path, config, cancel_token=None):
+    """Report what processing ``path`` would do, without writing anything.
+
+    Every sheet is planned the way ``config.engine`` would process it:
+    the RestructureSheet layout for vbs and stream, where every record is
+    a group of one row, and the V2 header blocks for openpyxl and com. The
+    report lists, per sheet, the groups and rows to insert, the formulas in
+    copied rows (each copy is rewritten), the ``LEN(`` formulas that are
+    repointed and the shapes that are copied, plus estimates of the output
+    size and of the processing time. ``cancel_token`` is checked between
+    chunks.
+    """
+    start = time.perf_counter()
+    check = (cancel_token or NO_CANCEL).check
+    path = Path(path)
+    report = {
+        "file": str(path),
+        "engine": config.engine,
+        "size": path.stat().st_size,
+        "sheets": [],
+        "rows_to_insert": 0,
+        "estimated_size": None,
+        "estimated_seconds": None,
+    }
+    if not zipfile.is_zipfile(path):
+        report["error"] = "Not an OOXML package; only Excel can read it"
+        return report
+
+    output_rows = 0
+    extra_bytes = 0
+    restructure = config.engine in RESTRUCTURE_ENGINES
+    workers = config.sheet_workers
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and not restructure else None
+    skipped = set()
+    if config.engine == "com":
+        # ExcelProcessorV2.can_process leaves the other sheets alone
+        from triage import triage_workbook
+        triage = triage_workbook(path, config.header_color)
+        skipped = {sheet.name for sheet in triage.sheets if not sheet.can_process} if triage else set()
+    try:
+        with zipfile.ZipFile(path) as zf:
+            styles = StyleResolver.from_zip(zf)
+            header_styles = styles.header_styles(bgr_to_rgb(config.header_color))
+            blank_strings = blank_shared_strings(zf)
+
+            for name, part in worksheet_parts(zf):
+                if part not in zf.NameToInfo:
+                    continue
+                if restructure:
+                    sheet = _restructure_sheet(zf, part, styles, config, check)
+                else:
+                    sheet = _analyze_sheet(zf, part, header_styles, blank_strings, executor, check)
+                if name in skipped:
+                    sheet.update(dict.fromkeys(_PLANNED, 0))
+                sheet["name"] = name
+                report["sheets"].append(sheet)
+                report["rows_to_insert"] += sheet["rows_to_insert"]
+
+                output_rows += sheet["rows"] + sheet["rows_to_insert"]
+                if sheet["rows"]:
+                    # Inserted rows look like the rows they are copied from
+                    growth = sheet["rows_to_insert"] / sheet["rows"]
+                    extra_bytes += zf.getinfo(part).compress_size * growth
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    report["estimated_size"] = int(report["size"] + extra_bytes)
+    if config.engine in ROWS_PER_SECOND:
+        report["estimated_seconds"] = round(output_rows / ROWS_PER_SECOND[config.engine], 1)
+    report["scan_seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def _analyze_sheet(zf, part, header_styles, blank_strings, executor, check):
+    scan = scan_sheet(zf, part, header_styles, blank_strings, executor, check=check)
+    shape_rows = _shape_rows(zf, part)
+    plan = build_plan(
+        scan.blocks,
+        scan.last_row,
+        formula_cells=[(row, col) for row, col, uses_len in scan.formula_cells if uses_len],
+        shape_rows=shape_rows,
+    )
+    copied = {row for group in plan.groups for row in group}
+    return {
+        "rows": scan.last_row,
+        "blocks": len(scan.blocks),
+        "groups": len(plan.groups),
+        "largest_group": max((len(group) for group in plan.groups), default=0),
+        "rows_to_insert": plan.inserted_rows,
+        "formulas_to_rewrite": sum(1 for row, _, _ in scan.formula_cells if row in copied),
+        "len_formulas_to_fix": len(plan.formula_fixups),
+        "shapes": len(shape_rows),
+        "shapes_to_copy": len(plan.shape_copies),
+    }
+
+
+# Report entries that are 0 for a sheet the engine does not process
+_PLANNED = (
+    "blocks", "groups", "largest_group", "rows_to_insert", "formulas_to_rewrite",
+    "len_formulas_to_fix", "shapes_to_copy",
+)
+
+
+def _restructure_sheet(zf, part, styles, config, check):
+    from excel_processor_stream import restructure_layout
+    layout = restructure_layout(zf, part, styles, config.header_color, check)
+    shape_rows = _shape_rows(zf, part)
+    copied = set(layout.copied_rows)
+    return {
+        "rows": layout.next_row - 1,
+        "blocks": 1 if layout.header_row else 0,
+        "groups": layout.records,
+        "largest_group": 1 if layout.records else 0,
+        # Rows inserted for the copies and header copies, less the trailing header deleted
+        "rows_to_insert": layout.delta - (1 if layout.deleted_row else 0),
+        "formulas_to_rewrite": layout.copied_formulas,
+        "len_formulas_to_fix": 0,
+        "shapes": len(shape_rows),
+        # Excel pastes the shapes of copied rows, the stream engine leaves drawings alone
+        "shapes_to_copy": sum(1 for row in shape_rows if row in copied) if config.engine == "vbs" else 0,
+    }
+
+
+def _shape_rows(zf, part):
+    """Rows holding the top left corner of the shapes drawn on a sheet."""
+    rows = []
+    for rel_type, target in part_rels(zf, part).values():
+        if rel_type == DRAWING_REL and target in zf.NameToInfo:
+            rows.extend(int(row) + 1 for row in _ANCHOR_ROW_RE.findall(zf.read(target)))
+    return rows
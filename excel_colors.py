@@ -0,0 +1,13 @@
+def bgr_to_rgb(color):
+    """Convert an Excel COM BGR color integer to an ``RRGGBB`` hex string."""
+    red = color & 0xFF
+    green = (color >> 8) & 0xFF
+    blue = (color >> 16) & 0xFF
+    return f"{red:02X}{green:02X}{blue:02X}"
+
+
+def rgb_equals(argb, rgb):
+    """Compare an OOXML ``AARRGGBB``/``RRGGBB`` value with ``RRGGBB``."""
+    if not isinstance(argb, str):
+        return False
+    return argb[-6:].upper() == rgb
@@ -1,19 +1,25 @@
 # excel_com.py
-import win32com.client
-import pythoncom
-
 from logger import get_logger
 
 
 class ExcelCOM:
-    def __init__(self):
+    def __init__(self, dispatch=None):
+        """``dispatch`` replaces ``win32com.client.DispatchEx``, e.g. ``tests/fake_com.FakeDispatch``."""
         self.app = None
         self.logger = get_logger()
         self._original_state = {}
+        self._dispatch = dispatch
+        self._opened = set()  # FullName of the workbooks opened through open_workbook
 
     def __enter__(self):
-        pythoncom.CoInitialize()
-        self.app = win32com.client.Dispatch("Excel.Application")
+        if self._dispatch is None:
+            import pythoncom
+            import win32com.client
+            pythoncom.CoInitialize()
+            # A new instance; Dispatch would attach to the user's Excel
+            self.app = win32com.client.DispatchEx("Excel.Application")
+        else:
+            self.app = self._dispatch("Excel.Application")
 
         # Save original state
         self._original_state = {
@@ -52,15 +58,27 @@ class ExcelCOM:
                 except:
                     pass
 
-            # Close all workbooks
-            for wb in self.app.Workbooks:
+            # Close only our workbooks, never the ones the user opened
+            for wb in self.own_workbooks():
                 wb.Close(False)
 
-            self.app.Quit()
+            if self.app.Workbooks.Count:
+                self.logger.warning("Excel left running for the workbooks opened in it")
+                self.app.Visible = True
+            else:
+                self.app.Quit()
         except Exception as e:
             self.logger.error(f"Error closing Excel: {e}")
         finally:
-            pythoncom.CoUninitialize()
+            if self._dispatch is None:
+                import pythoncom
+                pythoncom.CoUninitialize()
 
     def open_workbook(self, filepath):
-        return self.app.Workbooks.Open(filepath)
\ No newline at end of file
+        wb = self.app.Workbooks.Open(filepath)
+        self._opened.add(wb.FullName)
+        return wb
+
+    def own_workbooks(self):
+        """Workbooks opened through ``open_workbook`` that are still open."""
+        return [wb for wb in self.app.Workbooks if wb.FullName in self._opened]
\ No newline at end of file
@@ -0,0 +1,177 @@
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+
+from logger import get_logger
+
+# Tasks an Excel instance runs before it is replaced; Excel's memory use
+# only grows while it stays open
+MAX_FILES_PER_SESSION = 50
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class ExcelSession:
+    """A long-lived Excel instance that is started on first use.
+
+    Excel is quit and started afresh on the next task after ``max_files``
+    tasks, when a task leaves workbooks open and when Excel stops
+    answering. COM objects belong to the thread that created them, so a
+    session must only be used from one thread.
+    """
+
+    def __init__(self, max_files=MAX_FILES_PER_SESSION, dispatch=None):
+        self.max_files = max_files
+        self.dispatch = dispatch
+        self.logger = get_logger()
+        self.excel = None
+        self.files = 0  # tasks run by the current Excel instance
+        self.starts = 0
+
+    def run(self, task, *args):
+        """Return ``task(excel_com, *args)``."""
+        if self.excel is None:
+            self._start()
+        try:
+            return task(self.excel, *args)
+        finally:
+            self.files += 1
+            reason = self._recycle_reason()
+            if reason:
+                self.logger.info(f"Restarting Excel: {reason}")
+                self.close()
+
+    def close(self):
+        excel, self.excel = self.excel, None
+        if excel is not None:
+            excel.__exit__(None, None, None)
+
+    def _start(self):
+        from excel_com import ExcelCOM
+        self.excel = ExcelCOM(self.dispatch).__enter__()
+        self.files = 0
+        self.starts += 1
+
+    def _recycle_reason(self):
+        if self.files >= self.max_files:
+            return f"{self.files} files processed"
+        try:
+            leaked = len(self.excel.own_workbooks())
+        except Exception as e:
+            return f"Excel stopped responding ({e})"
+        if leaked:
+            return f"{leaked} workbooks left open"
+        return None
+
+
+class ExcelPool:
+    """Worker threads that each own an ``ExcelSession``.
+
+    Tasks go to whichever worker is free and run as ``task(excel_com,
+    *args)`` on that worker's thread, so every Excel instance is created,
+    used and quit on the same thread and stays warm between files.
+    """
+
+    def __init__(self, size=1, max_files=MAX_FILES_PER_SESSION, dispatch=None):
+        self._tasks = queue.Queue()
+        self.sessions = [ExcelSession(max_files, dispatch) for _ in range(size)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(session,), name=f"excel-{i}", daemon=True)
+            for i, session in enumerate(self.sessions)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, task, *args):
+        future = Future()
+        self._tasks.put((future, task, args))
+        return future
+
+    def run(self, task, *args):
+        return self.submit(task, *args).result()
+
+    def close(self):
+        """Quit every Excel instance once the submitted tasks are done."""
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, session):
+        try:
+            while True:
+                item = self._tasks.get()
+                if item is None:
+                    break
+                future, task, args = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(session.run(task, *args))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            session.close()
+
+
+def shared_pool(dispatch=None):
+    """The pool of this process: one session, kept until ``close_shared_pool``.
+
+    ``dispatch`` only applies when the pool is created.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ExcelPool(1, dispatch=dispatch)
+        return _shared
+
+
+def close_shared_pool():
+    global _shared
+    with _shared_lock:
+        pool, _shared = _shared, None
+    if pool is not None:
+        pool.close()
+
+
+atexit.register(close_shared_pool)
+
+
+def process_workbook(excel, path, config, sheets=None, progress_callback=None,
+                     cancel_token=None):
+    """Run ``ExcelProcessorV2`` over the workbook at ``path`` and save it in place.
+
+    Only the sheets whose indexes are in ``sheets`` are processed when it
+    is given; ``progress_callback(done, total)`` is called for every sheet.
+    A stop through ``cancel_token`` closes the workbook unsaved.
+    """
+    from cancellation import NO_CANCEL
+    from excel_processor_v2 import ExcelProcessorV2
+
+    cancel_token = cancel_token or NO_CANCEL
+    wb = excel.open_workbook(str(Path(path).resolve()))
+    try:
+        processor = ExcelProcessorV2(config)
+        processor.set_cancel_token(cancel_token)
+        total = wb.Sheets.Count
+        for index in range(1, total + 1):
+            cancel_token.check()
+            sheet = wb.Sheets(index)
+            if (sheets is None or index in sheets) and processor.can_process(sheet):
+                processor.process_sheet(sheet)
+            if progress_callback:
+                progress_callback(index, total)
+        wb.Save()
+    finally:
+        wb.Close(False)
+
+
+def count_sheets(excel, path):
+    wb = excel.open_workbook(str(Path(path).resolve()))
+    try:
+        return wb.Sheets.Count
+    finally:
+        wb.Close(False)
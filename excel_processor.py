@@ -1,50 +1,206 @@
+import os
 import subprocess
 import shutil
 from pathlib import Path
+from cancellation import NO_CANCEL
 from config import Config
 from logger import get_logger
 
 
 class ExcelProcessor:
-    """Handle Excel files via external VBScript."""
+    """Handle Excel files via external VBScript or a Python engine."""
 
     def __init__(self, config: Config):
         self.config = config
         self.logger = get_logger()
         self._sheet_progress_callback = None
-        self._pause_stop_checker = None
+        self._cancel_token = NO_CANCEL
+        self._previous_output = None
+        self._fingerprints = None  # per-sheet fingerprints of the output just written
+        self.report = None  # analysis of the last file in dry run mode
 
     def set_sheet_progress_callback(self, callback):
         self._sheet_progress_callback = callback
 
+    def set_cancel_token(self, token):
+        """Stop or pause through ``token``, see ``cancellation.CancelToken``.
+
+        The Python engines and the com engine check it between groups and
+        rows; the VBScript cannot be interrupted and finishes its file.
+        """
+        self._cancel_token = token or NO_CANCEL
+
     def process_file(self, filepath: str):
         self.logger.info(f"Starting processing: {filepath}")
         source_path = Path(filepath)
         output_folder = source_path.parent / "Deeva"
-        output_folder.mkdir(exist_ok=True)
         output_file = output_folder / source_path.name
 
         if not self.config.dry_run:
-            self.logger.info(f"Copying file to: {output_file}")
-            shutil.copy2(filepath, output_file)
-
-            if self._pause_stop_checker and not self._pause_stop_checker():
-                raise Exception("Processing stopped by user")
-
-            script_path = Path(__file__).with_name("excel_processor.vbs")
-            args = [
-                "cscript",
-                "//NoLogo",
-                str(script_path),
-                str(output_file),
-                str(self.config.header_color),
-            ]
+            output_folder.mkdir(exist_ok=True)
+            cache = key = None
+            if self.config.cache:
+                from output_cache import OutputCache, cache_key
+                cache = OutputCache(output_folder, self.config.cache_dir)
+                key = cache_key(source_path, self.config)
+                if cache.materialize(key, output_file):
+                    self.logger.info(f"Input unchanged, reused previous output: {output_file}")
+                    return
+            # The old output may be a hardlink into the cache; never write
+            # through it. The Python engines copy its unchanged sheets.
+            self._previous_output = None
+            self._fingerprints = None
+            if (self.config.cache and self.config.engine in ("openpyxl", "stream")
+                    and output_file.exists()):
+                self._previous_output = output_file.with_name(f"{output_file.name}.previous")
+                os.replace(output_file, self._previous_output)
+            else:
+                output_file.unlink(missing_ok=True)
 
             try:
-                subprocess.run(args, check=True)
-                self.logger.info(f"Successfully saved to: {output_file}")
-            except subprocess.CalledProcessError as e:
-                self.logger.error(f"VBScript processing failed: {e}")
+                if self.config.engine == "openpyxl":
+                    self._process_with_openpyxl(source_path, output_file)
+                elif self.config.engine == "stream":
+                    self._process_with_stream(source_path, output_file)
+                elif self.config.engine == "com":
+                    self._process_with_com(source_path, output_file)
+                else:
+                    self._process_with_vbscript(source_path, output_file)
+            except:
+                # Stopped or failed: never leave a half written output
+                # behind, keep the last one
+                if self._previous_output and self._previous_output.exists():
+                    os.replace(self._previous_output, output_file)
+                else:
+                    output_file.unlink(missing_ok=True)
                 raise
+            finally:
+                if self._previous_output:
+                    self._previous_output.unlink(missing_ok=True)
+
+            # Fingerprints of an earlier output must not outlive it
+            from output_cache import SheetManifest
+            SheetManifest(output_folder).set(output_file.name, self._fingerprints, output_file)
+            if cache:
+                cache.store(key, output_file)
         else:
-            self.logger.info(f"[DRY RUN] Would save to: {output_file}")
+            self._analyze(source_path, output_file)
+
+    def _analyze(self, source_path, output_file):
+        from dry_run import analyze_workbook
+        self.report = analyze_workbook(source_path, self.config, self._cancel_token)
+        for sheet in self.report["sheets"]:
+            self.logger.info(
+                f"[DRY RUN] Sheet '{sheet['name']}': {sheet['groups']} groups, "
+                f"{sheet['rows_to_insert']} rows to insert, "
+                f"{sheet['formulas_to_rewrite']} formulas to rewrite, "
+                f"{sheet['shapes_to_copy']} shapes to copy"
+            )
+        estimate = self.report["estimated_seconds"]
+        self.logger.info(
+            f"[DRY RUN] Would save to: {output_file}, about "
+            f"{self.report['estimated_size'] or self.report['size']} bytes"
+            + (f" in about {estimate}s" if estimate is not None else "")
+        )
+
+    def _process_with_vbscript(self, source_path, output_file):
+        self.logger.info(f"Copying file to: {output_file}")
+        shutil.copy2(source_path, output_file)
+
+        self._cancel_token.check()
+
+        triage = self._triage(source_path)
+        if triage is not None and not triage.needs_processing:
+            self.logger.info("No header found in any sheet, file copied unchanged")
+            return
+
+        script_path = Path(__file__).with_name("excel_processor.vbs")
+        args = [
+            "cscript",
+            "//NoLogo",
+            str(script_path),
+            str(output_file),
+            str(self.config.header_color),
+        ]
+        if triage is not None:
+            # Only the sheets with a header are handed to Excel
+            args.append(",".join(str(sheet.index) for sheet in triage.sheets_to_process))
+
+        try:
+            subprocess.run(args, check=True)
+            self.logger.info(f"Successfully saved to: {output_file}")
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"VBScript processing failed: {e}")
+            raise
+
+    def _process_with_com(self, source_path, output_file):
+        self.logger.info(f"Copying file to: {output_file}")
+        shutil.copy2(source_path, output_file)
+
+        self._cancel_token.check()
+
+        triage = self._triage(source_path)
+        if triage is not None and not triage.v2_sheets:
+            self.logger.info("No sheet with header blocks found, file copied unchanged")
+            return
+        sheets = None if triage is None else {sheet.index for sheet in triage.v2_sheets}
+
+        # The Excel instance of this process stays open between files
+        from excel_pool import process_workbook, shared_pool
+        shared_pool().run(
+            process_workbook, output_file, self.config, sheets, self._sheet_progress_callback,
+            self._cancel_token,
+        )
+        self.logger.info(f"Successfully saved to: {output_file}")
+
+    def _triage(self, source_path):
+        from triage import triage_workbook
+        try:
+            return triage_workbook(source_path, self.config.header_color)
+        except Exception as e:
+            self.logger.warning(f"Could not pre-scan {source_path.name}: {e}")
+            return None
+
+    def _process_with_openpyxl(self, source_path, output_file):
+        if source_path.suffix.lower() == ".xls":
+            raise ValueError("The openpyxl engine does not support .xls files")
+
+        self._cancel_token.check()
+
+        from excel_processor_openpyxl import ExcelProcessorOpenpyxl
+        processor = ExcelProcessorOpenpyxl(self.config)
+        processor.set_cancel_token(self._cancel_token)
+        self._use_previous_output(processor, output_file)
+        processor.process_file(source_path, output_file)
+        self._store_fingerprints(processor, output_file)
+        self.logger.info(f"Successfully saved to: {output_file}")
+
+    def _process_with_stream(self, source_path, output_file):
+        if source_path.suffix.lower() == ".xls":
+            raise ValueError("The streaming engine does not support .xls files")
+
+        self._cancel_token.check()
+
+        from excel_processor_stream import ExcelProcessorStream
+        processor = ExcelProcessorStream(self.config)
+        processor.set_cancel_token(self._cancel_token)
+        processor.set_progress_callback(self._sheet_progress_callback)
+        self._use_previous_output(processor, output_file)
+        processor.process_file(source_path, output_file)
+        self._store_fingerprints(processor, output_file)
+        self.logger.info(f"Successfully saved to: {output_file}")
+
+    def _use_previous_output(self, processor, output_file):
+        """Let a Python engine copy unchanged sheets from the previous output."""
+        if not self.config.cache:
+            return
+        from output_cache import SheetManifest
+        fingerprints = {}
+        if self._previous_output:
+            fingerprints = SheetManifest(output_file.parent).get(
+                output_file.name, self._previous_output
+            )
+        processor.set_previous_output(self._previous_output, fingerprints)
+
+    def _store_fingerprints(self, processor, output_file):
+        self._fingerprints = processor.fingerprints
@@ -0,0 +1,304 @@
+import os
+from copy import copy, deepcopy
+
+from openpyxl import load_workbook
+from openpyxl.cell.cell import Cell
+from openpyxl.utils import get_column_letter
+
+from cancellation import NO_CANCEL
+from excel_colors import bgr_to_rgb
+from excel_processor_stream import ROWS_PER_CHECK, ExcelProcessorStream
+from excel_styles import StyleResolver
+from logger import get_logger
+from transform_plan import build_plan, find_blocks_from_masks
+
+
+class ExcelProcessorOpenpyxl:
+    """Run the V2 block duplication on openpyxl worksheets without Excel.
+
+    The sheet is scanned once into memory and then rebuilt in a single pass,
+    so the cost is linear in the number of cells instead of shifting the
+    sheet for every inserted row.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = get_logger()
+        self._progress_callback = None
+        self._cancel_token = NO_CANCEL
+        self._header_rgb = bgr_to_rgb(config.header_color)
+        self._fill_cache = {}
+        self._styles = None
+        self._previous = None
+        self.fingerprints = None
+
+    def set_progress_callback(self, callback):
+        self._progress_callback = callback
+
+    def set_cancel_token(self, token):
+        """Check ``token`` between sheets and while rows are scanned or written."""
+        self._cancel_token = token or NO_CANCEL
+
+    def set_previous_output(self, path, fingerprints):
+        """See ``ExcelProcessorStream.set_previous_output``."""
+        self._previous = (path, fingerprints)
+
+    def process_file(self, filepath, output_path=None):
+        """Plan every sheet with openpyxl and write only the changed parts.
+
+        The plans are applied by streaming the affected worksheet and
+        drawing parts into a copy of the package; everything else (other
+        sheets, images, VBA) is copied without being re-serialized.
+        """
+        stream = ExcelProcessorStream(self.config)
+        stream.set_cancel_token(self._cancel_token)
+        reused = referenced = set()
+        if self._previous:
+            stream.set_previous_output(*self._previous)
+            reused = set(stream.reusable_sheets(filepath).values())
+            if reused:
+                referenced = stream.referenced_sheets(filepath)
+
+        wb = load_workbook(filepath)
+        self._fill_cache = {}
+        self._styles = None
+
+        plans = {}
+        for ws in wb.worksheets:
+            self._cancel_token.check()
+            if ws.title in reused:
+                # Copied from the previous output; the plan is only needed
+                # when references of other sheets follow its rows
+                if ws.title.lower() in referenced:
+                    plans[ws.title] = self.plan_sheet(ws)
+                continue
+            self.logger.info(f"Processing sheet '{ws.title}' with openpyxl method")
+            plan = self.plan_sheet(ws)
+            if plan is None:
+                self.logger.info("No data blocks found")
+            else:
+                plans[ws.title] = plan
+        wb.close()
+
+        output_path = output_path or filepath
+        if str(output_path) == str(filepath):
+            # The package is read while the output is written
+            temp_path = f"{output_path}.tmp"
+            stream.apply_plans(filepath, temp_path, plans)
+            os.replace(temp_path, output_path)
+        else:
+            stream.apply_plans(filepath, output_path, plans)
+        self.fingerprints = stream.fingerprints
+
+    def can_process(self, ws):
+        rows = self._scan_rows(ws)
+        yellow_headers_count = 0
+
+        for row in range(1, min(50, len(rows))):
+            if rows[row]['is_header']:
+                yellow_headers_count += 1
+
+        return yellow_headers_count >= 2
+
+    def process_sheet(self, ws):
+        self.logger.info(f"Processing sheet '{ws.title}' with openpyxl method")
+
+        plan = self.plan_sheet(ws)
+        if plan is None:
+            self.logger.info("No data blocks found")
+            return
+
+        self.apply_plan(ws, plan)
+
+        self.logger.info(f"Processed {len(plan.groups)} groups")
+
+    def plan_sheet(self, ws):
+        """Scan ``ws`` once and return its ``TransformPlan`` or ``None``."""
+        rows = self._scan_rows(ws)
+        blocks = self._find_all_blocks(rows)
+        if not blocks:
+            return None
+
+        shape_rows = [
+            item.anchor._from.row + 1 for item in ws._images + ws._charts
+            if getattr(getattr(item, 'anchor', None), '_from', None) is not None
+        ]
+        return build_plan(
+            blocks,
+            len(rows) - 1,
+            removed_rows=self._duplicate_header_rows(rows),
+            formula_cells=[
+                (row, col) for row in range(1, len(rows)) for col in rows[row]['len_columns']
+            ],
+            shape_rows=shape_rows,
+        )
+
+    def _scan_rows(self, ws):
+        """Read every row once and keep only what block detection needs.
+
+        Index 0 is a placeholder so that list indices match sheet rows.
+        """
+        cols_count = ws.max_column - ws.min_column + 1
+        header_cols = min(9, cols_count)
+        rows = [None]
+
+        for cells in ws.iter_rows(min_row=1, max_row=ws.max_row,
+                                  min_col=1, max_col=cols_count):
+            if not len(rows) % ROWS_PER_CHECK:
+                self._cancel_token.check()
+            values = [self._normalize_value(cell.value) for cell in cells]
+            colored = [self._is_header_fill(ws, cell) for cell in cells]
+            rows.append({
+                'values': values,
+                'colored': colored,
+                'is_header': any(
+                    colored[i] and values[i] for i in range(header_cols)
+                ),
+                'has_data': any(values),
+                'len_columns': [
+                    cell.column for cell in cells
+                    if cell.data_type == 'f' and isinstance(cell.value, str)
+                    and ("LEN(" in cell.value.upper() or "ДЛСТР(" in cell.value.upper())
+                ],
+            })
+
+        return rows
+
+    def _is_header_fill(self, ws, cell):
+        # Fills are shared between cells, so resolve each fill id only once
+        fill_id = cell._style.fillId if cell.has_style else 0
+        matches = self._fill_cache.get(fill_id)
+        if matches is None:
+            matches = self._fill_matches(ws.parent, ws.parent._fills[fill_id])
+            self._fill_cache[fill_id] = matches
+        return matches
+
+    def _fill_matches(self, wb, fill):
+        if getattr(fill, 'fill_type', None) != 'solid':
+            return False
+        if self._styles is None:
+            # Theme colors and tints are resolved like styles.xml ones
+            self._styles = StyleResolver(theme_xml=wb.loaded_theme)
+        color = fill.fgColor
+        attrs = {color.type: str(color.value), 'tint': color.tint}
+        return self._styles.color_key(attrs) == self._header_rgb
+
+    def _find_all_blocks(self, rows):
+        return find_blocks_from_masks(
+            [row['is_header'] for row in rows[1:]],
+            [row['has_data'] for row in rows[1:]],
+        )
+
+    def _duplicate_header_rows(self, rows):
+        header_row = None
+        for row in range(1, len(rows)):
+            if any(c and v for c, v in zip(rows[row]['colored'], rows[row]['values'])):
+                header_row = row
+                break
+
+        if not header_row:
+            return set()
+
+        header = rows[header_row]
+        return {
+            row for row in range(header_row + 1, len(rows))
+            if all(rows[row]['colored']) and rows[row]['values'] == header['values']
+        }
+
+    def apply_plan(self, ws, plan):
+        """Rebuild ``ws`` according to ``plan`` in a single pass."""
+        merged = [copy(cr) for cr in ws.merged_cells.ranges]
+        for cr in merged:
+            ws.unmerge_cells(cr.coord)
+
+        old_cells = ws._cells
+        ws._cells = {}
+        for (row, column), cell in old_cells.items():
+            # The original cell is rewritten in place, copies start from the source
+            value = cell._value
+            for target in plan.targets(row):
+                if target.copy_index < 0:
+                    new_cell = cell
+                    new_cell.row = target.row
+                else:
+                    new_cell = Cell(ws, row=target.row, column=column, value=value)
+                    new_cell.data_type = cell.data_type
+                    new_cell._style = copy(cell._style)
+                    if cell.comment:
+                        new_cell.comment = copy(cell.comment)
+
+                if cell.data_type == 'f' and isinstance(value, str):
+                    new_cell._value = plan.rewrite_formula(value, target, column)
+                if cell.hyperlink:
+                    new_cell.hyperlink = copy(cell.hyperlink)
+
+                ws._cells[(target.row, column)] = new_cell
+
+        old_dims = dict(ws.row_dimensions)
+        ws.row_dimensions.clear()
+        for row, dim in old_dims.items():
+            for target in plan.targets(row):
+                new_dim = copy(dim)
+                new_dim.index = target.row
+                ws.row_dimensions[target.row] = new_dim
+
+        for cr in merged:
+            for target_range in self._target_ranges(cr, plan):
+                ws.merge_cells(target_range)
+
+        self._move_anchors(ws, plan)
+
+        if self._progress_callback:
+            self._progress_callback(len(plan.groups), len(plan.groups))
+
+    def _target_ranges(self, cr, plan):
+        targets = [plan.targets(row) for row in range(cr.min_row, cr.max_row + 1)]
+        # Copy the merge only when every row of it was copied the same way
+        if len({len(t) for t in targets}) != 1:
+            targets = [t[:1] for t in targets]
+
+        ranges = []
+        for top, bottom in zip(targets[0], targets[-1]):
+            ranges.append(
+                f"{get_column_letter(cr.min_col)}{top.row}:"
+                f"{get_column_letter(cr.max_col)}{bottom.row}"
+            )
+        return ranges
+
+    def _move_anchors(self, ws, plan):
+        """Move images and charts with their rows and add the planned copies."""
+        copies = {}
+        for shape in plan.shape_copies:
+            copies.setdefault(shape.source_row, []).append(shape.target_row)
+
+        for items in (ws._images, ws._charts):
+            for item in list(items):
+                anchor = getattr(item, 'anchor', None)
+                marker = getattr(anchor, '_from', None)
+                if marker is None:
+                    continue
+
+                row = marker.row + 1
+                for target_row in copies.get(row, []):
+                    new_item = copy(item)
+                    new_item.anchor = deepcopy(anchor)
+                    self._shift_anchor(new_item.anchor, target_row - row)
+                    items.append(new_item)
+
+                targets = plan.targets(row)
+                if targets and targets[0].copy_index < 0:
+                    self._shift_anchor(anchor, targets[0].row - row)
+                else:
+                    items.remove(item)
+
+    def _shift_anchor(self, anchor, delta):
+        anchor._from.row += delta
+        to = getattr(anchor, 'to', None)
+        if to is not None:
+            to.row += delta
+
+    def _normalize_value(self, value):
+        """Return a stripped string representation of a cell value."""
+        if value is None:
+            return ""
+        return str(value).strip()
@@ -0,0 +1,1294 @@
+import heapq
+import os
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from xml.sax.saxutils import unescape
+
+from cancellation import NO_CANCEL, install_worker_token, worker_token
+from excel_colors import bgr_to_rgb
+from excel_styles import NO_FILL, StyleResolver, uses_styles
+from formula_refs import referenced_sheets, remap_ref, rewrite_row_refs, translate_formula
+from logger import get_logger
+from output_cache import sheet_fingerprints
+from transform_plan import OtherSheets, RowTarget, other_sheet_row
+from ooxml import (ANCHORED_RELS, CHUNK_SIZE, COMMENTS_REL, DRAWING_REL, MAIN_NS, Node,
+                   SheetStreamParser, VML_DRAWING_REL, XmlWriter, column_letter,
+                   document_bytes, parse_document, part_rels, split_cell_ref,
+                   worksheet_parts)
+from zip_passthrough import ZipPassthroughWriter
+
+CALC_CHAIN = "xl/calcChain.xml"
+WORKBOOK_PART = "xl/workbook.xml"
+
+_SHEET_DATA_END_RE = re.compile(rb"</(?:\w+:)?sheetData>|<(?:\w+:)?sheetData\s*/>")
+_REF_ATTR_RE = re.compile(rb'\s(?:sq)?ref="([^"]*)"')
+_FORMULA_RE = re.compile(rb"<(?:\w+:)?f[\s>/]")
+_FORMULA_TEXT_RE = re.compile(rb"<(?:\w+:)?f\b[^>]*>([^<]*![^<]*)<")
+# Longer than any formula, so none is cut between two reads
+_FORMULA_TAIL = 64 * 1024
+_ROW_NUMBER_RE = re.compile(r"[A-Z]+\$?(\d+)")
+_VML_SHAPE_RE = re.compile(rb"<(\w+:)?shape\b.*?</\1?shape>", re.S)
+_VML_ROW_RE = re.compile(rb"(<(?:\w+:)?Row>\s*)(\d+)")
+_VML_ANCHOR_RE = re.compile(rb"(<(?:\w+:)?Anchor>)([^<]*)")
+_VML_SHAPE_ID_RE = re.compile(rb'(\sid="_x0000_s)(\d+)"')
+
+# Rows a SheetRewriter writes between two cancellation checks
+ROWS_PER_CHECK = 256
+
+# States of the RestructureSheet loop
+FIND_HEADER = 0
+SCAN = 1
+CLEAR = 2
+CHECK = 3
+PASSTHROUGH = 4
+
+
+class ExcelProcessorStream:
+    """Apply the ``excel_processor.vbs`` layout by streaming sheet XML.
+
+    Each ``xl/worksheets/sheetN.xml`` part is parsed with expat and written
+    straight into the output package, one ``<row>`` at a time. Rows are
+    renumbered on the fly and the duplicated rows and header copies are
+    emitted as the source rows go by, so memory does not grow with the
+    number of rows.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = get_logger()
+        self._progress_callback = None
+        self._cancel_token = NO_CANCEL
+        self._previous_output = None
+        self._previous_fingerprints = {}
+        self._fingerprinted = None
+        self._referenced = None
+        self.fingerprints = None
+
+    def set_progress_callback(self, callback):
+        self._progress_callback = callback
+
+    def set_cancel_token(self, token):
+        """Check ``token`` between sheets and every ``ROWS_PER_CHECK`` rows."""
+        self._cancel_token = token or NO_CANCEL
+
+    def set_previous_output(self, path, fingerprints):
+        """Copy the sheets whose fingerprint is unchanged from an earlier output.
+
+        ``fingerprints`` are what ``self.fingerprints`` held after the run
+        that wrote ``path``; ``path`` may be ``None`` on a first run. After
+        the run ``self.fingerprints`` holds the fingerprints of the input.
+        """
+        self._previous_output = path
+        self._previous_fingerprints = fingerprints or {}
+        self.fingerprints = {}
+
+    def reusable_sheets(self, filepath):
+        """Return ``{part: sheet_name}`` for the sheets the previous output supplies."""
+        with zipfile.ZipFile(filepath) as zin:
+            reused = self._reusable_parts(zin, worksheet_parts(zin))
+        return {part: name for part, name in reused.items() if name is not None}
+
+    def referenced_sheets(self, filepath):
+        """Lower case names of the sheets other sheets or defined names point into."""
+        with zipfile.ZipFile(filepath) as zin:
+            sheet_refs, name_refs = self._references(zin, worksheet_parts(zin))
+        return set(name_refs).union(*sheet_refs.values())
+
+    def process_file(self, filepath, output_path):
+        restructure = partial(restructure_sheet, header_color=self.config.header_color)
+        self._rewrite_package(
+            filepath, output_path, lambda name: partial(restructure, sheet_name=name),
+            self._has_header_style, self._restructure_layout
+        )
+
+    def apply_plans(self, filepath, output_path, plans):
+        """Apply ``TransformPlan``s keyed by sheet name, one pass per sheet.
+
+        Sheets without a plan are copied unchanged. The drawings, comments
+        and comment shapes of planned sheets are rewritten so that they
+        follow their rows.
+        """
+        def keep_sheet(zin, part, name, styles):
+            return plans.get(name) is None
+
+        self._rewrite_package(
+            filepath, output_path,
+            lambda name: partial(apply_plan, plan=plans[name], sheet_name=name),
+            keep_sheet, lambda zin, part, name, styles: plans.get(name)
+        )
+
+    def _restructure_layout(self, zin, part, name, styles):
+        return restructure_layout(
+            zin, part, styles, self.config.header_color, self._cancel_token.check
+        )
+
+    def _rewrite_package(self, filepath, output_path, sheet_rewriter, keep_sheet=None,
+                         row_map=None):
+        """Write ``output_path`` regenerating only the parts that change.
+
+        Every other member is copied byte for byte without recompression.
+        ``sheet_rewriter(name)`` returns the ``rewrite(zin, part, dst, styles,
+        check, other_sheets)`` callable for a sheet, ``keep_sheet(zin, part,
+        name, styles)`` may declare a sheet unchanged and ``row_map(zin,
+        part, name, styles)`` returns where the rows of a changed sheet go,
+        a ``TransformPlan`` or a restructure layout. Row maps are only asked
+        for when drawings, comments or references of other sheets and
+        defined names have to follow them. With ``Config.sheet_workers``
+        the sheets are rewritten in worker processes, so the rewrite
+        callables must be picklable.
+        """
+        with ExitStack() as stack:
+            zin = stack.enter_context(zipfile.ZipFile(filepath))
+            zout = stack.enter_context(ZipPassthroughWriter(zin, output_path))
+            styles = StyleResolver.from_zip(zin)
+            sheets = worksheet_parts(zin)
+            sheet_names = {part: name for name, part in sheets}
+            sheet_parts = {name.lower(): part for name, part in sheets}
+            order = {part: index for index, (_, part) in enumerate(sheets)}
+
+            reused = self._reusable_parts(zin, sheets)
+            if reused:
+                previous = stack.enter_context(zipfile.ZipFile(self._previous_output))
+
+            kept = set()
+            rewrites = {}
+            for name, part in sheets:
+                if part not in zin.NameToInfo or part in reused:
+                    continue
+                if keep_sheet and keep_sheet(zin, part, name, styles):
+                    kept.add(part)
+                else:
+                    rewrites[part] = sheet_rewriter(name)
+
+            maps = {}
+
+            def sheet_map(part):
+                """Row map of a sheet whose rows move, ``None`` for the others."""
+                if part not in maps:
+                    name = sheet_names[part]
+                    if part in reused:
+                        moves = not (keep_sheet and keep_sheet(zin, part, name, styles))
+                    else:
+                        moves = part in rewrites
+                    maps[part] = row_map(zin, part, name, styles) if moves and row_map else None
+                return maps[part]
+
+            def other_sheets(names, part=None):
+                entries = {}
+                for name in names:
+                    target = sheet_parts.get(name)
+                    if target is None or target == part or target not in zin.NameToInfo:
+                        continue
+                    target_map = sheet_map(target)
+                    if target_map is not None:
+                        before = part is None or order[target] < order[part]
+                        entries[name] = (target_map, before)
+                return OtherSheets(entries) if entries else None
+
+            sheet_refs, name_refs = self._references(zin, sheets)
+            for name, part in sheets:
+                others = other_sheets(sheet_refs.get(part, ()), part)
+                if others is None:
+                    continue
+                if part in rewrites:
+                    rewrites[part] = partial(rewrites[part], other_sheets=others)
+                elif part in kept:
+                    # Unchanged itself, but it points into sheets whose rows move
+                    rewrites[part] = partial(
+                        rewrite_references, sheet_name=name, other_sheets=others
+                    )
+            defined_names = other_sheets(name_refs)
+
+            anchored = _anchored_parts(zin, rewrites, sheet_map)
+            submitted = self._submit_rewrites(stack, filepath, rewrites, styles)
+            processed = 0
+
+            for info in zin.infolist():
+                self._cancel_token.check()
+                if info.filename == CALC_CHAIN:
+                    # Cell positions change, Excel rebuilds the chain on load
+                    continue
+
+                if info.filename in sheet_names:
+                    name = sheet_names[info.filename]
+                    rewrite = rewrites.get(info.filename)
+                    if info.filename in reused:
+                        self.logger.info(f"Sheet '{name}' unchanged since the last run, reused")
+                        zout.copy(previous.getinfo(info.filename), previous)
+                    elif rewrite is None:
+                        zout.copy(info)
+                    else:
+                        self.logger.info(f"Processing sheet '{name}' with streaming method")
+                        if info.filename in submitted:
+                            message = self._collect_rewrite(zout, info, *submitted[info.filename])
+                        else:
+                            with zout.open(info.filename) as dst:
+                                message = rewrite(zin, info.filename, dst, styles,
+                                                  check=self._cancel_token.check)
+                        self.logger.info(message)
+                    processed += 1
+                    if self._progress_callback:
+                        self._progress_callback(processed, len(sheets))
+                elif info.filename in reused:
+                    # Drawing of a reused sheet, rewritten the same way as before
+                    zout.copy(previous.getinfo(info.filename), previous)
+                elif info.filename in anchored:
+                    rewrite, part_map = anchored[info.filename]
+                    zout.writestr(info.filename, rewrite(zin.read(info), part_map))
+                elif info.filename == WORKBOOK_PART and defined_names:
+                    zout.writestr(info.filename, rewrite_defined_names(zin.read(info), defined_names))
+                elif info.filename in ("[Content_Types].xml", "xl/_rels/workbook.xml.rels"):
+                    zout.writestr(info.filename, _drop_calc_chain(zin.read(info)))
+                else:
+                    zout.copy(info)
+
+    def _reusable_parts(self, zin, sheets):
+        """Map the parts that can be copied from the previous output to their sheet.
+
+        Drawings and comments of reused sheets map to ``None``. Sheets
+        pointing into a sheet that is not reused are rewritten, their
+        references follow its rows. Fingerprints are only computed once
+        ``set_previous_output`` was called.
+        """
+        if self.fingerprints is None:
+            return {}
+        if self._fingerprinted != zin.filename:
+            self.fingerprints = sheet_fingerprints(zin, self.config)
+            self._fingerprinted = zin.filename
+        if not self._previous_output or not zipfile.is_zipfile(self._previous_output):
+            return {}
+
+        candidates = {}
+        with zipfile.ZipFile(self._previous_output) as previous:
+            for name, part in sheets:
+                fingerprint = self.fingerprints.get(part)
+                if (not fingerprint or self._previous_fingerprints.get(part) != fingerprint
+                        or part not in previous.NameToInfo):
+                    continue
+                drawings = [
+                    target for rel_type, target in part_rels(zin, part).values()
+                    if rel_type in ANCHORED_RELS
+                ]
+                if all(target in previous.NameToInfo for target in drawings):
+                    candidates[part] = (name, drawings)
+
+        sheet_refs, _ = self._references(zin, sheets)
+        sheet_parts = {name.lower(): part for name, part in sheets}
+        dropped = True
+        while dropped:
+            dropped = False
+            for part in list(candidates):
+                targets = {sheet_parts.get(name) for name in sheet_refs.get(part, ())}
+                if any(target and target not in candidates for target in targets):
+                    del candidates[part]
+                    dropped = True
+
+        reused = {}
+        for part, (name, drawings) in candidates.items():
+            reused[part] = name
+            reused.update((target, None) for target in drawings)
+        return reused
+
+    def _references(self, zin, sheets):
+        """Return the references between sheets as ``({part: names}, names)``.
+
+        The first maps sheets to the other sheets their formulas name, the
+        second holds the sheets defined names point into; names are lower
+        case. Sheets are only scanned when there are several.
+        """
+        if self._referenced and self._referenced[0] == zin.filename:
+            return self._referenced[1]
+        sheet_refs = {}
+        if len(sheets) > 1:
+            for name, part in sheets:
+                if part in zin.NameToInfo:
+                    names = _formula_sheets(zin, part, self._cancel_token.check)
+                    names.discard(name.lower())
+                    if names:
+                        sheet_refs[part] = names
+        name_refs = set()
+        for text in _defined_names(zin):
+            name_refs |= referenced_sheets(text)
+        self._referenced = (zin.filename, (sheet_refs, name_refs))
+        return sheet_refs, name_refs
+
+    def _submit_rewrites(self, stack, filepath, rewrites, styles):
+        """Start rewriting sheets in worker processes, one part per task.
+
+        Each worker writes its compressed part into a temporary package;
+        ``_collect_rewrite`` copies it into the output in member order.
+        Returns an empty dict when the sheets are rewritten inline.
+        """
+        workers = min(self.config.sheet_workers or os.cpu_count() or 1, len(rewrites))
+        if workers <= 1:
+            return {}
+
+        temp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        # The workers check the same token, a stop does not wait for their sheets
+        executor = stack.enter_context(ProcessPoolExecutor(
+            max_workers=workers, initializer=install_worker_token,
+            initargs=(self._cancel_token,),
+        ))
+        # Sheets not started yet are dropped when the package is abandoned
+        stack.callback(executor.shutdown, cancel_futures=True)
+        submitted = {}
+        for index, (part, rewrite) in enumerate(rewrites.items()):
+            temp_path = os.path.join(temp_dir, f"{index}.zip")
+            future = executor.submit(
+                _rewrite_part, str(filepath), part, rewrite, styles, temp_path
+            )
+            submitted[part] = (future, temp_path)
+        return submitted
+
+    def _collect_rewrite(self, zout, info, future, temp_path):
+        message = future.result()
+        with zipfile.ZipFile(temp_path) as part_zip:
+            zout.copy(part_zip.getinfo(info.filename), part_zip)
+        os.remove(temp_path)
+        return message
+
+    def _has_header_style(self, zin, part, name, styles):
+        header_styles = styles.header_styles(bgr_to_rgb(self.config.header_color))
+        with zin.open(part) as src:
+            if uses_styles(src, header_styles):
+                return False
+        self.logger.info(f"No header style used in sheet '{name}', rows left as they are")
+        return True
+
+
+def restructure_sheet(zin, part, dst, styles, header_color, check=None, sheet_name=None,
+                      other_sheets=None):
+    """Apply the RestructureSheet layout to one worksheet part.
+
+    ``check`` is called every ``ROWS_PER_CHECK`` rows and may raise to
+    abort. References naming ``sheet_name`` are on this sheet, those into
+    other sheets follow ``other_sheets``. Returns the message to log for
+    the sheet.
+    """
+    header_styles = styles.header_styles(bgr_to_rgb(header_color))
+    tracked_rows, has_formulas = _prescan(zin, part, check)
+    # Formulas may point at rows further down, so the whole layout is
+    # worked out first in a pass that writes nothing
+    layout = restructure_layout(zin, part, styles, header_color, check) if has_formulas else None
+    with zin.open(part) as src:
+        restructurer = SheetRestructurer(
+            XmlWriter(dst), styles.fill_keys, header_styles, tracked_rows, layout,
+            sheet_name, other_sheets
+        )
+        restructurer.run(src, check)
+
+    if restructurer.header_row:
+        return (
+            f"Header found in row {restructurer.header_row}, "
+            f"{restructurer.records} records restructured"
+        )
+    return "No header found"
+
+
+def restructure_layout(zin, part, styles, header_color, check=None):
+    """Lay one worksheet part out like ``restructure_sheet`` without writing it.
+
+    Returns the ``SheetRestructurer``, which tells where every row went.
+    """
+    header_styles = styles.header_styles(bgr_to_rgb(header_color))
+    with zin.open(part) as src:
+        layout = SheetRestructurer(_NullWriter(), styles.fill_keys, header_styles)
+        layout.run(src, check)
+    return layout
+
+
+def apply_plan(zin, part, dst, styles, plan, check=None, sheet_name=None, other_sheets=None):
+    """Apply a ``TransformPlan`` to one worksheet part, see ``restructure_sheet``."""
+    with zin.open(part) as src:
+        PlanApplier(XmlWriter(dst), plan, sheet_name, other_sheets).run(src, check)
+    return f"{len(plan.groups)} groups duplicated, {plan.inserted_rows} rows inserted"
+
+
+def rewrite_references(zin, part, dst, styles, check=None, sheet_name=None,
+                       other_sheets=None):
+    """Make the formulas of an unchanged sheet follow ``other_sheets``."""
+    with zin.open(part) as src:
+        rewriter = ReferenceRewriter(XmlWriter(dst), sheet_name, other_sheets)
+        rewriter.run(src, check)
+    return f"{rewriter.formulas} formulas follow the rows of other sheets"
+
+
+def _rewrite_part(filepath, part, rewrite, styles, temp_path):
+    """Rewrite one worksheet part into a single member package.
+
+    Runs in a worker process of ``ExcelProcessorStream._submit_rewrites``.
+    """
+    with zipfile.ZipFile(filepath) as zin, ZipPassthroughWriter(zin, temp_path) as zout:
+        with zout.open(part) as dst:
+            return rewrite(zin, part, dst, styles, check=worker_token().check)
+
+
+class SheetRewriter:
+    """Common streaming plumbing for rewriting a single worksheet part.
+
+    Subclasses decide where each ``<row>`` goes in ``_handle_row`` and may
+    adjust the elements that follow ``<sheetData>`` in ``_remap_suffix``.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.next_row = 1
+        self.rows_count = None
+        self.cols_count = None
+        self._shared = {}
+        self._row_name = "row"
+        self._in_suffix = False
+        self._check = None
+        self._rows_seen = 0
+
+    def run(self, stream, check=None):
+        self._check = check
+        parser = SheetStreamParser(
+            self.writer.declaration, self._on_start, self._on_end,
+            self._on_element, self._on_row
+        )
+        parser.parse(stream)
+        self.writer.flush()
+        # Layouts are handed to worker processes, the check stays here
+        self._check = None
+
+    def _on_start(self, name, attrs):
+        self.writer.start(name, attrs)
+
+    def _on_end(self, name):
+        if name.rsplit(":", 1)[-1] == "sheetData":
+            self._finish_rows()
+            self._in_suffix = True
+        self.writer.end(name)
+
+    def _on_element(self, node):
+        if node.tag == "dimension" and not self._in_suffix:
+            # The used range changes; Excel recalculates it when missing
+            self._read_dimension(node.attrs.get("ref", ""))
+            return
+        if self._in_suffix:
+            self._remap_suffix(node)
+        self.writer.node(node)
+
+    def _on_row(self, node):
+        self._rows_seen += 1
+        if self._check and not self._rows_seen % ROWS_PER_CHECK:
+            self._check()
+        self._row_name = node.name
+        src_row = int(node.attrs.get("r", self.next_row))
+        self._skip_missing_rows(src_row)
+        self._prepare_row(node, src_row)
+        self._handle_row(node, src_row)
+        self.next_row = src_row + 1
+
+    def _skip_missing_rows(self, src_row):
+        pass
+
+    def _handle_row(self, node, src_row):
+        raise NotImplementedError
+
+    def _finish_rows(self):
+        pass
+
+    def _remap_suffix(self, node):
+        pass
+
+    def _read_dimension(self, ref):
+        corners = [split_cell_ref(part) for part in ref.split(":")]
+        if not corners or None in corners:
+            return
+        first, last = corners[0], corners[-1]
+        self.cols_count = last[0] - first[0] + 1
+        self.rows_count = last[1] - first[1] + 1
+
+    def _prepare_row(self, node, src_row):
+        """Give every cell an explicit reference and expand shared formulas."""
+        col = 0
+        for cell in node.elements():
+            ref = split_cell_ref(cell.attrs.get("r"))
+            col = ref[0] if ref else col + 1
+            cell.attrs["r"] = f"{column_letter(col)}{src_row}"
+
+            formula = cell.find("f")
+            if formula is None or formula.attrs.get("t") != "shared":
+                continue
+            si = formula.attrs.get("si")
+            text = formula.text()
+            if text:
+                self._shared[si] = (text, src_row, col)
+            elif si in self._shared:
+                master, master_row, master_col = self._shared[si]
+                text = translate_formula(master, src_row - master_row, col - master_col)
+            for key in ("t", "si", "ref"):
+                formula.attrs.pop(key, None)
+            _set_formula(formula, text)
+
+
+class SheetRestructurer(SheetRewriter):
+    """Streaming port of ``RestructureSheet`` for a single worksheet part.
+
+    Only rows listed in ``tracked_rows`` (the rows referenced by merged
+    cells, hyperlinks, conditional formats and the like that follow
+    ``<sheetData>``) remember where they ended up. Formula references are
+    adjusted the way Excel adjusts them on every insert, paste and delete
+    of the macro; that needs the final position of rows not read yet, so
+    sheets with formulas get a ``layout`` from an earlier pass.
+    """
+
+    def __init__(self, writer, fill_keys, header_styles, tracked_rows=(), layout=None,
+                 sheet_name=None, other_sheets=None):
+        super().__init__(writer)
+        self.fill_keys = fill_keys
+        self.header_styles = header_styles
+        self.tracked_rows = sorted(tracked_rows)
+        self._tracked = set(self.tracked_rows)
+        self.layout = layout
+        self.sheet_name = sheet_name
+        self.other_sheets = other_sheets
+
+        self.state = FIND_HEADER
+        self.delta = 0
+        self.records = 0
+        self.copied_rows = array("l")  # source rows of the records
+        self.copied_formulas = 0  # formulas in record and header copies
+        self.cleared_rows = array("l")  # source rows whose contents were cleared
+
+        self.header_row = None
+        self.header_node = None
+        self.start_col = None
+        self.end_col = None
+        self.header_copies = array("l")
+        # First source row moved down by each inserted row, in order
+        self.shifted_from = array("l")
+
+        self.placements = {}
+        self.deleted_row = None
+        self._held = []
+
+    # Layout
+
+    def _handle_row(self, node, src_row):
+        if self.state == FIND_HEADER:
+            limit = min(20, self.rows_count or 20)
+            if src_row > limit:
+                self.state = PASSTHROUGH
+            elif self._has_header_color(node):
+                self._start_header(node, src_row)
+            self._emit(node, src_row, src_row)
+        elif self.state == SCAN:
+            if self._has_data(node):
+                self._emit_record(node, src_row)
+            else:
+                self._emit(node, src_row, src_row + self.delta)
+        elif self.state == CLEAR:
+            self._emit_cleared(src_row)
+        elif self.state == CHECK:
+            if self._has_data(node):
+                self._emit_header_copy(src_row)
+                self._emit_record(node, src_row)
+            else:
+                self.state = PASSTHROUGH
+                self._emit(node, src_row, src_row + self.delta)
+        else:
+            self._emit(node, src_row, src_row + self.delta)
+
+    def _skip_missing_rows(self, src_row):
+        """Advance the layout over rows that have no ``<row>`` element."""
+        if src_row <= self.next_row:
+            return
+        first_missing = self.next_row
+        if self.state == CLEAR:
+            self._emit_cleared(first_missing)
+            first_missing += 1
+        if self.state == CHECK and first_missing < src_row:
+            self.state = PASSTHROUGH
+
+        start = bisect_left(self.tracked_rows, first_missing)
+        stop = bisect_left(self.tracked_rows, src_row)
+        for row in self.tracked_rows[start:stop]:
+            self.placements[row] = [(row + self.delta, "move")]
+
+    def _start_header(self, node, src_row):
+        cols_count = self.cols_count or float("inf")
+        values = [
+            split_cell_ref(cell.attrs["r"])[0] for cell in node.elements()
+            if _has_value(cell) and split_cell_ref(cell.attrs["r"])[0] <= cols_count
+        ]
+        if not values:
+            # FindHeaderRange returned Nothing, the sheet stays as it is
+            self.state = PASSTHROUGH
+            return
+
+        self.header_row = src_row
+        self.start_col = min(values)
+        self.end_col = max(values)
+        self.header_node = node.copy()
+        self.state = SCAN
+
+    def _emit_record(self, node, src_row):
+        out_row = src_row + self.delta
+        duplicate = node.copy()
+        self._emit(node, src_row, out_row)
+        self._emit(duplicate, src_row, out_row + 1, paste=True)
+        self.shifted_from.append(src_row + 1)
+        self.copied_rows.append(src_row)
+        self.delta += 1
+        self.records += 1
+        self.state = CLEAR
+
+    def _emit_cleared(self, src_row):
+        out_row = src_row + self.delta
+        stub = Node(self._row_name, {"r": str(out_row), "ht": "15", "customHeight": "1"})
+        self.cleared_rows.append(src_row)
+        self._track(src_row, out_row, "cleared")
+        self._write_row(stub, has_cells=False)
+        self.state = CHECK
+
+    def _emit_header_copy(self, src_row):
+        out_row = src_row + self.delta
+        attrs = {"r": str(out_row)}
+        for key in ("ht", "customHeight"):
+            if key in self.header_node.attrs:
+                attrs[key] = self.header_node.attrs[key]
+
+        row = Node(self.header_node.name, attrs)
+        for cell in self.header_node.elements():
+            col = split_cell_ref(cell.attrs["r"])[0]
+            if self.start_col <= col <= self.end_col:
+                row.children.append(cell.copy())
+
+        offset = out_row - self.header_row
+        # Pasted after the cleared row above, into a row inserted for it
+        remap = self._ref_mapper(out_row, src_row - 1, self.delta + 1, offset)
+        for cell in row.elements():
+            col = split_cell_ref(cell.attrs["r"])[0]
+            cell.attrs["r"] = f"{column_letter(col)}{out_row}"
+            formula = cell.find("f")
+            if formula is not None:
+                self.copied_formulas += 1
+                if remap:
+                    _set_formula(
+                        formula, rewrite_row_refs(formula.text(), remap, sheet_name=self.sheet_name)
+                    )
+                _shift_formula_ref(formula, offset)
+
+        self.header_copies.append(out_row)
+        self.shifted_from.append(src_row)
+        self.delta += 1
+        self._write_row(row, has_cells=bool(row.children))
+
+    def _emit(self, node, src_row, out_row, paste=False):
+        if "r" in node.attrs or out_row != src_row:
+            node.attrs["r"] = str(out_row)
+
+        moved = out_row - src_row
+        if paste:
+            # Pasted one row below its source, into a row inserted for it
+            remap = self._ref_mapper(out_row, src_row, self.delta + 1, 1)
+        else:
+            remap = self._ref_mapper(out_row, src_row, self.delta, 0)
+        if moved or remap:
+            for cell in node.elements():
+                col, _ = split_cell_ref(cell.attrs["r"])
+                cell.attrs["r"] = f"{column_letter(col)}{out_row}"
+                formula = cell.find("f")
+                if formula is None:
+                    continue
+                if paste:
+                    self.copied_formulas += 1
+                text = formula.text()
+                if text and remap:
+                    _set_formula(formula, rewrite_row_refs(text, remap, sheet_name=self.sheet_name))
+                _shift_formula_ref(formula, moved)
+
+        self._track(src_row, out_row, "copy" if paste else "move")
+        self._write_row(node, has_cells=bool(node.elements()))
+
+    def _ref_mapper(self, out_row, done_row, inserted, shift):
+        """Return the ``rewrite_row_refs`` callback for a row written at ``out_row``.
+
+        When the row is written, source rows up to ``done_row`` are already
+        where the layout puts them and the rows below are ``inserted`` rows
+        further down. Relative references are then shifted by ``shift``,
+        the offset of the paste, and every row follows the inserts and the
+        delete that are still to come. References into other sheets follow
+        ``other_sheets``.
+        """
+        layout = self.layout
+        other_sheets = self.other_sheets
+        if layout is None or not (layout.shifted_from or layout.deleted_row or other_sheets):
+            return None
+
+        def remap(row, absolute, other_sheet):
+            if other_sheet:
+                return other_sheet_row(other_sheets, other_sheet, row, absolute, shift)
+            current = layout.out_row(row) if row <= done_row else row + inserted
+            if not absolute:
+                current += shift
+            if current > out_row:
+                # Still a source row below the current one
+                current = layout.out_row(current - inserted)
+            return layout.final_row(current)
+        return remap
+
+    def out_row(self, src_row):
+        """Row of ``src_row`` once every row was inserted, before the delete."""
+        return src_row + bisect_right(self.shifted_from, src_row)
+
+    def final_row(self, out_row):
+        """Row after the trailing header was deleted, 0 for the deleted row."""
+        if out_row == self.deleted_row:
+            return 0
+        return self._after_delete(out_row)
+
+    def map_reference(self, row, absolute=True):
+        """Where a reference from another sheet to ``row`` points, 0 if deleted."""
+        return self.final_row(self.out_row(row))
+
+    def targets(self, src_row):
+        """Return the ``RowTarget`` list of a source row, like ``TransformPlan.targets``.
+
+        Record rows have a copy right below them and the header row one per
+        header copy. Only valid once the whole sheet was laid out.
+        """
+        rows = [self.out_row(src_row)]
+        index = bisect_left(self.copied_rows, src_row)
+        if index < len(self.copied_rows) and self.copied_rows[index] == src_row:
+            rows.append(rows[0] + 1)
+        if src_row == self.header_row:
+            rows.extend(self.header_copies)
+        return [
+            RowTarget(row, copy_index)
+            for copy_index, row in enumerate((self.final_row(row) for row in rows), -1) if row
+        ]
+
+    def cell_targets(self, src_row):
+        """``targets`` of the cell contents, nothing for the rows that were cleared."""
+        index = bisect_left(self.cleared_rows, src_row)
+        if index < len(self.cleared_rows) and self.cleared_rows[index] == src_row:
+            return []
+        return self.targets(src_row)
+
+    def _track(self, src_row, out_row, kind):
+        if src_row in self._tracked:
+            self.placements.setdefault(src_row, []).append((out_row, kind))
+
+    # Output with the trailing header check
+
+    def _write_row(self, node, has_cells):
+        """Write a row, holding back the last used row and what follows it."""
+        if has_cells:
+            self._flush_held()
+        if has_cells or self._held:
+            self._held.append((node, has_cells))
+        else:
+            self.writer.node(node)
+
+    def _flush_held(self):
+        for node, _ in self._held:
+            self.writer.node(node)
+        self._held = []
+
+    def _finish_rows(self):
+        if self.state == CLEAR:
+            self._emit_cleared(self.next_row)
+
+        if self.header_row and self._held:
+            last, _ = self._held[0]
+            last_row = int(last.attrs.get("r", 0))
+            header_key = self._cell_fill(self.header_node, self.start_col)
+            if last_row > self.header_row and self._cell_fill(last, self.start_col) == header_key:
+                # Remove extra header if it was added at the end of the sheet
+                self.deleted_row = last_row
+                self._held.pop(0)
+                for node, _ in self._held:
+                    node.attrs["r"] = str(int(node.attrs["r"]) - 1)
+
+        self._flush_held()
+
+    # Elements after sheetData
+
+    def _out_row(self, src_row):
+        placements = self.placements.get(src_row)
+        if placements:
+            return self._after_delete(placements[0][0])
+        return self._after_delete(src_row + self.delta)
+
+    def _remap_suffix(self, node):
+        copies = []
+        if node.tag in ("mergeCells", "hyperlinks"):
+            copies = self._copy_single_row_refs(node)
+
+        for element in node.iter():
+            for key in ("ref", "sqref"):
+                if key in element.attrs:
+                    element.attrs[key] = remap_ref(element.attrs[key], self._out_row)
+
+        node.children.extend(copies)
+        if node.tag == "mergeCells":
+            node.attrs["count"] = str(len(node.elements()))
+
+    def _copy_single_row_refs(self, node):
+        """Repeat merges and hyperlinks of a single row on its copies.
+
+        Merges and hyperlinks of cleared rows are dropped together with the
+        row contents.
+        """
+        copies = []
+        for element in node.elements():
+            ref = element.attrs.get("ref", "")
+            rows = {int(row) for row in _ROW_NUMBER_RE.findall(ref)}
+            if len(rows) != 1:
+                continue
+            src_row = rows.pop()
+            placements = self.placements.get(src_row, [])
+            if placements and placements[0][1] == "cleared":
+                node.children.remove(element)
+                continue
+
+            targets = [out_row for out_row, kind in placements[1:] if kind == "copy"]
+            if src_row == self.header_row and self._within_header(ref):
+                targets.extend(self.header_copies)
+            for out_row in targets:
+                copy = element.copy()
+                copy.attrs["ref"] = remap_ref(
+                    ref, lambda row, out_row=out_row: self._after_delete(out_row)
+                )
+                copies.append(copy)
+        return copies
+
+    def _after_delete(self, out_row):
+        if self.deleted_row and out_row > self.deleted_row:
+            return out_row - 1
+        return out_row
+
+    def _within_header(self, ref):
+        cols = [split_cell_ref(part)[0] for part in ref.split(":") if split_cell_ref(part)]
+        return all(self.start_col <= col <= self.end_col for col in cols)
+
+    # Cell helpers
+
+    def _has_header_color(self, node):
+        cols_count = self.cols_count or float("inf")
+        for cell in node.elements():
+            if split_cell_ref(cell.attrs["r"])[0] > cols_count:
+                continue
+            if int(cell.attrs.get("s", 0)) in self.header_styles:
+                return True
+        return False
+
+    def _has_data(self, node):
+        for cell in node.elements():
+            col = split_cell_ref(cell.attrs["r"])[0]
+            if self.start_col <= col <= self.end_col and _has_value(cell):
+                return True
+        return False
+
+    def _cell_fill(self, node, col):
+        for cell in node.elements():
+            if split_cell_ref(cell.attrs["r"])[0] == col:
+                return self._style_fill(cell.attrs.get("s"))
+        if node.attrs.get("customFormat") in ("1", "true"):
+            return self._style_fill(node.attrs.get("s"))
+        return self._style_fill(None)
+
+    def _style_fill(self, style):
+        index = int(style) if style else 0
+        if index < len(self.fill_keys):
+            return self.fill_keys[index]
+        return NO_FILL
+
+
+class PlanApplier(SheetRewriter):
+    """Apply a V2 ``TransformPlan`` to a worksheet part in a single pass.
+
+    Copies of a group are held back until the rows in front of them have
+    been written, so memory is bounded by the size of the largest group.
+    """
+
+    def __init__(self, writer, plan, sheet_name=None, other_sheets=None):
+        super().__init__(writer)
+        self.plan = plan
+        self.sheet_name = sheet_name
+        self.other_sheets = other_sheets
+        self._pending = []
+
+    def _handle_row(self, node, src_row):
+        targets = self.plan.targets(src_row)
+        if not targets:
+            return
+
+        self._flush_pending(targets[0].row)
+        # Copies are taken before the original is rewritten in place
+        rows = [node if target.copy_index < 0 else node.copy() for target in targets]
+        for target, row in zip(targets, rows):
+            self._move_row(row, src_row, target)
+            if target.copy_index < 0:
+                self.writer.node(row)
+            else:
+                heapq.heappush(self._pending, (target.row, len(self._pending), row))
+
+    def _flush_pending(self, before_row=None):
+        while self._pending and (before_row is None or self._pending[0][0] < before_row):
+            self.writer.node(heapq.heappop(self._pending)[2])
+
+    def _finish_rows(self):
+        self._flush_pending()
+
+    def _move_row(self, node, src_row, target):
+        node.attrs["r"] = str(target.row)
+        for cell in node.elements():
+            col, _ = split_cell_ref(cell.attrs["r"])
+            cell.attrs["r"] = f"{column_letter(col)}{target.row}"
+            formula = cell.find("f")
+            if formula is None:
+                continue
+            text = formula.text()
+            if text:
+                _set_formula(formula, self.plan.rewrite_formula(
+                    text, target, col, self.sheet_name, self.other_sheets
+                ))
+            _shift_formula_ref(formula, target.row - src_row)
+
+    def _remap_suffix(self, node):
+        copies = []
+        if node.tag in ("mergeCells", "hyperlinks"):
+            for element in node.elements():
+                ref = element.attrs.get("ref", "")
+                rows = {int(row) for row in _ROW_NUMBER_RE.findall(ref)}
+                if len(rows) != 1:
+                    continue
+                src_row = rows.pop()
+                for target in self.plan.targets(src_row)[1:]:
+                    copy = element.copy()
+                    copy.attrs["ref"] = remap_ref(ref, lambda row, target=target: target.row)
+                    copies.append(copy)
+
+        for element in node.iter():
+            for key in ("ref", "sqref"):
+                if key in element.attrs:
+                    element.attrs[key] = remap_ref(
+                        element.attrs[key],
+                        lambda row: self.plan.map_reference(row, True) or row
+                    )
+
+        node.children.extend(copies)
+        if node.tag == "mergeCells":
+            node.attrs["count"] = str(len(node.elements()))
+
+
+class ReferenceRewriter(SheetRewriter):
+    """Rows stay where they are, references into other sheets follow them."""
+
+    def __init__(self, writer, sheet_name, other_sheets):
+        super().__init__(writer)
+        self.sheet_name = sheet_name
+        self.other_sheets = other_sheets
+        self.formulas = 0
+
+    def _handle_row(self, node, src_row):
+        for cell in node.elements():
+            formula = cell.find("f")
+            text = formula.text() if formula is not None else ""
+            if "!" in text:
+                rewritten = rewrite_row_refs(text, self._remap, sheet_name=self.sheet_name)
+                if rewritten != text:
+                    self.formulas += 1
+                    _set_formula(formula, rewritten)
+        self.writer.node(node)
+
+    def _remap(self, row, absolute, other_sheet):
+        if other_sheet:
+            return other_sheet_row(self.other_sheets, other_sheet, row, True)
+        return row
+
+
+def _has_value(cell):
+    return any(child.tag in ("v", "is", "f") for child in cell.elements())
+
+
+def _set_formula(formula, text):
+    formula.children = [text] if text else []
+
+
+def _shift_formula_ref(formula, offset):
+    # Array formulas carry the range they spill into
+    if offset and "ref" in formula.attrs:
+        formula.attrs["ref"] = remap_ref(formula.attrs["ref"], lambda row: row + offset)
+
+
+def _anchored_parts(zf, sheet_parts, row_map):
+    """Map the drawing and comment parts of sheets to ``(rewrite, row_map)``.
+
+    ``row_map(part)`` is only asked for sheets that have such parts.
+    """
+    rewriters = {
+        DRAWING_REL: rewrite_drawing,
+        COMMENTS_REL: rewrite_comments,
+        VML_DRAWING_REL: rewrite_vml,
+    }
+    parts = {}
+    for part in sheet_parts:
+        anchored = [
+            (rewriters[rel_type], target) for rel_type, target in part_rels(zf, part).values()
+            if rel_type in rewriters and target in zf.NameToInfo
+        ]
+        sheet_map = row_map(part) if anchored else None
+        if sheet_map is None:
+            continue
+        for rewrite, target in anchored:
+            parts[target] = (rewrite, sheet_map)
+    return parts
+
+
+def rewrite_drawing(data, row_map):
+    """Move the anchors of a drawing part the way ``row_map`` moves rows.
+
+    ``row_map`` is a ``TransformPlan`` or a ``SheetRestructurer`` layout.
+
+    Anchors follow the row of their top left corner; anchors in duplicated
+    rows are copied and anchors in removed rows are dropped. Chart frames
+    are moved but not copied, a copy would need its own chart part.
+    """
+    root = parse_document(data)
+    next_id = max(
+        [int(node.attrs.get("id", 0)) for node in root.iter() if node.tag == "cNvPr"] or [0]
+    ) + 1
+
+    children = []
+    for child in root.children:
+        anchors = _anchors(child)
+        if not anchors:
+            children.append(child)
+            continue
+
+        row = anchors[0][0] + 1
+        targets = row_map.targets(row)
+        if not targets or targets[0].copy_index >= 0:
+            continue
+
+        copyable = not any(node.tag == "graphicFrame" for node in child.iter())
+        for target in targets[1:] if copyable else ():
+            copy = child.copy()
+            _shift_anchors(_anchors(copy), target.row - row)
+            for node in copy.iter():
+                if node.tag == "cNvPr":
+                    node.attrs["id"] = str(next_id)
+                    next_id += 1
+            children.append(copy)
+
+        _shift_anchors(anchors, targets[0].row - row)
+        children.append(child)
+
+    root.children = children
+    return document_bytes(root)
+
+
+def rewrite_comments(data, row_map):
+    """Move the comments of a comments part the way ``row_map`` moves rows.
+
+    Comments of duplicated rows are copied, comments of removed or cleared
+    rows are dropped.
+    """
+    root = parse_document(data)
+    for comment_list in root.elements():
+        if comment_list.tag != "commentList":
+            continue
+        children = []
+        for comment in comment_list.elements():
+            ref = split_cell_ref(comment.attrs.get("ref"))
+            if ref is None:
+                children.append(comment)
+                continue
+            col, row = ref
+            targets = row_map.cell_targets(row)
+            if not targets or targets[0].copy_index >= 0:
+                continue
+            comment.attrs["ref"] = f"{column_letter(col)}{targets[0].row}"
+            children.append(comment)
+            for target in targets[1:]:
+                copy = comment.copy()
+                copy.attrs["ref"] = f"{column_letter(col)}{target.row}"
+                # Revision ids must stay unique
+                for key in [key for key in copy.attrs if key.endswith(":uid")]:
+                    del copy.attrs[key]
+                children.append(copy)
+        comment_list.children = children
+    return document_bytes(root)
+
+
+def rewrite_vml(data, row_map):
+    """Move the comment shapes of a legacy VML drawing like ``rewrite_comments``.
+
+    VML written by Excel is not always well formed XML, so the shapes are
+    edited as text. Note shapes name their cell in ``<x:Row>`` and follow
+    its comment; other shapes only move with the row of their anchor.
+    """
+    next_id = max([int(m.group(2)) for m in _VML_SHAPE_ID_RE.finditer(data)] or [1024]) + 1
+
+    def shift(shape, delta):
+        shape = _VML_ROW_RE.sub(lambda m: m.group(1) + b"%d" % (int(m.group(2)) + delta), shape)
+
+        def anchor(match):
+            values = match.group(2).split(b",")
+            for index in (2, 6):
+                if index < len(values):
+                    values[index] = b" %d" % (int(values[index]) + delta)
+            return match.group(1) + b",".join(values)
+        return _VML_ANCHOR_RE.sub(anchor, shape)
+
+    def repl(match):
+        nonlocal next_id
+        shape = match.group(0)
+        note = _VML_ROW_RE.search(shape)
+        anchor = _VML_ANCHOR_RE.search(shape)
+        if note:
+            row = int(note.group(2)) + 1
+        elif anchor and len(anchor.group(2).split(b",")) > 2:
+            row = int(anchor.group(2).split(b",")[2]) + 1
+        else:
+            return shape
+
+        targets = row_map.cell_targets(row) if note else row_map.targets(row)
+        if not targets or targets[0].copy_index >= 0:
+            return b""
+        shapes = [shift(shape, targets[0].row - row)]
+        for target in targets[1:] if note else ():
+            copy = _VML_SHAPE_ID_RE.sub(lambda m: m.group(1) + b'%d"' % next_id, shape, 1)
+            next_id += 1
+            shapes.append(shift(copy, target.row - row))
+        return b"".join(shapes)
+
+    return _VML_SHAPE_RE.sub(repl, data)
+
+
+def _anchors(node):
+    """Return ``[(from_row, [row_nodes])]`` for the anchors within ``node``."""
+    if not isinstance(node, Node):
+        return []
+    anchors = []
+    for element in node.iter():
+        if element.tag not in ("twoCellAnchor", "oneCellAnchor"):
+            continue
+        rows = []
+        for marker in element.elements():
+            if marker.tag in ("from", "to"):
+                rows.extend(child for child in marker.elements() if child.tag == "row")
+        if rows:
+            anchors.append((int(rows[0].text()), rows))
+    return anchors
+
+
+def _shift_anchors(anchors, delta):
+    for _, rows in anchors:
+        for row in rows:
+            row.children = [str(int(row.text()) + delta)]
+
+
+class _NullWriter:
+    """Writer of the layout pass, everything written is dropped."""
+
+    def declaration(self, version, encoding, standalone):
+        pass
+
+    def start(self, name, attrs):
+        pass
+
+    def end(self, name):
+        pass
+
+    def node(self, node):
+        pass
+
+    def flush(self):
+        pass
+
+
+def _prescan(zf, part, check=None):
+    """Collect rows referenced by ``ref``/``sqref`` after ``<sheetData>``.
+
+    Also tells whether any cell holds a formula. Returns ``(rows, has_formulas)``.
+    """
+    tail = b""
+    found = False
+    has_formulas = False
+    with zf.open(part) as stream:
+        while True:
+            if check:
+                check()
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if found:
+                tail += chunk
+                continue
+            data = tail + chunk
+            match = _SHEET_DATA_END_RE.search(data)
+            if not has_formulas:
+                has_formulas = bool(_FORMULA_RE.search(data, 0, match.start() if match else len(data)))
+            if match:
+                found = True
+                tail = data[match.end():]
+            else:
+                tail = data[-32:]
+
+    rows = set()
+    if found:
+        for value in _REF_ATTR_RE.findall(tail):
+            rows.update(int(row) for row in _ROW_NUMBER_RE.findall(value.decode("utf-8")))
+    return rows, has_formulas
+
+
+def _formula_sheets(zf, part, check=None):
+    """Lower case names of the sheets the formulas of a worksheet part name."""
+    names = set()
+    tail = b""
+    with zf.open(part) as stream:
+        while True:
+            if check:
+                check()
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = tail + chunk
+            # Formulas at the end may be cut, the tail is searched again
+            for match in _FORMULA_TEXT_RE.finditer(data):
+                names |= referenced_sheets(_xml_text(match.group(1)))
+            tail = data[-_FORMULA_TAIL:]
+    return names
+
+
+def _xml_text(data):
+    return unescape(data.decode("utf-8", "replace"), {"&quot;": '"', "&apos;": "'"})
+
+
+def _defined_names(zf):
+    root = ET.fromstring(zf.read(WORKBOOK_PART))
+    return [node.text or "" for node in root.iter(f"{{{MAIN_NS}}}definedName")]
+
+
+def rewrite_defined_names(data, other_sheets):
+    """Make the defined names of ``xl/workbook.xml`` follow ``other_sheets``."""
+    root = parse_document(data)
+    for node in root.iter():
+        if node.tag == "definedName" and "!" in node.text():
+            node.children = [rewrite_row_refs(
+                node.text(),
+                lambda row, absolute, sheet: other_sheet_row(other_sheets, sheet, row, True)
+                if sheet else row
+            )]
+    return document_bytes(root)
+
+
+def _drop_calc_chain(data):
+    text = data.decode("utf-8")
+    text = re.sub(r'<Override[^>]*PartName="/xl/calcChain\.xml"[^>]*/>', "", text)
+    text = re.sub(r'<Relationship[^>]*Target="[^"]*calcChain\.xml"[^>]*/>', "", text)
+    return text.encode("utf-8")
@@ -1,5 +1,8 @@
-import re
+from cancellation import NO_CANCEL
 from logger import get_logger
+from com_scan import ComShapeIndex, ComSheetScan, as_grid
+from ooxml import column_letter
+from transform_plan import LEN_RE, build_plan, find_blocks, find_blocks_from_masks
 
 
 class ExcelProcessorV2:
@@ -7,124 +10,122 @@ class ExcelProcessorV2:
         self.config = config
         self.logger = get_logger()
         self._progress_callback = None
+        self._cancel_token = NO_CANCEL
 
     def set_progress_callback(self, callback):
-        self._progress_callback = callback
+        """Report groups done per sheet, at most every ``progress.MIN_INTERVAL``."""
+        from progress import Throttle
+        self._progress_callback = Throttle(callback) if callback else None
+
+    def set_cancel_token(self, token):
+        """Check ``token`` between groups and while rows are read cell by cell."""
+        self._cancel_token = token or NO_CANCEL
 
     def can_process(self, sheet):
         used_range = sheet.UsedRange
         if not used_range:
             return False
 
+        if self.config.bulk_scan:
+            scan = ComSheetScan(sheet, self.config.header_color, max_rows=49)
+            return sum(scan.header_mask()) >= 2
+
         yellow_headers_count = 0
 
         for row in range(1, min(50, used_range.Rows.Count + 1)):
-            for col in range(1, min(10, used_range.Columns.Count + 1)):
-                cell = sheet.Cells(row, col)
-                if cell.Interior.Color == self.config.header_color and self._normalize_value(cell.Value):
-                    yellow_headers_count += 1
-                    break
+            if self._is_header_row(sheet, row, used_range.Columns.Count):
+                yellow_headers_count += 1
 
         return yellow_headers_count >= 2
 
+    def plan_sheet(self, sheet):
+        """Scan ``sheet`` once and return its ``TransformPlan`` or ``None``."""
+        used_range = sheet.UsedRange
+        scan = None
+        removed_rows = ()
+        if self.config.bulk_scan:
+            scan = ComSheetScan(sheet, self.config.header_color)
+            removed_rows = scan.duplicate_header_rows()
+
+        blocks = self._find_all_blocks(sheet, used_range, scan)
+        if not blocks:
+            return None
+
+        last_row = used_range.Row + used_range.Rows.Count - 1
+        return build_plan(blocks, last_row, removed_rows=removed_rows)
+
     def process_sheet(self, sheet):
         self.logger.info(f"Processing sheet '{sheet.Name}' with V2 method")
 
         used_range = sheet.UsedRange
-        blocks = self._find_all_blocks(sheet, used_range)
+        plan = self.plan_sheet(sheet)
 
-        if not blocks:
+        if plan is None:
             self.logger.info("No data blocks found")
             return
 
         sheet.Application.ScreenUpdating = False
         sheet.Application.Calculation = -4135
 
-        total_groups = sum(len(block['data_groups']) for block in blocks)
+        total_groups = len(plan.groups)
         processed_groups = 0
+        shapes = self._index_shapes(sheet)
 
-        for block in reversed(blocks):
-            for group in reversed(block['data_groups']):
-                self._duplicate_block_rows(sheet, block, used_range, group)
-                processed_groups += 1
+        # Inserting bottom-up keeps the planned source rows valid for the
+        # groups that are still to be processed
+        for group in reversed(plan.groups):
+            self._cancel_token.check()
+            self._duplicate_block_rows(sheet, used_range, group, shapes)
+            processed_groups += 1
 
-                if self._progress_callback:
-                    self._progress_callback(processed_groups, total_groups)
+            if self._progress_callback:
+                self._progress_callback(processed_groups, total_groups)
 
         sheet.Application.Calculation = -4105
         sheet.Application.ScreenUpdating = True
         # After duplicating all blocks Excel may end up with copied header
         # rows at the bottom of the sheet. These duplicated headers serve no
         # purpose and confuse users when exporting the result. Remove any
-        # stray header rows that appear after the first data block.
-        self._remove_duplicate_headers(sheet)
+        # stray header rows that appear after the first data block. A bulk
+        # scan already found them, and their copies, while planning.
+        if self.config.bulk_scan:
+            self._delete_rows(sheet, plan.removed_pre_rows)
+        else:
+            self._remove_duplicate_headers(sheet)
 
-        self.logger.info(f"Processed {len(blocks)} blocks")
+        self.logger.info(f"Processed {total_groups} groups")
+
+    def _find_all_blocks(self, sheet, used_range, scan=None):
+        if scan is None and self.config.bulk_scan:
+            scan = ComSheetScan(sheet, self.config.header_color)
+        if scan is not None:
+            return find_blocks_from_masks(scan.header_mask(), scan.data_mask())
 
-    def _find_all_blocks(self, sheet, used_range):
-        blocks = []
-        current_row = 1
         last_row = used_range.Row + used_range.Rows.Count - 1
         cols_count = used_range.Columns.Count
 
-        while current_row <= last_row:
-            is_header = False
-            for col in range(1, min(10, cols_count + 1)):
-                cell = sheet.Cells(current_row, col)
-                if cell.Interior.Color == self.config.header_color and self._normalize_value(cell.Value):
-                    is_header = True
-                    break
+        def has_data(row):
+            self._cancel_token.check()
+            for col in range(1, cols_count + 1):
+                cell = sheet.Cells(row, col)
+                if self._normalize_value(cell.Value) or cell.HasFormula:
+                    return True
+            return False
 
-            if is_header:
-                block = {
-                    'header_row': current_row,
-                    'data_groups': []
-                }
-
-                current_row += 1
-                current_group = []
-
-                while current_row <= last_row:
-                    is_next_header = False
-                    for col in range(1, min(10, cols_count + 1)):
-                        if sheet.Cells(current_row, col).Interior.Color == self.config.header_color and \
-                                self._normalize_value(sheet.Cells(current_row, col).Value):
-                            is_next_header = True
-                            break
-
-                    if is_next_header:
-                        if current_group:
-                            block['data_groups'].append(current_group)
-                        break
-
-                    has_data = False
-                    for col in range(1, cols_count + 1):
-                        cell = sheet.Cells(current_row, col)
-                        if self._normalize_value(cell.Value) or cell.HasFormula:
-                            has_data = True
-                            break
-
-                    if not has_data:
-                        if current_group:
-                            block['data_groups'].append(current_group)
-                            current_group = []
-                        current_row += 1
-                        break
-                    else:
-                        current_group.append(current_row)
-                        current_row += 1
-
-                if current_group:
-                    block['data_groups'].append(current_group)
-
-                if block['data_groups']:
-                    blocks.append(block)
-            else:
-                current_row += 1
+        return find_blocks(
+            last_row,
+            lambda row: self._is_header_row(sheet, row, cols_count),
+            has_data
+        )
 
-        return blocks
+    def _is_header_row(self, sheet, row, cols_count, max_cols=9):
+        for col in range(1, min(max_cols, cols_count) + 1):
+            cell = sheet.Cells(row, col)
+            if cell.Interior.Color == self.config.header_color and self._normalize_value(cell.Value):
+                return True
+        return False
 
-    def _duplicate_block_rows(self, sheet, block, used_range, group):
+    def _duplicate_block_rows(self, sheet, used_range, group, shapes=None):
         cols_count = used_range.Columns.Count
 
         if not group:
@@ -133,52 +134,81 @@ class ExcelProcessorV2:
         group_size = len(group)
 
         insert_row = group[-1] + 1
-        for _ in range(group_size):
-            sheet.Rows(insert_row).Insert(Shift=-4121)
-
-        for i, source_row in enumerate(group):
-            target_row = insert_row + i
+        last_target = insert_row + group_size - 1
+        target_rows = f"{insert_row}:{last_target}"
 
-            sheet.Rows(source_row).Copy()
-            sheet.Rows(target_row).PasteSpecial(-4104)
+        # One insert for the whole group and one copy straight into the new
+        # rows; Copy with a Destination does not go through the clipboard
+        sheet.Rows(target_rows).Insert(Shift=-4121)
+        sheet.Rows(f"{group[0]}:{group[-1]}").Copy(Destination=sheet.Rows(target_rows))
 
-            for col in range(1, cols_count + 1):
-                cell = sheet.Cells(target_row, col)
-                if cell.HasFormula:
-                    formula = cell.Formula
-                    if "LEN(" in formula.upper() or "ДЛСТР(" in formula.upper():
-                        col_letter = sheet.Cells(1, col).Address.split("$")[1]
-                        if i > 0:
-                            ref_row = target_row - 1
-                        else:
-                            ref_row = target_row
-                        formula = re.sub(
-                            r'(LEN|ДЛСТР)\s*\([^)]+\)',
-                            rf'\1({col_letter}{ref_row})',
-                            formula,
-                            flags=re.IGNORECASE
-                        )
-                        cell.Formula = formula
+        self._fix_len_formulas(sheet, insert_row, last_target, cols_count)
 
-        self._copy_shapes_in_range(sheet, group[0], group[-1], insert_row)
+        if shapes is None:
+            shapes = self._index_shapes(sheet)
+        if shapes:
+            shapes.insert_rows(insert_row, group_size)
+            self._copy_shapes_in_range(sheet, shapes, group[0], group[-1], insert_row)
 
-        sheet.Application.CutCopyMode = False
+    def _fix_len_formulas(self, sheet, first_row, last_row, cols_count):
+        """Point copied ``LEN(`` formulas at their own column.
 
-    def _copy_shapes_in_range(self, sheet, start_row, end_row, target_start_row):
-        try:
-            for shape in sheet.Shapes:
-                shape_row = shape.TopLeftCell.Row
-                if start_row <= shape_row <= end_row:
-                    row_offset = shape_row - start_row
+        The copied rows are read with a single ``Formula`` call. Corrected
+        formulas are written back one run of formula cells per column at a
+        time, so constants in between are never rewritten (writing them back
+        through ``Formula`` would re-parse them like typed input).
+        """
+        target = sheet.Range(f"A{first_row}:{column_letter(cols_count)}{last_row}")
+        formulas = as_grid(target.Formula)
+
+        for col in range(1, cols_count + 1):
+            col_letter = column_letter(col)
+            run_start = None
+            run = []
+            changed = False
+
+            for i in range(len(formulas) + 1):
+                formula = formulas[i][col - 1] if i < len(formulas) else None
+                if isinstance(formula, str) and formula.startswith("="):
+                    if run_start is None:
+                        run_start, run, changed = i, [], False
+                    upper = formula.upper()
+                    if "LEN(" in upper or "ДЛСТР(" in upper:
+                        target_row = first_row + i
+                        ref_row = target_row - 1 if i > 0 else target_row
+                        formula = LEN_RE.sub(
+                            lambda m: f"{m.group(1)}({col_letter}{ref_row})", formula
+                        )
+                        changed = True
+                    run.append((formula,))
+                    continue
 
-                    shape.Copy()
-                    sheet.Paste()
+                if run_start is not None and changed:
+                    start = first_row + run_start
+                    end = start + len(run) - 1
+                    sheet.Range(f"{col_letter}{start}:{col_letter}{end}").Formula = tuple(run)
+                run_start = None
 
-                    new_shape = sheet.Shapes(sheet.Shapes.Count)
+    def _index_shapes(self, sheet):
+        try:
+            return ComShapeIndex(sheet)
+        except Exception as e:
+            self.logger.warning(f"Error reading shapes: {e}")
+            return ComShapeIndex()
 
-                    target_cell = sheet.Cells(target_start_row + row_offset, shape.TopLeftCell.Column)
-                    new_shape.Top = target_cell.Top + (shape.Top - shape.TopLeftCell.Top)
-                    new_shape.Left = target_cell.Left + (shape.Left - shape.TopLeftCell.Left)
+    def _copy_shapes_in_range(self, sheet, shapes, start_row, end_row, target_start_row):
+        row_tops = {}
+        try:
+            for shape_row, entry in list(shapes.shapes_in(start_row, end_row)):
+                target_row = target_start_row + shape_row - start_row
+                if target_row not in row_tops:
+                    row_tops[target_row] = sheet.Rows(target_row).Top
+
+                # Duplicate places the copy next to the original without
+                # going through the clipboard; only its position is fixed up
+                new_shape = entry['shape'].Duplicate()
+                new_shape.Top = row_tops[target_row] + entry['top_offset']
+                new_shape.Left = entry['left']
         except Exception as e:
             self.logger.warning(f"Error copying shapes: {e}")
 
@@ -196,6 +226,10 @@ class ExcelProcessorV2:
         the sheet. This helper scans rows below the first header and deletes
         any rows that exactly match the header's contents and color.
         """
+        if self.config.bulk_scan:
+            self._remove_duplicate_headers_bulk(sheet)
+            return
+
         used_range = sheet.UsedRange
         last_row = used_range.Row + used_range.Rows.Count - 1
         cols_count = used_range.Columns.Count
@@ -222,6 +256,7 @@ class ExcelProcessorV2:
 
         # Walk from bottom upwards and remove duplicated headers
         for row in range(last_row, header_row, -1):
+            self._cancel_token.check()
             is_header = True
             for col in range(1, cols_count + 1):
                 cell = sheet.Cells(row, col)
@@ -232,3 +267,35 @@ class ExcelProcessorV2:
 
             if is_header:
                 sheet.Rows(row).Delete()
+
+    def _remove_duplicate_headers_bulk(self, sheet):
+        scan = ComSheetScan(sheet, self.config.header_color)
+        self._delete_rows(sheet, scan.duplicate_header_rows())
+
+    def _delete_rows(self, sheet, rows, max_address=255):
+        """Delete ``rows`` with as few union-range ``Delete`` calls as possible.
+
+        Consecutive rows are merged into ``a:b`` areas. Excel limits a range
+        address to 255 characters, so longer unions are split into chunks
+        that are deleted bottom-up to keep the remaining row numbers valid.
+        """
+        areas = []
+        for row in sorted(rows):
+            if areas and areas[-1][1] == row - 1:
+                areas[-1][1] = row
+            else:
+                areas.append([row, row])
+
+        chunks = [[]]
+        length = 0
+        for first, last in areas:
+            address = f"{first}:{last}"
+            if chunks[-1] and length + len(address) + 1 > max_address:
+                chunks.append([])
+                length = 0
+            chunks[-1].append(address)
+            length += len(address) + 1
+
+        for chunk in reversed(chunks):
+            if chunk:
+                sheet.Range(",".join(chunk)).Delete()
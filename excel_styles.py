@@ -0,0 +1,172 @@
+import colorsys
+import re
+import xml.etree.ElementTree as ET
+
+from ooxml import CHUNK_SIZE, MAIN_NS, REL_NS, part_rels
+
+DRAWING_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+STYLES_REL = REL_NS + "/styles"
+THEME_REL = REL_NS + "/theme"
+
+NO_FILL = "FFFFFF"  # Interior.Color of a cell without fill
+
+# Order of the theme palette as referenced by ``<color theme="n"/>``; Excel
+# swaps the first two pairs of the ``<a:clrScheme>`` order
+THEME_COLOR_NAMES = (
+    "lt1", "dk1", "lt2", "dk2", "accent1", "accent2", "accent3",
+    "accent4", "accent5", "accent6", "hlink", "folHlink",
+)
+
+# Default palette of ``<color indexed="n"/>``, the same as openpyxl's
+# COLOR_INDEX; importing openpyxl only for it slows every start down
+INDEXED_COLORS = (
+    "000000", "FFFFFF", "FF0000", "00FF00", "0000FF", "FFFF00", "FF00FF", "00FFFF",
+    "000000", "FFFFFF", "FF0000", "00FF00", "0000FF", "FFFF00", "FF00FF", "00FFFF",
+    "800000", "008000", "000080", "808000", "800080", "008080", "C0C0C0", "808080",
+    "9999FF", "993366", "FFFFCC", "CCFFFF", "660066", "FF8080", "0066CC", "CCCCFF",
+    "000080", "FF00FF", "FFFF00", "00FFFF", "800080", "800000", "008080", "0000FF",
+    "00CCFF", "CCFFFF", "CCFFCC", "FFFF99", "99CCFF", "FF99CC", "CC99FF", "FFCC99",
+    "3366FF", "33CCCC", "99CC00", "FFCC00", "FF9900", "FF6600", "666699", "969696",
+    "003366", "339966", "003300", "333300", "993300", "993366", "333399", "333333",
+)
+
+_STYLE_ATTR_RE = re.compile(rb'\ss="(\d+)"')
+
+
+class StyleResolver:
+    """Resolve the fill color of every ``cellXfs`` entry of a workbook.
+
+    ``styles.xml`` and the theme are parsed once; afterwards the fill of a
+    cell is a list lookup on its ``s=`` attribute and header detection is a
+    set lookup, see ``header_styles``. Theme colors and tints are resolved
+    the way Excel reports them through ``Interior.Color``.
+    """
+
+    def __init__(self, styles_xml=None, theme_xml=None):
+        self.theme_colors = read_theme_colors(theme_xml)
+        self.fill_keys = [NO_FILL]
+        if styles_xml:
+            self.fill_keys = self._read_fill_keys(ET.fromstring(styles_xml)) or [NO_FILL]
+
+    @classmethod
+    def from_zip(cls, zf):
+        styles_part, theme_part = "xl/styles.xml", "xl/theme/theme1.xml"
+        for rel_type, part in part_rels(zf, "xl/workbook.xml").values():
+            if rel_type == STYLES_REL:
+                styles_part = part
+            elif rel_type == THEME_REL:
+                theme_part = part
+
+        names = set(zf.namelist())
+        return cls(
+            zf.read(styles_part) if styles_part in names else None,
+            zf.read(theme_part) if theme_part in names else None,
+        )
+
+    def fill_key(self, style):
+        """Return the ``RRGGBB`` fill of a cell's ``s=`` attribute value."""
+        index = int(style) if style else 0
+        if index < len(self.fill_keys):
+            return self.fill_keys[index]
+        return NO_FILL
+
+    def header_styles(self, header_rgb):
+        """Return the set of ``cellXfs`` indices filled with ``header_rgb``."""
+        return {index for index, key in enumerate(self.fill_keys) if key == header_rgb}
+
+    def _read_fill_keys(self, root):
+        ns = {"m": MAIN_NS}
+        fills = []
+        for fill in root.findall("m:fills/m:fill", ns):
+            pattern = fill.find("m:patternFill", ns)
+            if pattern is None or pattern.get("patternType", "none") == "none":
+                fills.append(NO_FILL)
+                continue
+            color = pattern.find("m:fgColor", ns)
+            fills.append(None if color is None else self.color_key(color.attrib))
+
+        keys = []
+        for xf in root.findall("m:cellXfs/m:xf", ns):
+            fill_id = int(xf.get("fillId", 0))
+            keys.append(fills[fill_id] if fill_id < len(fills) else NO_FILL)
+        return keys
+
+    def color_key(self, attrs):
+        """Return ``RRGGBB`` for the attributes of a ``<color>`` element.
+
+        ``None`` stands for colors that cannot be resolved (``auto``, unknown
+        indices or theme slots).
+        """
+        rgb = None
+        if attrs.get("rgb"):
+            rgb = attrs["rgb"][-6:].upper()
+        elif attrs.get("indexed") is not None:
+            indexed = int(attrs["indexed"])
+            if indexed < len(INDEXED_COLORS):
+                rgb = INDEXED_COLORS[indexed]
+        elif attrs.get("theme") is not None:
+            theme = int(attrs["theme"])
+            if theme < len(self.theme_colors):
+                rgb = self.theme_colors[theme]
+
+        if rgb is None:
+            return None
+        return apply_tint(rgb, float(attrs.get("tint") or 0))
+
+
+def read_theme_colors(theme_xml):
+    """Return the ``RRGGBB`` theme palette in ``<color theme="n"/>`` order."""
+    if not theme_xml:
+        return []
+
+    root = ET.fromstring(theme_xml)
+    scheme = root.find(f".//{{{DRAWING_NS}}}clrScheme")
+    if scheme is None:
+        return []
+
+    colors = {}
+    for slot in scheme:
+        name = slot.tag.rsplit("}", 1)[-1]
+        for color in slot:
+            value = color.get("lastClr") or color.get("val")
+            if value and len(value) == 6:
+                colors[name] = value.upper()
+    return [colors.get(name, NO_FILL) for name in THEME_COLOR_NAMES]
+
+
+def apply_tint(rgb, tint):
+    """Lighten (``tint > 0``) or darken (``tint < 0``) an ``RRGGBB`` color."""
+    if not tint:
+        return rgb
+
+    red, green, blue = (int(rgb[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    hue, lightness, saturation = colorsys.rgb_to_hls(red, green, blue)
+    if tint < 0:
+        lightness *= 1 + tint
+    else:
+        lightness = lightness * (1 - tint) + tint
+    red, green, blue = colorsys.hls_to_rgb(hue, lightness, saturation)
+    return "".join(f"{round(channel * 255):02X}" for channel in (red, green, blue))
+
+
+def uses_styles(stream, styles):
+    """Whether a worksheet part references any of the ``styles`` indices.
+
+    Only the raw bytes are searched for ``s="n"`` attributes; nothing is
+    parsed. Cells without ``s=`` use style 0.
+    """
+    if 0 in styles:
+        return True
+    wanted = {str(index).encode() for index in styles}
+    if not wanted:
+        return False
+
+    tail = b""
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return False
+        data = tail + chunk
+        if any(match in wanted for match in _STYLE_ATTR_RE.findall(data)):
+            return True
+        tail = data[-32:]
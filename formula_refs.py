@@ -0,0 +1,141 @@
+import re
+
+from ooxml import column_index, column_letter
+
+# A1-style references with an optional sheet prefix, optionally followed by a
+# second corner (``A1:B2``), or whole-row ranges such as ``3:5``. Sheets of
+# other workbooks carry an ``[n]`` index.
+_REF_RE = re.compile(
+    r"""
+    (?<![\w.$:!'])
+    (?P<sheet>(?:'(?:[^']|'')+'|(?:\[\d+\])?[\w.]+)!)?
+    (?:
+        (?P<cabs>\$?)(?P<col>[A-Z]{1,3})(?P<rabs>\$?)(?P<row>\d+)
+        (?::(?P<cabs2>\$?)(?P<col2>[A-Z]{1,3})(?P<rabs2>\$?)(?P<row2>\d+))?
+      |
+        (?P<r1abs>\$?)(?P<r1>\d+):(?P<r2abs>\$?)(?P<r2>\d+)
+    )
+    (?![\w(!])
+    """,
+    re.VERBOSE,
+)
+
+MAX_ROW = 1048576
+MAX_COLUMN = 16384
+
+
+def rewrite_row_refs(formula, remap, col_remap=None, sheet_name=None):
+    """Rewrite the row numbers of every reference in ``formula``.
+
+    ``remap(row, absolute, other_sheet)`` returns the new row number for a
+    referenced row. ``other_sheet`` is the name of the sheet a reference
+    points into, or ``None`` for the sheet holding the formula: references
+    without a sheet and those naming ``sheet_name``. ``col_remap`` does the
+    same for column numbers of cell references. String literals are left
+    untouched.
+    """
+    if not formula or not isinstance(formula, str):
+        return formula
+
+    parts = formula.split('"')
+    # Even parts are outside of string literals
+    for i in range(0, len(parts), 2):
+        if parts[i]:
+            parts[i] = _REF_RE.sub(
+                lambda m: _rewrite_match(m, remap, col_remap, sheet_name), parts[i]
+            )
+    return '"'.join(parts)
+
+
+def referenced_sheets(formula):
+    """Return the lower case names of the sheets ``formula`` refers to by name."""
+    if not formula or "!" not in formula:
+        return set()
+    parts = formula.split('"')
+    return {
+        _sheet_name(match.group('sheet')).lower()
+        for part in parts[::2] for match in _REF_RE.finditer(part) if match.group('sheet')
+    }
+
+
+def _sheet_name(prefix):
+    """Sheet name of a reference prefix without quotes and ``!``.
+
+    Sheets of other workbooks keep their ``[n]``, which no sheet name of
+    this workbook can contain.
+    """
+    name = prefix[:-1]
+    if name.startswith("'"):
+        name = name[1:-1].replace("''", "'")
+    return name
+
+
+def shift_formula(formula, row_delta):
+    """Shift relative row references the way a copy/paste does."""
+    if not row_delta:
+        return formula
+    return rewrite_row_refs(
+        formula,
+        lambda row, absolute, other_sheet: row if absolute else row + row_delta
+    )
+
+
+def translate_formula(formula, row_delta, col_delta):
+    """Translate relative references, e.g. to expand a shared formula."""
+    if not col_delta:
+        return shift_formula(formula, row_delta)
+    return rewrite_row_refs(
+        formula,
+        lambda row, absolute, other_sheet: row if absolute else row + row_delta,
+        lambda col, absolute, other_sheet: col if absolute else col + col_delta,
+    )
+
+
+def remap_ref(ref, row_func):
+    """Remap the rows of a range string such as ``A1:C4`` or ``A1 B3:B5``."""
+    def repl(match):
+        new_row = row_func(int(match.group(2)))
+        return f"{match.group(1)}{new_row}"
+
+    return re.sub(r"(\$?[A-Z]{1,3}\$?)(\d+)", repl, ref)
+
+
+def _rewrite_match(match, remap, col_remap, sheet_name):
+    sheet = match.group('sheet') or ""
+    other_sheet = _sheet_name(sheet) if sheet else None
+    if other_sheet and sheet_name and other_sheet.lower() == sheet_name.lower():
+        other_sheet = None
+
+    def new_col(letters, abs_flag):
+        if col_remap is None:
+            return letters
+        col = col_remap(column_index(letters), bool(abs_flag), other_sheet)
+        if col < 1 or col > MAX_COLUMN:
+            return None
+        return column_letter(col)
+
+    def new_row(value, abs_flag):
+        row = remap(int(value), bool(abs_flag), other_sheet)
+        if row < 1 or row > MAX_ROW:
+            return None
+        return row
+
+    if match.group('col'):
+        row = new_row(match.group('row'), match.group('rabs'))
+        col = new_col(match.group('col'), match.group('cabs'))
+        if row is None or col is None:
+            return "#REF!"
+        text = f"{sheet}{match.group('cabs')}{col}{match.group('rabs')}{row}"
+        if match.group('col2'):
+            row2 = new_row(match.group('row2'), match.group('rabs2'))
+            col2 = new_col(match.group('col2'), match.group('cabs2'))
+            if row2 is None or col2 is None:
+                return "#REF!"
+            text += f":{match.group('cabs2')}{col2}{match.group('rabs2')}{row2}"
+        return text
+
+    row1 = new_row(match.group('r1'), match.group('r1abs'))
+    row2 = new_row(match.group('r2'), match.group('r2abs'))
+    if row1 is None or row2 is None:
+        return "#REF!"
+    return f"{sheet}{match.group('r1abs')}{row1}:{match.group('r2abs')}{row2}"
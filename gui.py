@@ -1,10 +1,13 @@
 # gui.py
+import logging
 import os
+import threading
 
 import traceback
+from collections import deque
 from pathlib import Path
 from PySide6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                               QPushButton, QListWidget, QTextEdit, QLabel,
+                               QPushButton, QListWidget, QPlainTextEdit, QLabel,
                                QProgressBar, QFileDialog, QFrame,
                                QListWidgetItem, QGroupBox,
                                QMessageBox)
@@ -12,12 +15,12 @@ from PySide6.QtCore import Qt, QThread, Signal, Slot, QUrl, QTimer
 from PySide6.QtGui import (QDragEnterEvent, QDropEvent, QAction, QActionGroup,
                            QDesktopServices, QIcon)
 
+from cancellation import CancelToken, ProcessingStopped
 from config import Config
-from logger import setup_logger
+from logger import add_sink, remove_sink, setup_logger
 from styles import MAIN_STYLE, ICON_PATH
 from updater import UpdateChecker, CURRENT_VERSION
 from translations import tr, set_language
-from error_dialog import ErrorReportDialog, FeedbackDialog
 from settings_manager import settings_manager
 
 
@@ -82,12 +85,74 @@ class FileListWidget(QListWidget):
         self.setObjectName("fileList")
 
 
+# Lines the log view keeps; the log file has the full history
+LOG_MAX_LINES = 5000
+# Interval of the log view refresh, 25 times a second
+LOG_FLUSH_MS = 40
+# Files processed at the same time offered in the menu; 0 uses every core
+WORKER_CHOICES = (1, 2, 4, 0)
+
+
+class LogView(QPlainTextEdit):
+    """Read-only log showing the last ``LOG_MAX_LINES`` lines.
+
+    ``append_line`` may be called from any thread. Lines are buffered and
+    appended in one batch every ``LOG_FLUSH_MS``, so a chatty run costs a
+    relayout per tick instead of one per line.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setMaximumBlockCount(LOG_MAX_LINES)
+        self._pending = deque(maxlen=LOG_MAX_LINES)
+        self._lock = threading.Lock()
+        self._timer = QTimer(self)
+        self._timer.setInterval(LOG_FLUSH_MS)
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
+
+    def append_line(self, text):
+        with self._lock:
+            self._pending.append(text)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            lines = list(self._pending)
+            self._pending.clear()
+        self.appendPlainText("\n".join(lines))
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+        super().clear()
+
+
+class GuiLogHandler(logging.Handler):
+    """Emit formatted records through a Qt signal; runs on the log listener thread."""
+
+    def __init__(self, signal):
+        super().__init__()
+        self.signal = signal
+        self.setFormatter(logging.Formatter('%(message)s'))
+
+    def emit(self, record):
+        try:
+            self.signal.emit(self.format(record))
+        except:
+            self.handleError(record)
+
+
 class ProcessorThread(QThread):
     progress = Signal(int)
     log_message = Signal(str)
     finished = Signal(dict)
     file_processing = Signal(str)
     sheet_progress = Signal(int, int)
+    throughput = Signal(float, float)  # rows per second and seconds left, -1 until known
 
     def __init__(self, files, config):
         super().__init__()
@@ -95,98 +160,129 @@ class ProcessorThread(QThread):
         self.config = config
         self.total_sheets = 0
         self.processed_sheets = 0
-        self.is_paused = False
-        self.should_stop = False
+        self.tracker = None
         self.current_file_index = 0
-        self._pause_lock = False
         self._last_error = None
         self._last_traceback = None
+        self.cancel_token = CancelToken()
+
+    @property
+    def is_paused(self):
+        return self.cancel_token.paused
+
+    @property
+    def should_stop(self):
+        return self.cancel_token.stopped
 
     def pause(self):
-        self.is_paused = True
-        self._pause_lock = True
+        self.cancel_token.pause()
+        if self.tracker:
+            self.tracker.pause()
 
     def resume(self):
-        self.is_paused = False
-        self._pause_lock = False
+        if self.tracker:
+            self.tracker.resume()
+        self.cancel_token.resume()
 
     def stop(self):
-        self.should_stop = True
-        self.is_paused = False
-        self._pause_lock = False
-
-    def count_sheets(self):
-        from excel_com import ExcelCOM
-        total = 0
-        with ExcelCOM() as excel:
-            for file in self.files:
+        self.cancel_token.stop()
+
+    def measure_work(self):
+        """``progress.FileWork`` of every file, to weigh the progress by rows."""
+        from progress import file_work
+        from triage import triage_workbook
+        work = {}
+        # Sheet and row counts come from the workbook and sheet XML; only
+        # files that are not OOXML packages (.xls, .xlsb) are opened in Excel
+        needs_excel = []
+        for file in self.files:
+            try:
+                triage = triage_workbook(file, self.config.header_color)
+            except:
+                triage = None
+            if triage is None:
+                needs_excel.append(file)
+            else:
+                work[str(file)] = file_work(triage)
+
+        if needs_excel:
+            # Reuses this process's Excel, which the com engine keeps for the files
+            from excel_pool import count_sheets, shared_pool
+            pool = shared_pool()
+            for file in needs_excel:
                 try:
-                    wb = excel.open_workbook(file)
-                    total += wb.Sheets.Count
-                    wb.Close(False)
+                    sheets = pool.run(count_sheets, file)
                 except:
-                    pass
-        return total
+                    sheets = 0
+                work[str(file)] = file_work(None, sheets)
+        return work
 
     def check_pause_stop(self):
-        if self.should_stop:
-            return False
-
-        while self.is_paused:
-            self.msleep(100)
-            if self.should_stop:
-                return False
-
-        return True
+        """Block while paused; ``False`` once stopped."""
+        return self.cancel_token.wait()
 
     def run(self):
+        # One log sink for the whole run, detached once its records are shown
+        gui_handler = GuiLogHandler(self.log_message)
+        add_sink(gui_handler)
+        try:
+            self._run()
+        finally:
+            remove_sink(gui_handler)
+
+    def _run(self):
         results = {"success": 0, "failed": 0, "output_folder": None}
 
-        self.total_sheets = self.count_sheets()
+        from progress import ProgressTracker
+        work = self.measure_work()
+        self.tracker = ProgressTracker(work)
+        self.total_sheets = sum(item.sheets for item in work.values())
         self.sheet_progress.emit(0, self.total_sheets)
 
+        from job_journal import JobJournal
+        self.journal = JobJournal(self.files, self.config)
+        self._resume(results)
+
+        from batch import resolve_workers
+        remaining = [file for file in self.files[self.current_file_index:]
+                     if not self.journal.is_done(file)]
+        if resolve_workers(self.config) > 1 and len(remaining) > 1:
+            self._run_batch(results, remaining)
+            if not self.should_stop:
+                self.journal.finish()
+            self._close_excel()
+            self.finished.emit(results)
+            return
+
         for i in range(self.current_file_index, len(self.files)):
             if not self.check_pause_stop():
                 break
 
             file = self.files[i]
             self.current_file_index = i
+            if self.journal.is_done(file):
+                continue
 
+            reported = [0]  # sheets the engine reported
             try:
                 self.file_processing.emit(Path(file).name)
 
                 from excel_processor import ExcelProcessor
                 processor = ExcelProcessor(self.config)
 
-                processor._pause_stop_checker = self.check_pause_stop
+                processor.set_cancel_token(self.cancel_token)
 
-                def sheet_completed_callback(current_sheet, total_sheets):
+                def sheet_completed_callback(current_sheet, total_sheets, file=file):
                     self.processed_sheets += 1
-                    progress = int((self.processed_sheets / self.total_sheets) * 100)
-                    self.progress.emit(progress)
-                    self.sheet_progress.emit(self.processed_sheets, self.total_sheets)
+                    reported[0] += 1
+                    if self.tracker.sheet_done(file, current_sheet, total_sheets):
+                        self._emit_progress()
 
                 processor.set_sheet_progress_callback(sheet_completed_callback)
 
-                import logging
-                class GuiLogHandler(logging.Handler):
-                    def __init__(self, thread):
-                        super().__init__()
-                        self.thread = thread
-
-                    def emit(self, record):
-                        msg = self.format(record)
-                        self.thread.log_message.emit(msg)
-
-                        if "searching for header" in msg or "processing group" in msg:
-                            if not self.thread.check_pause_stop():
-                                raise Exception("Processing stopped by user")
-
-                gui_handler = GuiLogHandler(self)
-                gui_handler.setFormatter(logging.Formatter('%(message)s'))
-                processor.logger.addHandler(gui_handler)
-
                 processor.process_file(file)
+                self.journal.file_done(file, True, sheets=max(reported[0], self.tracker.sheets(file)))
+                self._file_finished(file, reported[0])
                 results["success"] += 1
 
                 if not results["output_folder"]:
@@ -194,24 +290,97 @@ class ProcessorThread(QThread):
                     if output_folder.exists():
                         results["output_folder"] = str(output_folder)
 
+            except ProcessingStopped:
+                break
             except Exception as e:
-                if "stopped by user" in str(e):
-                    break
-                else:
-                    self.log_message.emit(f"Error in {Path(file).name}: {str(e)}")
-                    results["failed"] += 1
-
-                    if "stopped by user" not in str(e):
-                        self._last_error = str(e)
-                        self._last_traceback = traceback.format_exc()
+                self.log_message.emit(f"Error in {Path(file).name}: {str(e)}")
+                self.journal.file_done(file, False, str(e))
+                self._file_finished(file, reported[0])
+                results["failed"] += 1
+                self._last_error = str(e)
+                self._last_traceback = traceback.format_exc()
+        else:
+            self.journal.finish()
 
+        self._close_excel()
         self.finished.emit(results)
 
+    def _file_finished(self, file, reported_sheets):
+        # The VBScript and files copied unchanged report no sheets
+        self.processed_sheets += max(self.tracker.sheets(file) - reported_sheets, 0)
+        if self.tracker.file_done(file):
+            self._emit_progress()
+
+    def _emit_progress(self):
+        snapshot = self.tracker.snapshot()
+        self.progress.emit(snapshot.percent)
+        if self.total_sheets:
+            self.sheet_progress.emit(min(self.processed_sheets, self.total_sheets),
+                                     self.total_sheets)
+        if snapshot.rows_per_second is not None:
+            self.throughput.emit(snapshot.rows_per_second, snapshot.eta_seconds)
+
+    def _close_excel(self):
+        # A hidden Excel left running could be handed the files the user
+        # opens from Explorer
+        from excel_pool import close_shared_pool
+        close_shared_pool()
+
+    def _resume(self, results):
+        """Count the files an interrupted run of this batch already processed."""
+        done = self.journal.done_files(self.files)
+        if not done:
+            return
+        self.log_message.emit(
+            f"Resuming the previous run: {len(done)} of {len(self.files)} files already processed"
+        )
+        for file in done:
+            results["success"] += 1
+            self.processed_sheets += self.journal.sheets_done(file)
+            self.tracker.skip(file)
+            output_folder = Path(file).parent / "Deeva"
+            if not results["output_folder"] and output_folder.exists():
+                results["output_folder"] = str(output_folder)
+        self._emit_progress()
+
+    def _run_batch(self, results, files):
+        """Process ``files`` in worker processes."""
+        from batch import iter_batch
+
+        def sheet_completed(file, current_sheet, total_sheets):
+            self.processed_sheets += 1
+            if self.tracker.sheet_done(file, current_sheet, total_sheets):
+                self._emit_progress()
+
+        for result in iter_batch(files, self.config, cancel_token=self.cancel_token,
+                                 sheet_callback=sheet_completed):
+            self.current_file_index += 1
+            name = Path(result["file"]).name
+            self.file_processing.emit(name)
+            sheets = result["sheets"]
+            if result["ok"]:
+                sheets = max(sheets, self.tracker.sheets(result["file"]))
+            self.journal.file_done(result["file"], result["ok"], result["error"], sheets)
+            if result["ok"]:
+                results["success"] += 1
+                self.log_message.emit(f"Processed {name} in {result['seconds']:.1f}s")
+                if not results["output_folder"]:
+                    results["output_folder"] = result["output_folder"]
+            else:
+                results["failed"] += 1
+                self.log_message.emit(f"Error in {name}: {result['error']}")
+                self._last_error = result["error"]
+                self._last_traceback = result["traceback"]
+
+            # Its sheets were counted as the worker reported them
+            self._file_finished(result["file"], result["sheets"])
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.config = Config()
+        self.config.workers = settings_manager.get_workers()
         self.logger = setup_logger()
         self.files = []
         self.updater = UpdateChecker(self)
@@ -320,9 +489,8 @@ class MainWindow(QMainWindow):
 
         content_layout.addLayout(buttons_layout)
 
-        self.log_text = QTextEdit()
+        self.log_text = LogView()
         self.log_text.setObjectName("logText")
-        self.log_text.setReadOnly(True)
         content_layout.addWidget(self.log_text)
 
         self.summary_label = QLabel("")
@@ -373,6 +541,17 @@ class MainWindow(QMainWindow):
         self.feedback_action.triggered.connect(self.show_feedback_dialog)
         self.help_menu.addAction(self.feedback_action)
 
+        self.workers_menu = menubar.addMenu('')
+        workers_group = QActionGroup(self)
+        self.worker_actions = {}
+        for workers in WORKER_CHOICES:
+            action = QAction(str(workers), self, checkable=True)
+            action.setChecked(workers == self.config.workers)
+            action.triggered.connect(lambda checked=False, workers=workers: self.set_workers(workers))
+            workers_group.addAction(action)
+            self.workers_menu.addAction(action)
+            self.worker_actions[workers] = action
+
         # Language menu
         self.language_menu = menubar.addMenu('')
         lang_group = QActionGroup(self)
@@ -395,6 +574,12 @@ class MainWindow(QMainWindow):
         self.lang_ru.setChecked(lang == 'ru')
         self.apply_translations()
 
+    def set_workers(self, workers):
+        self.config.workers = workers
+        settings_manager.set_workers(workers)
+        for value, action in self.worker_actions.items():
+            action.setChecked(value == workers)
+
     def apply_translations(self):
         self.setWindowTitle(tr('app_title'))
         self.file_menu.setTitle(tr('menu_file'))
@@ -404,6 +589,8 @@ class MainWindow(QMainWindow):
         self.update_action.setText(tr('menu_check_updates'))
         self.about_action.setText(tr('menu_about'))
         self.feedback_action.setText(tr('menu_contact_developer'))
+        self.workers_menu.setTitle(tr('menu_parallel_files'))
+        self.worker_actions[0].setText(tr('workers_all'))
         self.language_menu.setTitle(tr('menu_language'))
         self.lang_en.setText(tr('lang_en'))
         self.lang_ru.setText(tr('lang_ru'))
@@ -461,10 +648,13 @@ class MainWindow(QMainWindow):
 
         self.thread = ProcessorThread(self.files, self.config)
         self.thread.progress.connect(self.progress_bar.setValue)
-        self.thread.log_message.connect(self.log_text.append)
+        # Buffered by the view in the sending thread, no event per line
+        self.thread.log_message.connect(self.log_text.append_line, Qt.DirectConnection)
         self.thread.finished.connect(self.on_process_finished)
         self.thread.file_processing.connect(self.on_file_processing)
         self.thread.sheet_progress.connect(self.on_sheet_progress)
+        self.thread.throughput.connect(self.on_throughput)
+        self._sheets_text = self._rate_text = ""
         self.thread.start()
 
     def toggle_pause(self):
@@ -473,12 +663,12 @@ class MainWindow(QMainWindow):
                 self.thread.resume()
                 self.pause_btn.setText("⏸")
                 self.status_label.setText(tr('processing_resumed'))
-                self.log_text.append(">>> " + tr('processing_resumed'))
+                self.log_text.append_line(">>> " + tr('processing_resumed'))
             else:
                 self.thread.pause()
                 self.pause_btn.setText("▶")
                 self.status_label.setText(tr('stopping'))
-                self.log_text.append(">>> " + tr('stopping'))
+                self.log_text.append_line(">>> " + tr('stopping'))
 
     def stop_processing(self):
         if self.thread and self.thread.isRunning():
@@ -492,7 +682,7 @@ class MainWindow(QMainWindow):
             if reply == QMessageBox.Yes:
                 self.thread.stop()
                 self.status_label.setText(tr('processing_paused'))
-                self.log_text.append(">>> " + tr('processing_paused'))
+                self.log_text.append_line(">>> " + tr('processing_paused'))
 
     def on_file_processing(self, filename):
         self.status_label.setText(tr('processing', filename=filename))
@@ -500,7 +690,17 @@ class MainWindow(QMainWindow):
         self.processed_list.addItem(item)
 
     def on_sheet_progress(self, processed, total):
-        self.progress_label.setText(tr('sheets_progress', processed=processed, total=total))
+        self._sheets_text = tr('sheets_progress', processed=processed, total=total)
+        self._update_progress_label()
+
+    def on_throughput(self, rows_per_second, eta_seconds):
+        from progress import format_duration
+        self._rate_text = tr('progress_rate', rows=f"{rows_per_second:,.0f}",
+                             eta=format_duration(eta_seconds))
+        self._update_progress_label()
+
+    def _update_progress_label(self):
+        self.progress_label.setText(" · ".join(filter(None, [self._sheets_text, self._rate_text])))
 
     @Slot(dict)
     def on_process_finished(self, results):
@@ -524,12 +724,12 @@ class MainWindow(QMainWindow):
 
         if hasattr(self.thread, 'should_stop') and self.thread.should_stop:
             self.status_label.setText(tr('processing_stopped'))
-            self.log_text.append(">>> " + tr('processing_stopped'))
+            self.log_text.append_line(">>> " + tr('processing_stopped'))
         else:
             self.status_label.setText(
                 tr('completed', success=results['success'], failed=results['failed'])
             )
-            self.log_text.append(">>> " + tr('completed', success=results['success'], failed=results['failed']))
+            self.log_text.append_line(">>> " + tr('completed', success=results['success'], failed=results['failed']))
 
             if results['failed'] > 0 and hasattr(self.thread, '_last_error'):
                 reply = QMessageBox.question(
@@ -543,6 +743,7 @@ class MainWindow(QMainWindow):
                     error_msg = self.thread._last_error
                     if hasattr(self.thread, '_last_traceback'):
                         error_msg = self.thread._last_traceback
+                    from error_dialog import ErrorReportDialog
                     dialog = ErrorReportDialog(self, error_msg)
                     dialog.exec()
 
@@ -560,5 +761,6 @@ class MainWindow(QMainWindow):
         )
 
     def show_feedback_dialog(self):
+        from error_dialog import FeedbackDialog
         dialog = FeedbackDialog(self)
         dialog.exec()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+JOURNAL_DIR = Path("journal")
+
+
+class JobJournal:
+    """Append-only on-disk record of a batch, so that it can be resumed.
+
+    A batch is identified by its files and the settings that shape the
+    output; starting the same batch again reads the journal back and
+    ``is_done`` reports the files that were already processed. Only the
+    outcome of each file is recorded: an output package is complete only
+    once every sheet was written, so a file interrupted part-way is
+    processed again from the start. Every record is one JSON line written
+    and synced immediately, so a crash loses at most the line being
+    written, which is ignored on reading.
+    """
+
+    def __init__(self, files, config, folder=JOURNAL_DIR):
+        identity = json.dumps([sorted(str(file) for file in files), config.engine,
+                               config.header_color])
+        batch_id = hashlib.sha256(identity.encode()).hexdigest()[:16]
+        self.path = Path(folder) / f"batch_{batch_id}.jsonl"
+        # A dry run processes nothing, so it neither records nor resumes
+        self.enabled = not config.dry_run
+        self._files = {}  # file -> last "file" record
+        self._torn_line = False
+        self._load()
+
+    def is_done(self, file):
+        """Whether ``file`` was processed successfully and has not changed since."""
+        record = self._files.get(str(file))
+        return bool(record and record["ok"] and record["stamp"] == _stamp(file))
+
+    def done_files(self, files):
+        return [file for file in files if self.is_done(file)]
+
+    def sheets_done(self, file):
+        """Sheets recorded with the last outcome of ``file``."""
+        record = self._files.get(str(file))
+        return record.get("sheets", 0) if record else 0
+
+    def file_done(self, file, ok, error=None, sheets=0):
+        """Record the outcome of ``file`` and the sheets it went through."""
+        record = {"event": "file", "file": str(file), "ok": ok, "error": error,
+                  "sheets": sheets, "stamp": _stamp(file)}
+        self._files[str(file)] = record
+        self._append(record)
+
+    def finish(self):
+        """Forget the batch once every file went through."""
+        if not self.enabled:
+            return
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+
+    def _load(self):
+        if not self.enabled:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+
+        self._torn_line = bool(lines) and not lines[-1].endswith("\n")
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("event") == "file":
+                self._files[record.get("file")] = record
+
+    def _append(self, record):
+        if not self.enabled:
+            return
+        self.path.parent.mkdir(exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self._torn_line:
+                # Terminate a line cut short by a crash
+                f.write("\n")
+                self._torn_line = False
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _stamp(file):
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
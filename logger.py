@@ -1,9 +1,32 @@
+import atexit
 import logging
+import os
+import queue
+import threading
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
+LOGGER_NAME = "excel_processor"
+
+_listener = None
+_sinks = ()  # the file and console handlers of setup_logger
+
+
+def setup_logger(level=logging.INFO):
+    """Log to a timestamped file and the console through a background thread.
+
+    The logger only puts records on a queue; a ``QueueListener`` thread
+    formats and writes them, so the engines never wait for the disk or the
+    console. Records below ``level`` are rejected before they are built.
+    Calling it again only changes the level.
+    """
+    global _listener, _sinks
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    if _listener is not None:
+        return logger
 
-def setup_logger():
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
 
@@ -20,13 +43,140 @@ def setup_logger():
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
 
-    logger = logging.getLogger("excel_processor")
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-
+    _sinks = (file_handler, console_handler)
+    _start_listener(logger)
+    atexit.register(stop_logging)
     return logger
 
 
 def get_logger():
-    return logging.getLogger("excel_processor")
\ No newline at end of file
+    return logging.getLogger(LOGGER_NAME)
+
+
+def add_sink(handler):
+    """Send the records logged from now on to ``handler`` too, on the listener thread."""
+    if _listener is None:
+        get_logger().addHandler(handler)
+    else:
+        _listener.queue.put(_SinkChange(handler, add=True))
+
+
+def remove_sink(handler):
+    """Detach and close ``handler`` once the records queued before got to it.
+
+    Returns when it is detached, so that nothing reaches it afterwards.
+    """
+    listener = _listener
+    if listener is None:
+        get_logger().removeHandler(handler)
+        handler.close()
+        return
+    change = _SinkChange(handler, add=False)
+    listener.queue.put(change)
+    while not change.applied.wait(0.1):
+        if _listener is not listener:
+            # Logging was stopped meanwhile, the handler went with it
+            break
+
+
+def stop_logging():
+    """Write out the queued records and stop the listener thread."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    logger = get_logger()
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def forward_worker_logs(log_queue):
+    """Hand the records worker processes put on ``log_queue`` to this process's sinks.
+
+    Workers send their records with ``log_to_queue``. Returns a function
+    that stops forwarding once the records queued before were handled.
+    """
+    def forward():
+        while True:
+            record = log_queue.get()
+            if record is None:
+                break
+            get_logger().handle(record)
+
+    thread = threading.Thread(target=forward, name="worker-logs", daemon=True)
+    thread.start()
+
+    def stop():
+        log_queue.put(None)
+        thread.join()
+    return stop
+
+
+def log_to_queue(log_queue, level):
+    """Send the records of this worker process to its parent through ``log_queue``.
+
+    Works the same whether the worker was forked or spawned; a spawned
+    worker never ran ``setup_logger`` and would otherwise log nowhere.
+    """
+    global _listener
+    _listener = None
+    logger = get_logger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(level)
+
+
+class _SinkChange:
+    """Queued with the records, so a sink sees exactly the records logged while attached."""
+
+    def __init__(self, handler, add):
+        self.handler = handler
+        self.add = add
+        self.applied = threading.Event()
+
+
+class _Listener(QueueListener):
+    def handle(self, record):
+        if not isinstance(record, _SinkChange):
+            super().handle(record)
+            return
+        if record.add:
+            self.handlers += (record.handler,)
+        else:
+            self.handlers = tuple(h for h in self.handlers if h is not record.handler)
+            record.handler.close()
+        record.applied.set()
+
+
+def _start_listener(logger):
+    global _listener
+    records = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(records))
+    _listener = _Listener(records, *_sinks, respect_handler_level=True)
+    _listener.start()
+
+
+def _log_directly_in_child():
+    # A forked worker inherits the queue but not the listener thread, and
+    # exits without running atexit; it writes to the file and console
+    # itself. Sinks added by the parent, like the GUI, stay behind; batch
+    # workers reach them through log_to_queue.
+    global _listener
+    if _listener is None:
+        return
+    _listener = None
+    logger = get_logger()
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    for handler in _sinks:
+        logger.addHandler(handler)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_log_directly_in_child)
@@ -1,4 +1,5 @@
 import sys
+from multiprocessing import freeze_support
 from PySide6.QtWidgets import QApplication
 from gui import MainWindow
 
@@ -9,4 +10,6 @@ def main():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    # Worker processes of batch.py re-run this module in frozen builds
+    freeze_support()
     main()
\ No newline at end of file
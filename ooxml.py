@@ -0,0 +1,307 @@
+import posixpath
+import re
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+WORKSHEET_REL = REL_NS + "/worksheet"
+DRAWING_REL = REL_NS + "/drawing"
+COMMENTS_REL = REL_NS + "/comments"
+VML_DRAWING_REL = REL_NS + "/vmlDrawing"
+# Parts of a sheet that hold row positions of their own
+ANCHORED_RELS = (DRAWING_REL, COMMENTS_REL, VML_DRAWING_REL)
+
+CHUNK_SIZE = 64 * 1024
+
+_CELL_REF_RE = re.compile(r"^\$?([A-Za-z]{1,3})\$?(\d+)$")
+
+
+def local_name(name):
+    return name.rsplit(":", 1)[-1]
+
+
+def column_index(letters):
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + ord(char) - 64
+    return index
+
+
+def column_letter(index):
+    letters = ""
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def split_cell_ref(ref):
+    """Return ``(column, row)`` for a reference such as ``B12``."""
+    match = _CELL_REF_RE.match(ref or "")
+    if not match:
+        return None
+    return column_index(match.group(1)), int(match.group(2))
+
+
+def worksheet_parts(zf):
+    """Return ``[(sheet_name, part_name), ...]`` in workbook order."""
+    rels = _read_rels(zf, "xl/workbook.xml")
+    root = ET.fromstring(zf.read("xl/workbook.xml"))
+    parts = []
+    for sheet in root.iter(f"{{{MAIN_NS}}}sheet"):
+        rel = rels.get(sheet.get(f"{{{REL_NS}}}id"))
+        if rel and rel[0] == WORKSHEET_REL:
+            parts.append((sheet.get("name"), rel[1]))
+    return parts
+
+
+def _read_rels(zf, part_name):
+    folder, name = posixpath.split(part_name)
+    rels_name = posixpath.join(folder, "_rels", name + ".rels")
+    if rels_name not in zf.namelist():
+        return {}
+
+    rels = {}
+    root = ET.fromstring(zf.read(rels_name))
+    for rel in root.iter(f"{{{PKG_REL_NS}}}Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        rels[rel.get("Id")] = (rel.get("Type"), resolve_target(folder, rel.get("Target")))
+    return rels
+
+
+def resolve_target(folder, target):
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(folder, target))
+
+
+def part_rels(zf, part_name):
+    """Return ``{rel_id: (type, part_name)}`` for a package part."""
+    return _read_rels(zf, part_name)
+
+
+class Node:
+    """Minimal element tree that keeps prefixed names and attribute order."""
+
+    __slots__ = ("name", "attrs", "children")
+
+    def __init__(self, name, attrs=None, children=None):
+        self.name = name
+        self.attrs = attrs if attrs is not None else {}
+        self.children = children if children is not None else []
+
+    @property
+    def tag(self):
+        return local_name(self.name)
+
+    def find(self, tag):
+        for child in self.children:
+            if isinstance(child, Node) and child.tag == tag:
+                return child
+        return None
+
+    def elements(self):
+        return [child for child in self.children if isinstance(child, Node)]
+
+    def text(self):
+        return "".join(child for child in self.children if isinstance(child, str))
+
+    def copy(self):
+        return Node(
+            self.name,
+            dict(self.attrs),
+            [child.copy() if isinstance(child, Node) else child for child in self.children],
+        )
+
+    def iter(self):
+        yield self
+        for child in self.children:
+            if isinstance(child, Node):
+                yield from child.iter()
+
+
+def _escape_text(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _escape_attr(value):
+    return (
+        _escape_text(value)
+        .replace('"', "&quot;")
+        .replace("\n", "&#10;")
+        .replace("\r", "&#13;")
+        .replace("\t", "&#9;")
+    )
+
+
+class XmlWriter:
+    """Buffered writer emitting raw XML to a binary stream."""
+
+    def __init__(self, stream, buffer_size=CHUNK_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+
+    def raw(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def declaration(self, version, encoding, standalone):
+        text = f'<?xml version="{version or "1.0"}" encoding="{encoding or "UTF-8"}"'
+        if standalone != -1:
+            text += f' standalone="{"yes" if standalone else "no"}"'
+        self.raw(text + "?>\n")
+
+    def start(self, name, attrs):
+        self.raw(self._open_tag(name, attrs) + ">")
+
+    def end(self, name):
+        self.raw(f"</{name}>")
+
+    def data(self, text):
+        self.raw(_escape_text(text))
+
+    def node(self, node):
+        self.raw(serialize(node))
+
+    def flush(self):
+        if self._parts:
+            self.stream.write("".join(self._parts).encode("utf-8"))
+            self._parts = []
+            self._size = 0
+
+    @staticmethod
+    def _open_tag(name, attrs):
+        if not attrs:
+            return f"<{name}"
+        return f"<{name} " + " ".join(
+            f'{key}="{_escape_attr(value)}"' for key, value in attrs.items()
+        )
+
+
+def serialize(node):
+    parts = []
+    _serialize(node, parts)
+    return "".join(parts)
+
+
+def _serialize(node, parts):
+    parts.append(XmlWriter._open_tag(node.name, node.attrs))
+    if not node.children:
+        parts.append("/>")
+        return
+    parts.append(">")
+    for child in node.children:
+        if isinstance(child, Node):
+            _serialize(child, parts)
+        else:
+            parts.append(_escape_text(child))
+    parts.append(f"</{node.name}>")
+
+
+def parse_document(data):
+    """Parse a small XML part, such as a drawing, into a ``Node`` tree."""
+    stack = []
+    result = []
+
+    def start(name, attrs):
+        node = Node(name, attrs)
+        if stack:
+            stack[-1].children.append(node)
+        else:
+            result.append(node)
+        stack.append(node)
+
+    def data_handler(text):
+        if stack:
+            stack[-1].children.append(text)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = lambda name: stack.pop()
+    parser.CharacterDataHandler = data_handler
+    parser.Parse(data, True)
+    return result[0]
+
+
+def document_bytes(root):
+    """Serialize a ``Node`` tree as a standalone XML part."""
+    declaration = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    return (declaration + serialize(root)).encode("utf-8")
+
+
+class SheetStreamParser:
+    """Stream a worksheet part through expat.
+
+    Elements outside ``<sheetData>`` at depth one are collected into
+    ``Node`` trees and handed to ``on_element``; every ``<row>`` is handed to
+    ``on_row``. ``on_start``/``on_end`` receive the worksheet root and the
+    ``sheetData`` element themselves. Only one row (or one top level
+    element) is held in memory at a time.
+    """
+
+    def __init__(self, on_declaration, on_start, on_end, on_element, on_row):
+        self.on_declaration = on_declaration
+        self.on_start = on_start
+        self.on_end = on_end
+        self.on_element = on_element
+        self.on_row = on_row
+        self._stack = []
+        self._depth = 0
+
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.buffer_size = CHUNK_SIZE
+        parser.XmlDeclHandler = self._declaration
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._data
+        self._parser = parser
+
+    def parse(self, stream):
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self._parser.Parse(chunk, False)
+        self._parser.Parse(b"", True)
+
+    def _declaration(self, version, encoding, standalone):
+        self.on_declaration(version, encoding, standalone)
+
+    def _start(self, name, attrs):
+        self._depth += 1
+        tag = local_name(name)
+        if self._stack:
+            node = Node(name, attrs)
+            self._stack[-1].children.append(node)
+            self._stack.append(node)
+        elif self._depth == 1 or (self._depth == 2 and tag == "sheetData"):
+            self.on_start(name, attrs)
+        else:
+            self._stack.append(Node(name, attrs))
+
+    def _end(self, name):
+        self._depth -= 1
+        if self._stack:
+            node = self._stack.pop()
+            if not self._stack:
+                if self._depth == 2:
+                    self.on_row(node)
+                else:
+                    self.on_element(node)
+        else:
+            self.on_end(name)
+
+    def _data(self, text):
+        # Whitespace between top level elements is not kept
+        if self._stack:
+            self._stack[-1].children.append(text)
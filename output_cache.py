@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from ooxml import ANCHORED_RELS, CHUNK_SIZE, MAIN_NS, part_rels, worksheet_parts
+
+# Bump whenever an engine writes different output for the same input, so
+# that outputs of older versions are not reused
+ENGINE_VERSION = 1
+
+MANIFEST_NAME = ".deeva-cache.json"
+SHEETS_MANIFEST_NAME = ".deeva-sheets.json"
+
+_SHARED_STRING_RE = re.compile(rb'\st="s"[^>]*>\s*<(?:\w+:)?v>(\d+)<')
+_SHARED_TYPE_RE = re.compile(rb'\st="s"')
+
+
+def cache_key(source_path, config):
+    """Key of an output: the input bytes and everything that shapes the result."""
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE * 16), b""):
+            digest.update(chunk)
+    return f"{digest.hexdigest()}-{_settings_key(config)}"
+
+
+def _settings_key(config):
+    return f"{config.engine}-v{ENGINE_VERSION}-{config.header_color}"
+
+
+def link_or_copy(source, target):
+    """Materialize ``source`` at ``target`` as a hardlink, or a copy if that fails."""
+    target = Path(target)
+    if target.exists() or target.is_symlink():
+        target.unlink()
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class _JsonManifest:
+    """A JSON object in a file, replaced atomically on every save."""
+
+    def __init__(self, manifest_path):
+        self.manifest_path = Path(manifest_path)
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except:
+            return {}
+
+    def _save(self, manifest):
+        temp_path = self.manifest_path.with_name(f"{self.manifest_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+
+class OutputCache(_JsonManifest):
+    """Manifest of earlier outputs, keyed by ``cache_key``.
+
+    Without ``store_dir`` the manifest lives in the output folder and points
+    at the outputs already there. With ``store_dir`` (``Config.cache_dir``)
+    every output is also linked into that folder under its key, so the same
+    input is reused across output folders too. Entries remember the size
+    and mtime of the file they point at; a file that was edited or deleted
+    since is a miss.
+    """
+
+    def __init__(self, output_folder, store_dir=None):
+        self.output_folder = Path(output_folder)
+        self.store_dir = Path(store_dir) if store_dir else None
+        super().__init__((self.store_dir or self.output_folder) / MANIFEST_NAME)
+
+    def lookup(self, key):
+        """Return the path of a valid cached output for ``key`` or ``None``."""
+        entry = self._load().get(key)
+        if not entry:
+            return None
+        path = Path(entry["path"])
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            return None
+        return path
+
+    def materialize(self, key, output_file):
+        """Put the cached output for ``key`` at ``output_file``; ``False`` on a miss."""
+        cached = self.lookup(key)
+        if cached is None:
+            return False
+        if not _same_file(cached, output_file):
+            link_or_copy(cached, output_file)
+        return True
+
+    def store(self, key, output_file):
+        """Record ``output_file`` as the output for ``key``."""
+        path = Path(output_file)
+        if self.store_dir:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            stored = self.store_dir / f"{key}{path.suffix}"
+            link_or_copy(path, stored)
+            path = stored
+
+        stat = path.stat()
+        # Re-read right before writing to keep what other processes stored
+        manifest = self._load()
+        manifest[key] = {
+            "path": str(path.resolve()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        self._save(manifest)
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+class SheetManifest(_JsonManifest):
+    """Per-sheet fingerprints of the outputs in one output folder.
+
+    Entries remember the size and mtime of the output they describe, so an
+    output written or edited since is never trusted.
+    """
+
+    def __init__(self, output_folder):
+        super().__init__(Path(output_folder) / SHEETS_MANIFEST_NAME)
+
+    def get(self, output_name, output_file):
+        """Fingerprints of ``output_file``, ``{}`` unless it is the output they describe."""
+        entry = self._load().get(output_name)
+        if not isinstance(entry, dict) or "sheets" not in entry:
+            return {}
+        try:
+            stat = Path(output_file).stat()
+        except OSError:
+            return {}
+        if entry.get("output") != [stat.st_size, stat.st_mtime_ns]:
+            return {}
+        return entry["sheets"]
+
+    def set(self, output_name, fingerprints, output_file=None):
+        """Record the fingerprints of ``output_file``; ``None`` forgets the entry."""
+        manifest = self._load()
+        if fingerprints is None:
+            if manifest.pop(output_name, None) is None:
+                return
+        else:
+            stat = Path(output_file).stat()
+            manifest[output_name] = {
+                "output": [stat.st_size, stat.st_mtime_ns],
+                "sheets": fingerprints,
+            }
+        self._save(manifest)
+
+
+def sheet_fingerprints(zf, config):
+    """Fingerprint every worksheet part of an open package.
+
+    A fingerprint covers everything the processed sheet depends on: the
+    part itself, its relationships, drawings and comments, the text of the shared
+    strings it uses, styles and theme, and the engine settings. Returns
+    ``{part: hexdigest}``.
+    """
+    common = hashlib.sha256(_settings_key(config).encode())
+    for name in sorted(zf.NameToInfo):
+        if name == "xl/styles.xml" or name.startswith("xl/theme/"):
+            common.update(name.encode())
+            common.update(zf.read(name))
+
+    shared = None
+    fingerprints = {}
+    for _, part in worksheet_parts(zf):
+        if part not in zf.NameToInfo:
+            continue
+        digest = common.copy()
+        indexes, complete = _hash_sheet_part(zf, part, digest)
+
+        rels = part_rels(zf, part)
+        for rel_id, (rel_type, target) in sorted(rels.items()):
+            digest.update(f"{rel_id}:{rel_type}:{target}".encode())
+            if rel_type in ANCHORED_RELS and target in zf.NameToInfo:
+                digest.update(zf.read(target))
+
+        if indexes and not complete:
+            # Some shared string cells were not recognized; depend on all
+            digest.update(zf.read("xl/sharedStrings.xml"))
+        elif indexes:
+            if shared is None:
+                shared = _shared_strings(zf)
+            for index in indexes:
+                digest.update(b"\0" + shared[index].encode() if index < len(shared) else b"\1")
+
+        fingerprints[part] = digest.hexdigest()
+    return fingerprints
+
+
+def _hash_sheet_part(zf, part, digest):
+    """Feed a part into ``digest`` and collect its shared string indexes.
+
+    Returns the indexes and whether every ``t="s"`` cell was understood.
+    """
+    indexes = []
+    types = 0
+    buffer = b""
+    with zf.open(part) as stream:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            digest.update(chunk)
+            buffer += chunk
+            # Matches are short; the tail is kept for the next round
+            cut = len(buffer) if not chunk else max(0, len(buffer) - 256)
+            for match in _SHARED_STRING_RE.finditer(buffer):
+                if match.start() < cut:
+                    indexes.append(int(match.group(1)))
+            types += sum(1 for match in _SHARED_TYPE_RE.finditer(buffer) if match.start() < cut)
+            buffer = buffer[cut:]
+            if not chunk:
+                break
+    return indexes, len(indexes) == types
+
+
+def _shared_strings(zf):
+    if "xl/sharedStrings.xml" not in zf.NameToInfo:
+        return []
+
+    ns = {"m": MAIN_NS}
+    strings = []
+    with zf.open("xl/sharedStrings.xml") as stream:
+        for _, element in ET.iterparse(stream):
+            if element.tag == f"{{{MAIN_NS}}}si":
+                texts = element.findall("m:t", ns) + element.findall("m:r/m:t", ns)
+                strings.append("".join(text.text or "" for text in texts))
+                element.clear()
+    return strings
@@ -0,0 +1,162 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+# Least time between two progress updates; the bar needs no more than a
+# few per second and every update is a queued signal to the GUI thread
+MIN_INTERVAL = 0.25
+# Work needed before a rate and a remaining time are worth showing
+WARMUP_SECONDS = 2.0
+
+
+@dataclass
+class FileWork:
+    rows: int  # rows the file's sheets span, from the pre-scan
+    sheets: int
+    rows_known: bool = True  # False when the file needs Excel to be read
+
+
+def file_work(triage, sheets=0):
+    """``FileWork`` of a ``triage.WorkbookTriage``; ``None`` only gives ``sheets``."""
+    if triage is None:
+        return FileWork(0, sheets, rows_known=False)
+    rows = sum(max(sheet.rows, 1) for sheet in triage.sheets)
+    return FileWork(rows, triage.sheet_count)
+
+
+@dataclass
+class ProgressSnapshot:
+    fraction: float  # of the weighted work, 0 to 1
+    rows_per_second: Optional[float]
+    eta_seconds: Optional[float]
+
+    @property
+    def percent(self):
+        return int(self.fraction * 100)
+
+
+class ProgressTracker:
+    """Progress of a run weighted by the rows of each file.
+
+    A file of 50 000 rows moves the bar as much as fifty files of 1 000
+    rows; within a file progress moves as its sheets complete. Files the
+    pre-scan could not read (``.xls``) weigh the average rows per sheet of
+    the others. The rate only counts the work of this run and the time it
+    was not paused, so resumed batches do not inflate it.
+
+    ``sheet_done`` and ``file_done`` return whether a snapshot is due, so
+    callers send one at most every ``min_interval`` seconds.
+    """
+
+    def __init__(self, work, min_interval=MIN_INTERVAL, clock=time.monotonic):
+        self.min_interval = min_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._weights = _weights(work)
+        self._sheets = {file: item.sheets for file, item in work.items()}
+        self.total = sum(self._weights.values())
+        self._done = {}  # file -> weight done
+        self._skipped = 0.0  # work done by an earlier run
+        self._started = clock()
+        self._paused_at = None
+        self._paused_for = 0.0
+        self._last_update = None
+
+    def sheets(self, file):
+        return self._sheets.get(str(file), 0)
+
+    def skip(self, file):
+        """Count ``file`` as done by an earlier run."""
+        with self._lock:
+            weight = self._weights.get(str(file), 0)
+            self._skipped += weight - self._done.get(str(file), 0)
+            self._done[str(file)] = weight
+
+    def sheet_done(self, file, done, total):
+        """``done`` of the ``total`` sheets of ``file`` are complete."""
+        with self._lock:
+            weight = self._weights.get(str(file), 0)
+            if total:
+                self._done[str(file)] = max(self._done.get(str(file), 0),
+                                            weight * min(done, total) / total)
+            return self._due(force=False)
+
+    def file_done(self, file):
+        """``file`` went through, whether or not its engine reported sheets."""
+        with self._lock:
+            self._done[str(file)] = self._weights.get(str(file), 0)
+            return self._due(force=True)
+
+    def pause(self):
+        with self._lock:
+            if self._paused_at is None:
+                self._paused_at = self._clock()
+
+    def resume(self):
+        with self._lock:
+            if self._paused_at is not None:
+                self._paused_for += self._clock() - self._paused_at
+                self._paused_at = None
+
+    def snapshot(self):
+        with self._lock:
+            done = sum(self._done.values())
+            fraction = min(done / self.total, 1.0) if self.total else 0.0
+            now = self._paused_at if self._paused_at is not None else self._clock()
+            elapsed = now - self._started - self._paused_for
+            worked = done - self._skipped
+            if elapsed < WARMUP_SECONDS or worked <= 0:
+                return ProgressSnapshot(fraction, None, None)
+            rate = worked / elapsed
+            return ProgressSnapshot(fraction, rate, max(self.total - done, 0) / rate)
+
+    def _due(self, force):
+        now = self._clock()
+        if not force and self._last_update is not None \
+                and now - self._last_update < self.min_interval:
+            return False
+        self._last_update = now
+        return True
+
+
+class Throttle:
+    """Wrap ``callback(done, total)`` to call it at most every ``min_interval``.
+
+    The first and the final (``done == total``) calls always go through.
+    """
+
+    def __init__(self, callback, min_interval=MIN_INTERVAL, clock=time.monotonic):
+        self.callback = callback
+        self.min_interval = min_interval
+        self._clock = clock
+        self._last = None
+
+    def __call__(self, done, total):
+        now = self._clock()
+        if done < total and self._last is not None and now - self._last < self.min_interval:
+            return
+        self._last = now
+        self.callback(done, total)
+
+
+def format_duration(seconds):
+    """``1:05:09`` or ``5:09``."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def _weights(work):
+    rows = sheets = 0
+    for item in work.values():
+        if item.rows_known:
+            rows += item.rows
+            sheets += item.sheets
+    per_sheet = rows / sheets if sheets else 1
+    return {
+        str(file): max(item.rows if item.rows_known else item.sheets * per_sheet, 1)
+        for file, item in work.items()
+    }
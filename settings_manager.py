@@ -37,5 +37,11 @@ class SettingsManager:
     def set_language(self, language):
         self.set('language', language)
 
+    def get_workers(self):
+        return self.get('workers', 1)
+
+    def set_workers(self, workers):
+        self.set('workers', workers)
+
 
 settings_manager = SettingsManager()
\ No newline at end of file
@@ -0,0 +1,252 @@
+import io
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List
+
+from excel_colors import bgr_to_rgb
+from excel_styles import StyleResolver
+from ooxml import CHUNK_SIZE, MAIN_NS, SheetStreamParser, split_cell_ref, worksheet_parts
+from transform_plan import ChunkRuns, stitch_blocks
+
+# Uncompressed sheet XML handed to one scan task
+CHUNK_BYTES = 8 * 1024 * 1024
+# Columns ExcelProcessorV2._is_header_row looks at
+HEADER_COLUMNS = 9
+
+_SHEET_DATA_RE = re.compile(rb"<(?:\w+:)?sheetData\b[^>]*?(/?)>")
+_SHEET_DATA_END_RE = re.compile(rb"</(?:\w+:)?sheetData>")
+_ROW_START_RE = re.compile(rb"<(?:\w+:)?row[\s>/]")
+_DIMENSION_RE = re.compile(rb'<(?:\w+:)?dimension\s[^>]*?ref="([^"]*)"')
+
+
+@dataclass
+class SheetScan:
+    blocks: list
+    last_row: int = 0
+    # (row, column, uses_len) of the formulas in rows that are not headers
+    formula_cells: List[tuple] = field(default_factory=list)
+
+
+def scan_workbook_blocks(path, header_color, workers=1, chunk_bytes=CHUNK_BYTES):
+    """Return ``{sheet_name: blocks}`` for every worksheet of a package.
+
+    The blocks are those ``ExcelProcessorV2._find_all_blocks`` finds, read
+    from the worksheet XML without Excel or openpyxl. Large sheets are cut
+    into chunks of ``chunk_bytes`` at row boundaries and the chunks are
+    scanned by ``workers`` processes, see ``scan_sheet_blocks``.
+    """
+    with zipfile.ZipFile(path) as zf:
+        styles = StyleResolver.from_zip(zf)
+        header_styles = styles.header_styles(bgr_to_rgb(header_color))
+        blank_strings = blank_shared_strings(zf)
+
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            return {
+                name: scan_sheet_blocks(
+                    zf, part, header_styles, blank_strings, executor, chunk_bytes
+                )
+                for name, part in worksheet_parts(zf) if part in zf.NameToInfo
+            }
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+
+def scan_sheet_blocks(zf, part, header_styles, blank_strings, executor=None,
+                      chunk_bytes=CHUNK_BYTES):
+    """Find the blocks of one worksheet part, see ``scan_sheet``."""
+    return scan_sheet(zf, part, header_styles, blank_strings, executor, chunk_bytes).blocks
+
+
+def scan_sheet(zf, part, header_styles, blank_strings, executor=None,
+               chunk_bytes=CHUNK_BYTES, check=None):
+    """Scan one worksheet part chunk by chunk into a ``SheetScan``.
+
+    The part is inflated once, in this process, and cut right before a
+    ``<row`` tag every ``chunk_bytes``. Each chunk is scanned on its own
+    (in ``executor`` when given) into a ``ChunkRuns`` and the runs are
+    stitched back together, so the result equals a scan of the whole sheet.
+    ``check`` is called before every chunk and may raise to abort.
+    """
+    header_cols = data_cols = float("inf")
+    tasks = []
+
+    def submit(chunk):
+        if check:
+            check()
+        args = (chunk, len(tasks) == 0, header_cols, data_cols, header_styles, blank_strings)
+        tasks.append(executor.submit(_scan_chunk, *args) if executor else _scan_chunk(*args))
+
+    with zf.open(part) as stream:
+        buffer = b""
+        searched = None  # offset in buffer up to which no </sheetData> was found
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            buffer += data
+            if searched is None:
+                match = _SHEET_DATA_RE.search(buffer)
+                if match is None:
+                    if not data:
+                        break
+                    continue
+                if match.group(1):
+                    # <sheetData/>: no rows at all
+                    break
+                dimension = _DIMENSION_RE.search(buffer, 0, match.start())
+                corners = [split_cell_ref(ref) for ref in
+                           dimension.group(1).decode().split(":")] if dimension else []
+                if corners and None not in corners:
+                    data_cols = corners[-1][0] - corners[0][0] + 1
+                    header_cols = min(HEADER_COLUMNS, data_cols)
+                buffer = buffer[match.end():]
+                searched = 0
+
+            end = _SHEET_DATA_END_RE.search(buffer, max(0, searched - 16))
+            searched = len(buffer)
+            if end:
+                submit(buffer[:end.start()])
+                break
+            if not data:
+                submit(buffer)
+                break
+            if len(buffer) >= chunk_bytes:
+                cut = _last_row_start(buffer)
+                if cut:
+                    submit(buffer[:cut])
+                    buffer = buffer[cut:]
+                    searched = len(buffer)
+
+    try:
+        chunks = [task.result() if executor else task for task in tasks]
+    except ValueError:
+        if chunk_bytes == float("inf"):
+            raise
+        # Rows are numbered by position; only a single chunk knows positions
+        return scan_sheet(zf, part, header_styles, blank_strings, None, float("inf"), check)
+
+    # Children of a shared formula carry no text; they use the master's
+    uses_len = {}
+    for _, formulas in chunks:
+        for _, _, text, shared_index in formulas:
+            if text is not None and shared_index is not None:
+                uses_len[shared_index] = _uses_len(text)
+    formula_cells = [
+        (row, col, _uses_len(text) if text is not None else uses_len.get(shared_index, False))
+        for _, formulas in chunks for row, col, text, shared_index in formulas
+    ]
+
+    runs = [runs for runs, _ in chunks]
+    return SheetScan(
+        stitch_blocks(runs), max((chunk.last_row for chunk in runs), default=0), formula_cells
+    )
+
+
+def _last_row_start(data):
+    """Offset of the last ``<row`` tag in ``data``, 0 if there is none."""
+    cut = 0
+    for match in _ROW_START_RE.finditer(data, max(0, len(data) - CHUNK_SIZE)):
+        cut = match.start()
+    if not cut:
+        for match in _ROW_START_RE.finditer(data):
+            cut = match.start()
+    return cut
+
+
+def _scan_chunk(chunk, first, header_cols, data_cols, header_styles, blank_strings):
+    """Scan the ``<row>`` elements of one chunk.
+
+    Returns its ``ChunkRuns`` and the ``(row, column, text, shared_index)``
+    of its formulas outside header rows. Runs in a worker process of
+    ``scan_sheet``.
+    """
+    runs = ChunkRuns()
+    formulas = []
+    next_row = [1 if first else None]
+
+    def on_row(node):
+        row = node.attrs.get("r")
+        if row is None:
+            if next_row[0] is None:
+                raise ValueError("Rows without an r attribute cannot be scanned in chunks")
+            row = next_row[0]
+        row = int(row)
+        next_row[0] = row + 1
+
+        is_header = has_data = False
+        row_formulas = []
+        col = 0
+        for cell in node.elements():
+            ref = split_cell_ref(cell.attrs.get("r"))
+            col = ref[0] if ref else col + 1
+            if col > data_cols:
+                break
+            has_value, has_formula = _cell_flags(cell, blank_strings)
+            has_data = has_data or has_value or has_formula
+            if (has_value and col <= header_cols
+                    and int(cell.attrs.get("s") or 0) in header_styles):
+                is_header = True
+                break
+            if has_formula:
+                formula = cell.find("f")
+                shared_index = formula.attrs.get("si") if formula.attrs.get("t") == "shared" else None
+                row_formulas.append((row, col, formula.text() or None, shared_index))
+        runs.add_row(row, is_header, has_data)
+        if not is_header:
+            formulas.extend(row_formulas)
+
+    parser = SheetStreamParser(
+        lambda *args: None, lambda *args: None, lambda *args: None, lambda *args: None, on_row
+    )
+    parser.parse(io.BytesIO(b"<worksheet><sheetData>" + chunk + b"</sheetData></worksheet>"))
+    return runs, formulas
+
+
+def _uses_len(formula):
+    formula = formula.upper()
+    return "LEN(" in formula or "ДЛСТР(" in formula
+
+
+def _cell_flags(cell, blank_strings):
+    """Whether a cell shows a non-blank value and whether it has a formula."""
+    has_formula = False
+    text = None
+    for child in cell.elements():
+        if child.tag == "f":
+            has_formula = True
+        elif child.tag == "v":
+            text = child.text()
+        elif child.tag == "is":
+            runs = [child] + [node for node in child.elements() if node.tag == "r"]
+            text = "".join(
+                node.text() for run in runs for node in run.elements() if node.tag == "t"
+            )
+
+    if text is None:
+        return False, has_formula
+    if cell.attrs.get("t") == "s":
+        return int(text) not in blank_strings, has_formula
+    return bool(text.strip()), has_formula
+
+
+def blank_shared_strings(zf):
+    """Indexes of shared strings that are empty or whitespace only."""
+    blank = set()
+    if "xl/sharedStrings.xml" not in zf.NameToInfo:
+        return blank
+
+    ns = {"m": MAIN_NS}
+    index = 0
+    with zf.open("xl/sharedStrings.xml") as stream:
+        for _, element in ET.iterparse(stream):
+            if element.tag != f"{{{MAIN_NS}}}si":
+                continue
+            texts = element.findall("m:t", ns) + element.findall("m:r/m:t", ns)
+            if not "".join(text.text or "" for text in texts).strip():
+                blank.add(index)
+            index += 1
+            element.clear()
+    return blank
@@ -0,0 +1,134 @@
+"""Measure how long the GUI takes to start and fail when it got slower.
+
+    python -m startup_benchmark [--runs N] [--budget-ms MS] [--window-budget-ms MS]
+
+Each run starts a fresh interpreter: one with ``-X importtime`` importing
+``gui`` and, unless ``--no-window``, one timing ``QApplication`` plus the
+first shown ``MainWindow``. The medians are compared against the budgets
+and the slowest imports are listed. Modules that must only load on first
+use (the updater's network stack, pgpy, the report dialogs) are reported
+when they show up at startup. Exit code 0 within budget, 1 otherwise.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Budgets for a developer machine; the locked-down laptops need about 3x
+IMPORT_BUDGET_MS = 450
+WINDOW_BUDGET_MS = 700
+
+# Loaded when an update is checked or a report dialog opens, never at startup
+DEFERRED_MODULES = (
+    "urllib.request",
+    "http.client",
+    "packaging",
+    "pgpy",
+    "telegram",
+    "error_dialog",
+    "feedback_dialog",
+)
+
+WINDOW_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from PySide6.QtWidgets import QApplication
+app = QApplication(sys.argv)
+from gui import MainWindow
+window = MainWindow()
+window.show()
+app.processEvents()
+print(time.perf_counter() - start)
+"""
+
+REPO_DIR = Path(__file__).resolve().parent
+
+
+def _run(args, cwd):
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_DIR), env.get("PYTHONPATH")]))
+    # Compiled files are kept so that every run after the first is warm
+    return subprocess.run([sys.executable] + args, cwd=cwd, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def measure_imports(module="gui", cwd=None):
+    """Import ``module`` in a fresh interpreter.
+
+    Returns ``{imported_module: (self_us, cumulative_us)}`` parsed from the
+    ``-X importtime`` report.
+    """
+    result = _run(["-X", "importtime", "-c", f"import {module}"], cwd)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the column header
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+def measure_window(cwd=None):
+    """Seconds from interpreter start to the first shown ``MainWindow``."""
+    return float(_run(["-c", WINDOW_SCRIPT], cwd).stdout.strip().splitlines()[-1])
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m startup_benchmark",
+                                     description="Check the GUI startup time against a budget.")
+    parser.add_argument("--runs", type=int, default=5, help="runs per measurement (median)")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                        help="budget for importing gui")
+    parser.add_argument("--window-budget-ms", type=float, default=WINDOW_BUDGET_MS,
+                        help="budget until the window is shown")
+    parser.add_argument("--no-window", action="store_true", help="only measure the imports")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    failures = []
+
+    # The window writes logs and settings into the working directory
+    with tempfile.TemporaryDirectory() as cwd:
+        _run(["-c", "import gui"], cwd)  # compile and warm the file cache
+        runs = [measure_imports("gui", cwd) for _ in range(max(1, args.runs))]
+        window_runs = [] if args.no_window else [
+            measure_window(cwd) for _ in range(max(1, args.runs))
+        ]
+
+    import_ms = statistics.median(run["gui"][1] for run in runs) / 1000
+    print(f"import gui: {import_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if import_ms > args.budget_ms:
+        failures.append("import time over budget")
+
+    if window_runs:
+        window_ms = statistics.median(window_runs) * 1000
+        print(f"window shown: {window_ms:.0f} ms (budget {args.window_budget_ms:.0f} ms)")
+        if window_ms > args.window_budget_ms:
+            failures.append("window time over budget")
+
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1][0], reverse=True)
+    print("slowest imports (self time):")
+    for name, (self_us, cumulative_us) in slowest[:args.top]:
+        print(f"  {self_us / 1000:7.1f} ms  {cumulative_us / 1000:7.1f} ms cumulative  {name}")
+
+    eager = [name for name in DEFERRED_MODULES if name in runs[-1]]
+    if eager:
+        print(f"imported at startup but should be deferred: {', '.join(eager)}")
+        failures.append("deferred modules imported")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
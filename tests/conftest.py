@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# The modules live at the top of the repository, next to this folder;
+# the test doubles live in this folder
+TESTS_DIR = Path(__file__).resolve().parent
+for path in (TESTS_DIR.parent, TESTS_DIR):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,565 @@
+"""In-memory stand-in for the parts of the Excel COM object model we use.
+
+Every call that would cross the process boundary in real Excel (getting a
+``Range``, reading or writing one of its properties, calling one of its
+methods) increments ``FakeApplication.calls``, so the number of COM round
+trips of a processing strategy can be measured without Excel.
+"""
+import re
+
+from formula_refs import MAX_COLUMN, MAX_ROW, rewrite_row_refs, shift_formula
+from ooxml import column_index, column_letter
+
+NO_FILL = 16777215
+ROW_HEIGHT = 15.0
+COLUMN_WIDTH = 48.0
+
+XL_SHIFT_DOWN = -4121
+XL_SHIFT_UP = -4162
+
+_ADDRESS_RE = re.compile(r"^\$?([A-Z]{1,3})?\$?(\d+)?$")
+
+
+class FakeApplication:
+    def __init__(self):
+        self.calls = 0
+        self.Visible = False
+        self.ScreenUpdating = True
+        self.DisplayAlerts = True
+        self.EnableEvents = True
+        self.Calculation = -4105
+        self.CutCopyMode = False
+        self.clipboard = None
+        self.Workbooks = FakeWorkbooks(self)
+
+    def tick(self, count=1):
+        self.calls += count
+
+    def Quit(self):
+        self.tick()
+        for wb in list(self.Workbooks):
+            wb.Close(False)
+
+
+class FakeWorkbooks:
+    def __init__(self, app):
+        self.app = app
+        self._items = []
+        self.opened = {}
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    @property
+    def Count(self):
+        self.app.tick()
+        return len(self._items)
+
+    def Add(self, sheets=1):
+        self.app.tick()
+        wb = FakeWorkbook(self.app, sheets)
+        self._items.append(wb)
+        return wb
+
+    def Open(self, filepath):
+        """Open a workbook registered in ``opened`` under ``filepath``."""
+        self.app.tick()
+        factory = self.opened.get(str(filepath))
+        wb = factory(self.app) if factory else FakeWorkbook(self.app, 1)
+        wb.FullName = str(filepath)
+        self._items.append(wb)
+        return wb
+
+
+class FakeWorkbook:
+    def __init__(self, app, sheets=1):
+        self.app = app
+        self.Application = app
+        self.FullName = ""
+        self.saved = False
+        self.closed = False
+        self.Sheets = FakeSheets(self, [FakeSheet(self, f"Sheet{i + 1}") for i in range(sheets)])
+        self.Worksheets = self.Sheets
+
+    def Save(self):
+        self.app.tick()
+        self.saved = True
+
+    def Close(self, save_changes=False):
+        self.app.tick()
+        self.closed = True
+        if self in self.app.Workbooks._items:
+            self.app.Workbooks._items.remove(self)
+
+
+class FakeSheets:
+    def __init__(self, workbook, sheets):
+        self.workbook = workbook
+        self._items = sheets
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __call__(self, index):
+        self.workbook.app.tick()
+        if isinstance(index, str):
+            return next(sheet for sheet in self._items if sheet.Name == index)
+        return self._items[index - 1]
+
+    @property
+    def Count(self):
+        self.workbook.app.tick()
+        return len(self._items)
+
+
+class FakeSheet:
+    def __init__(self, workbook, name="Sheet1"):
+        self.Parent = workbook
+        self.Application = workbook.app
+        self.app = workbook.app
+        self.Name = name
+        # (row, col) -> {'value', 'formula', 'color'}
+        self.cells = {}
+        self.row_heights = {}
+        self.shapes = []
+        self.Shapes = FakeShapes(self)
+
+    # Test helpers, not part of the COM surface
+
+    def set_cell(self, row, col, value=None, formula=None, color=None):
+        data = self.cells.setdefault((row, col), {'value': None, 'formula': None, 'color': NO_FILL})
+        if value is not None:
+            data['value'] = value
+        if formula is not None:
+            data['formula'] = formula
+        if color is not None:
+            data['color'] = color
+        return data
+
+    def get_cell(self, row, col):
+        return self.cells.get((row, col), {'value': None, 'formula': None, 'color': NO_FILL})
+
+    def add_shape(self, row, col, name=None, dy=2.0, dx=2.0):
+        shape = FakeShape(self, name or f"Picture {len(self.shapes) + 1}",
+                          (row - 1) * ROW_HEIGHT + dy, (col - 1) * COLUMN_WIDTH + dx)
+        self.shapes.append(shape)
+        return shape
+
+    def rows_snapshot(self):
+        """Return ``{row: {col: value or formula}}`` for comparisons."""
+        snapshot = {}
+        for (row, col), data in self.cells.items():
+            content = data['formula'] or data['value']
+            if content is not None:
+                snapshot.setdefault(row, {})[col] = content
+        return snapshot
+
+    # COM surface
+
+    def Cells(self, row, col):
+        self.app.tick()
+        return FakeRange(self, [(row, col, row, col)])
+
+    def Range(self, first, last=None):
+        self.app.tick()
+        if isinstance(first, FakeRange):
+            r1, c1, _, _ = first.areas[0]
+            _, _, r2, c2 = (last or first).areas[0]
+            return FakeRange(self, [(min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2))])
+        return FakeRange(self, [_parse_area(part) for part in first.split(",")])
+
+    def Rows(self, index):
+        self.app.tick()
+        if isinstance(index, str):
+            first, _, last = index.partition(":")
+            return FakeRange(self, [(int(first), 1, int(last or first), MAX_COLUMN)])
+        return FakeRange(self, [(index, 1, index, MAX_COLUMN)])
+
+    @property
+    def UsedRange(self):
+        self.app.tick()
+        used = [
+            key for key, data in self.cells.items()
+            if data['value'] is not None or data['formula'] or data['color'] != NO_FILL
+        ]
+        if not used:
+            return FakeRange(self, [(1, 1, 1, 1)])
+        rows = [row for row, _ in used]
+        cols = [col for _, col in used]
+        return FakeRange(self, [(min(rows), min(cols), max(rows), max(cols))])
+
+    def Paste(self):
+        self.app.tick()
+        clip = self.app.clipboard
+        if isinstance(clip, FakeShape):
+            self.shapes.append(clip.clone())
+
+    # Row operations shared by FakeRange
+
+    def _insert_rows(self, first, count):
+        self.cells = {
+            (row + count if row >= first else row, col): data
+            for (row, col), data in self.cells.items()
+        }
+        self._adjust_formulas(lambda r: r + count if r >= first else r)
+        for shape in self.shapes:
+            if shape.row >= first:
+                shape.Top_ += count * ROW_HEIGHT
+
+    def _delete_rows(self, first, count):
+        last = first + count - 1
+        self.cells = {
+            (row - count if row > last else row, col): data
+            for (row, col), data in self.cells.items()
+            if not first <= row <= last
+        }
+        self._adjust_formulas(lambda r: 0 if first <= r <= last else (r - count if r > last else r))
+        self.shapes = [shape for shape in self.shapes if not first <= shape.row <= last]
+        for shape in self.shapes:
+            if shape.row > last:
+                shape.Top_ -= count * ROW_HEIGHT
+
+    def _adjust_formulas(self, remap):
+        # References into this sheet move on every sheet of the workbook
+        name = self.Name.lower()
+        for sheet in self.Parent.Sheets:
+            own = sheet is self
+            for data in sheet.cells.values():
+                if data['formula']:
+                    data['formula'] = rewrite_row_refs(
+                        data['formula'],
+                        lambda r, absolute, other, own=own:
+                            remap(r) if (other or "").lower() == ("" if own else name) else r,
+                        sheet_name=sheet.Name,
+                    )
+
+    def _copy_rows(self, source, target_row):
+        r1, c1, r2, c2 = source
+        offset = target_row - r1
+        copied = [
+            (row, col, dict(data)) for (row, col), data in self.cells.items()
+            if r1 <= row <= r2 and c1 <= col <= c2
+        ]
+        for row in range(target_row, target_row + r2 - r1 + 1):
+            for col in [col for (r, col) in self.cells if r == row and c1 <= col <= c2]:
+                del self.cells[(row, col)]
+        for row, col, data in copied:
+            if data['formula']:
+                data['formula'] = shift_formula(data['formula'], offset)
+            self.cells[(row + offset, col)] = data
+
+
+class FakeRange:
+    def __init__(self, sheet, areas):
+        self.sheet = sheet
+        self.app = sheet.app
+        self.areas = areas
+
+    def __bool__(self):
+        return True
+
+    @property
+    def _bounds(self):
+        return self.areas[0]
+
+    def _cells(self):
+        r1, c1, r2, c2 = self._bounds
+        for row in range(r1, r2 + 1):
+            for col in range(c1, c2 + 1):
+                yield row, col
+
+    def _grid(self, getter):
+        self.app.tick()
+        r1, c1, r2, c2 = self._bounds
+        if r1 == r2 and c1 == c2:
+            return getter(self.sheet.get_cell(r1, c1))
+        return tuple(
+            tuple(getter(self.sheet.get_cell(row, col)) for col in range(c1, c2 + 1))
+            for row in range(r1, r2 + 1)
+        )
+
+    def _set_grid(self, key, value):
+        self.app.tick()
+        r1, c1, r2, c2 = self._bounds
+        for row in range(r1, r2 + 1):
+            for col in range(c1, c2 + 1):
+                item = value
+                if isinstance(value, (tuple, list)):
+                    item = value[row - r1][col - c1]
+                data = self.sheet.set_cell(row, col)
+                if key == 'formula' and isinstance(item, str) and item.startswith("="):
+                    data['formula'] = item
+                else:
+                    data['formula'] = None
+                    data['value'] = None if item in ("", None) else item
+
+    @property
+    def Row(self):
+        self.app.tick()
+        return self._bounds[0]
+
+    @property
+    def Column(self):
+        self.app.tick()
+        return self._bounds[1]
+
+    @property
+    def Rows(self):
+        self.app.tick()
+        r1, _, r2, _ = self._bounds
+        return _Counter(r2 - r1 + 1)
+
+    @property
+    def Columns(self):
+        self.app.tick()
+        _, c1, _, c2 = self._bounds
+        return _Counter(c2 - c1 + 1)
+
+    @property
+    def Count(self):
+        self.app.tick()
+        return sum((r2 - r1 + 1) * (c2 - c1 + 1) for r1, c1, r2, c2 in self.areas)
+
+    @property
+    def Value(self):
+        return self._grid(lambda data: data['value'])
+
+    @Value.setter
+    def Value(self, value):
+        self._set_grid('value', value)
+
+    Value2 = Value
+
+    @property
+    def Formula(self):
+        return self._grid(
+            lambda data: data['formula'] or ("" if data['value'] is None else str(data['value']))
+        )
+
+    @Formula.setter
+    def Formula(self, value):
+        self._set_grid('formula', value)
+
+    @property
+    def HasFormula(self):
+        values = {bool(self.sheet.get_cell(r, c)['formula']) for r, c in self._cells()}
+        self.app.tick()
+        return values.pop() if len(values) == 1 else None
+
+    @property
+    def Interior(self):
+        self.app.tick()
+        return FakeInterior(self)
+
+    @property
+    def DisplayFormat(self):
+        self.app.tick()
+        return self
+
+    @property
+    def EntireRow(self):
+        self.app.tick()
+        return FakeRange(self.sheet, [(r1, 1, r2, MAX_COLUMN) for r1, _, r2, _ in self.areas])
+
+    @property
+    def Address(self):
+        self.app.tick()
+        r1, c1, r2, c2 = self._bounds
+        first = f"${column_letter(c1)}${r1}"
+        if (r1, c1) == (r2, c2):
+            return first
+        return f"{first}:${column_letter(c2)}${r2}"
+
+    @property
+    def Top(self):
+        self.app.tick()
+        return (self._bounds[0] - 1) * ROW_HEIGHT
+
+    @property
+    def Left(self):
+        self.app.tick()
+        return (self._bounds[1] - 1) * COLUMN_WIDTH
+
+    def Cells(self, row, col):
+        self.app.tick()
+        r1, c1, _, _ = self._bounds
+        return FakeRange(self.sheet, [(r1 + row - 1, c1 + col - 1, r1 + row - 1, c1 + col - 1)])
+
+    def Insert(self, Shift=XL_SHIFT_DOWN, CopyOrigin=None):
+        self.app.tick()
+        # Excel inserts above every area; doing it bottom-up keeps rows valid
+        for r1, _, r2, _ in sorted(self.areas, reverse=True):
+            self.sheet._insert_rows(r1, r2 - r1 + 1)
+
+    def Delete(self, Shift=XL_SHIFT_UP):
+        self.app.tick()
+        for r1, _, r2, _ in sorted(self.areas, reverse=True):
+            self.sheet._delete_rows(r1, r2 - r1 + 1)
+
+    def Clear(self):
+        self.app.tick()
+        r1, c1, r2, c2 = self._bounds
+        for row, col in [key for key in self.sheet.cells]:
+            if r1 <= row <= r2 and c1 <= col <= c2:
+                del self.sheet.cells[(row, col)]
+
+    @property
+    def RowHeight(self):
+        self.app.tick()
+        return self.sheet.row_heights.get(self._bounds[0], ROW_HEIGHT)
+
+    @RowHeight.setter
+    def RowHeight(self, value):
+        self.app.tick()
+        r1, _, r2, _ = self._bounds
+        for row in range(r1, r2 + 1):
+            self.sheet.row_heights[row] = value
+
+    def Copy(self, Destination=None):
+        self.app.tick()
+        if Destination is None:
+            self.app.clipboard = self
+            self.app.CutCopyMode = True
+            return
+        self.sheet._copy_rows(self._bounds, Destination._bounds[0])
+
+    def PasteSpecial(self, Paste=-4104, *args, **kwargs):
+        self.app.tick()
+        clip = self.app.clipboard
+        if isinstance(clip, FakeRange):
+            self.sheet._copy_rows(clip._bounds, self._bounds[0])
+
+
+class FakeInterior:
+    def __init__(self, rng):
+        self._range = rng
+
+    @property
+    def Color(self):
+        rng = self._range
+        rng.app.tick()
+        r1, c1, r2, c2 = rng._bounds
+        if c2 == MAX_COLUMN:
+            keys = [(r, c) for (r, c) in rng.sheet.cells if r1 <= r <= r2]
+            colors = {rng.sheet.get_cell(r, c)['color'] for r, c in keys}
+            if len(keys) < (r2 - r1 + 1) * MAX_COLUMN:
+                colors.add(NO_FILL)
+        else:
+            colors = {rng.sheet.get_cell(r, c)['color'] for r, c in rng._cells()}
+        # Excel returns Null for ranges with mixed fills
+        return colors.pop() if len(colors) == 1 else None
+
+    @Color.setter
+    def Color(self, value):
+        rng = self._range
+        rng.app.tick()
+        for row, col in rng._cells():
+            rng.sheet.set_cell(row, col, color=value)
+
+
+class FakeShapes:
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def __iter__(self):
+        self.sheet.app.tick()
+        return iter(list(self.sheet.shapes))
+
+    def __call__(self, index):
+        self.sheet.app.tick()
+        return self.sheet.shapes[index - 1]
+
+    @property
+    def Count(self):
+        self.sheet.app.tick()
+        return len(self.sheet.shapes)
+
+
+class FakeShape:
+    def __init__(self, sheet, name, top, left):
+        self.sheet = sheet
+        self.Name = name
+        self.Top_ = top
+        self.Left_ = left
+
+    @property
+    def row(self):
+        return int(self.Top_ // ROW_HEIGHT) + 1
+
+    @property
+    def col(self):
+        return int(self.Left_ // COLUMN_WIDTH) + 1
+
+    def clone(self):
+        shape = FakeShape(self.sheet, f"{self.Name} copy", self.Top_, self.Left_)
+        return shape
+
+    @property
+    def Top(self):
+        self.sheet.app.tick()
+        return self.Top_
+
+    @Top.setter
+    def Top(self, value):
+        self.sheet.app.tick()
+        self.Top_ = value
+
+    @property
+    def Left(self):
+        self.sheet.app.tick()
+        return self.Left_
+
+    @Left.setter
+    def Left(self, value):
+        self.sheet.app.tick()
+        self.Left_ = value
+
+    @property
+    def TopLeftCell(self):
+        self.sheet.app.tick()
+        return FakeRange(self.sheet, [(self.row, self.col, self.row, self.col)])
+
+    def Copy(self):
+        self.sheet.app.tick()
+        self.sheet.app.clipboard = self
+
+    def Duplicate(self):
+        self.sheet.app.tick()
+        # Excel places duplicates slightly below and to the right
+        shape = self.clone()
+        shape.Top_ += 7.5
+        shape.Left_ += 7.5
+        self.sheet.shapes.append(shape)
+        return shape
+
+
+class _Counter:
+    def __init__(self, count):
+        self.Count = count
+
+
+def _parse_area(text):
+    first, _, last = text.partition(":")
+    r1, c1 = _parse_corner(first)
+    r2, c2 = _parse_corner(last or first)
+    return (r1 or 1, c1 or 1, r2 or MAX_ROW, c2 or MAX_COLUMN)
+
+
+def _parse_corner(text):
+    match = _ADDRESS_RE.match(text.strip())
+    if not match:
+        raise ValueError(f"Unsupported address: {text}")
+    col, row = match.groups()
+    return (int(row) if row else None), (column_index(col) if col else None)
+
+
+class FakeDispatch:
+    """Callable replacement for ``win32com.client.DispatchEx``."""
+
+    def __init__(self):
+        self.applications = []
+
+    def __call__(self, prog_id):
+        app = FakeApplication()
+        self.applications.append(app)
+        return app
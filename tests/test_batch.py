@@ -0,0 +1,83 @@
+import logging
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+import batch
+from batch import iter_batch, process_one
+from config import Config
+from logger import get_logger
+from test_excel_processor_stream import random_rows
+from test_plan_engines import write_workbook
+
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@pytest.fixture(params=["fork", "spawn"])
+def start_method(request):
+    if request.param not in multiprocessing.get_all_start_methods():
+        pytest.skip(f"no {request.param} on this platform")
+    previous = multiprocessing.get_start_method()
+    multiprocessing.set_start_method(request.param, force=True)
+    yield request.param
+    multiprocessing.set_start_method(previous, force=True)
+
+
+def test_workers_log_and_report_sheets_to_the_parent(tmp_path, start_method):
+    files = []
+    for i in range(2):
+        folder = tmp_path / f"in{i}"
+        folder.mkdir()
+        files.append(str(folder / "book.xlsx"))
+        write_workbook(files[-1], random_rows(i))
+
+    logger = get_logger()
+    sink = Collect()
+    level = logger.level
+    logger.addHandler(sink)
+    logger.setLevel(logging.INFO)
+    sheets = []
+    try:
+        results = list(iter_batch(
+            files, Config(engine="stream", cache=False), workers=2,
+            sheet_callback=lambda *args: sheets.append(args)
+        ))
+    finally:
+        logger.removeHandler(sink)
+        logger.setLevel(level)
+
+    assert all(result["ok"] for result in results)
+    for file in files:
+        assert f"Starting processing: {file}" in sink.messages
+        assert (file, 1, 1) in sheets
+
+
+def test_identical_inputs_processed_once(tmp_path, monkeypatch):
+    files = []
+    for i in range(3):
+        folder = tmp_path / f"in{i}"
+        folder.mkdir()
+        files.append(str(folder / "book.xlsx"))
+        write_workbook(files[-1], random_rows(0 if i < 2 else 1))
+
+    processed = []
+
+    def counting(filepath, *args):
+        processed.append(filepath)
+        return process_one(filepath, *args)
+    monkeypatch.setattr(batch, "process_one", counting)
+
+    results = list(iter_batch(files, Config(engine="stream", cache=True), workers=1))
+    assert sorted(processed) == [files[0], files[2]]
+    assert sorted(result["file"] for result in results) == files
+    assert all(result["ok"] for result in results)
+    outputs = [Path(file).parent / "Deeva" / "book.xlsx" for file in files]
+    assert outputs[1].read_bytes() == outputs[0].read_bytes()
@@ -0,0 +1,141 @@
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from openpyxl import Workbook
+
+import sheet_scan
+from cancellation import CancelToken, ProcessingStopped, install_worker_token, worker_token
+from config import Config
+from excel_processor_stream import ROWS_PER_CHECK, SheetRestructurer, _NullWriter
+from excel_processor_v2 import ExcelProcessorV2
+from excel_styles import StyleResolver
+from fake_com import FakeApplication
+from test_excel_processor_v2 import make_sheet
+from test_plan_engines import YELLOW_FILL
+
+
+def stopping_check(token, after):
+    """A check that stops ``token`` on its ``after``-th call, and counts them."""
+    def check():
+        check.calls += 1
+        if check.calls == after:
+            token.stop()
+        token.check()
+    check.calls = 0
+    return check
+
+
+def wait_for_stop():
+    """Runs in a pool worker until its token is stopped."""
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        worker_token().check()
+        time.sleep(0.01)
+    return "never stopped"
+
+
+def write_rows(path, rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.cell(1, 1, "Head").fill = YELLOW_FILL
+    for row in range(2, rows + 2):
+        ws.cell(row, 1, row)
+    wb.save(path)
+
+
+def test_paused_check_blocks_until_resumed():
+    token = CancelToken()
+    token.pause()
+    returned = threading.Event()
+    thread = threading.Thread(target=lambda: (token.check(), returned.set()))
+    thread.start()
+    assert not returned.wait(0.2)
+    token.resume()
+    assert returned.wait(5)
+    thread.join()
+
+
+def test_stop_releases_a_paused_check():
+    token = CancelToken()
+    token.pause()
+    errors = []
+
+    def check():
+        try:
+            token.check()
+        except ProcessingStopped as e:
+            errors.append(e)
+    thread = threading.Thread(target=check)
+    thread.start()
+    token.stop()
+    thread.join(5)
+    assert not thread.is_alive() and len(errors) == 1
+
+
+def test_stop_raises_in_pool_worker():
+    token = CancelToken()
+    with ProcessPoolExecutor(1, initializer=install_worker_token, initargs=(token,)) as pool:
+        future = pool.submit(wait_for_stop)
+        time.sleep(0.2)
+        token.stop()
+        with pytest.raises(ProcessingStopped):
+            future.result(timeout=10)
+
+
+def test_stream_stop_within_rows_per_check(tmp_path):
+    path = tmp_path / "rows.xlsx"
+    write_rows(path, ROWS_PER_CHECK * 4)
+    token = CancelToken()
+    check = stopping_check(token, after=2)
+    with zipfile.ZipFile(path) as zf:
+        styles = StyleResolver.from_zip(zf)
+        restructurer = SheetRestructurer(_NullWriter(), styles.fill_keys, {1})
+        with zf.open("xl/worksheets/sheet1.xml") as src, pytest.raises(ProcessingStopped):
+            restructurer.run(src, check)
+    # Stopped at the check right after the request, not at the end of the sheet
+    assert restructurer._rows_seen == 2 * ROWS_PER_CHECK
+
+
+def test_scan_stop_between_chunks(tmp_path, monkeypatch):
+    path = tmp_path / "rows.xlsx"
+    write_rows(path, 2000)
+    scanned = []
+    scan_chunk = sheet_scan._scan_chunk
+    monkeypatch.setattr(sheet_scan, "_scan_chunk",
+                        lambda *args: scanned.append(1) or scan_chunk(*args))
+    token = CancelToken()
+    with zipfile.ZipFile(path) as zf, pytest.raises(ProcessingStopped):
+        sheet_scan.scan_sheet(zf, "xl/worksheets/sheet1.xml", {1}, set(),
+                              chunk_bytes=4096, check=stopping_check(token, after=2))
+    assert len(scanned) == 1
+
+
+@pytest.mark.parametrize("bulk_scan", [True, False])
+def test_com_stop_between_groups(bulk_scan):
+    sheet = make_sheet(FakeApplication(), blocks=5)
+    token = CancelToken()
+    processor = ExcelProcessorV2(Config(bulk_scan=bulk_scan))
+    processor.set_cancel_token(token)
+    groups = []
+
+    def group_done(done, total):
+        groups.append(done)
+        token.stop()
+    processor.set_progress_callback(group_done)
+    with pytest.raises(ProcessingStopped):
+        processor.process_sheet(sheet)
+    assert groups == [1]
+
+
+def test_com_cell_scan_stops_at_the_next_row():
+    sheet = make_sheet(FakeApplication(), blocks=5)
+    token = CancelToken()
+    processor = ExcelProcessorV2(Config(bulk_scan=False))
+    check = stopping_check(token, after=3)
+    processor.set_cancel_token(type("Token", (), {"check": staticmethod(check)})())
+    with pytest.raises(ProcessingStopped):
+        processor.plan_sheet(sheet)
+    assert check.calls == 3
@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+import cli
+
+
+def test_default_engine_runs_on_this_platform():
+    engine = cli.build_parser().parse_args(["book.xlsx"]).engine
+    assert engine == ("vbs" if os.name == "nt" else "stream")
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Excel engines run on Windows")
+@pytest.mark.parametrize("engine", cli.EXCEL_ENGINES)
+def test_excel_engines_refused_off_windows(tmp_path, capsys, engine):
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(["--engine", engine, str(tmp_path)])
+    assert exit_info.value.code == 2
+    assert "needs Windows and Excel" in capsys.readouterr().err
@@ -0,0 +1,40 @@
+import pytest
+from openpyxl import Workbook
+
+import fake_com
+from config import Config
+from dry_run import analyze_workbook
+from test_excel_processor_stream import random_rows, vbs_result
+from test_plan_engines import YELLOW_FILL, write_workbook
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_restructure_engines_report_the_vbs_layout(tmp_path, monkeypatch, seed):
+    rows = random_rows(seed)
+    path = tmp_path / "in.xlsx"
+    write_workbook(path, rows)
+
+    counts = {"Insert": 0, "Delete": 0}
+    for name in counts:
+        method = getattr(fake_com.FakeRange, name)
+
+        def counted(self, *args, name=name, method=method):
+            counts[name] += 1
+            return method(self, *args)
+        monkeypatch.setattr(fake_com.FakeRange, name, counted)
+    vbs_result(rows)
+
+    for engine in ("vbs", "stream"):
+        sheet, = analyze_workbook(path, Config(engine=engine))["sheets"]
+        assert sheet["rows_to_insert"] == counts["Insert"] - counts["Delete"]
+
+
+def test_com_skips_sheets_v2_does_not_process(tmp_path):
+    wb = Workbook()
+    wb.active.cell(1, 1, "Head").fill = YELLOW_FILL
+    wb.active.cell(2, 1, 1)
+    path = tmp_path / "single_header.xlsx"
+    wb.save(path)
+
+    assert analyze_workbook(path, Config(engine="openpyxl"))["sheets"][0]["groups"] == 1
+    assert analyze_workbook(path, Config(engine="com"))["sheets"][0]["groups"] == 0
@@ -0,0 +1,117 @@
+import threading
+
+from config import Config
+from excel_pool import ExcelPool, process_workbook
+from fake_com import FakeDispatch, FakeWorkbook, FakeWorkbooks
+from test_excel_processor_v2 import make_sheet
+
+
+class WorkbookDispatch(FakeDispatch):
+    """Every path opens a fresh copy of the same sheet of header blocks."""
+
+    def __init__(self):
+        super().__init__()
+        self.workbooks = []
+
+    def __call__(self, prog_id):
+        app = super().__call__(prog_id)
+        app.Workbooks.opened = _AnyPath(self._open)
+        return app
+
+    def _open(self, app):
+        source = make_sheet(app, blocks=5)
+        source.Parent.Close(False)
+        wb = FakeWorkbook(app, 1)
+        wb.Sheets(1).cells = source.cells
+        self.workbooks.append(wb)
+        return wb
+
+
+class _AnyPath(dict):
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def get(self, key, default=None):
+        return self.factory
+
+
+def files(tmp_path, count=5):
+    return [str(tmp_path / f"f{i}.xlsx") for i in range(count)]
+
+
+def test_one_excel_for_many_files(tmp_path):
+    dispatch = WorkbookDispatch()
+    pool = ExcelPool(1, dispatch=dispatch)
+    for file in files(tmp_path):
+        pool.run(process_workbook, file, Config(engine="com"))
+    pool.close()
+
+    assert len(dispatch.applications) == 1
+    assert all(wb.saved and wb.closed for wb in dispatch.workbooks)
+    assert len(dispatch.workbooks[0].Sheets(1).rows_snapshot()) > 5 * 2
+
+
+def test_recycled_after_max_files(tmp_path):
+    dispatch = WorkbookDispatch()
+    pool = ExcelPool(1, max_files=2, dispatch=dispatch)
+    for file in files(tmp_path):
+        pool.run(process_workbook, file, Config(engine="com"))
+    pool.close()
+    assert pool.sessions[0].starts == 3
+
+
+def test_recycled_when_a_workbook_is_left_open(tmp_path):
+    dispatch = WorkbookDispatch()
+    pool = ExcelPool(1, dispatch=dispatch)
+    pool.run(lambda excel: excel.open_workbook(str(tmp_path / "left_open.xlsx")))
+    pool.run(lambda excel: None)
+    pool.close()
+    assert len(dispatch.applications) == 2
+
+
+def test_workbooks_of_the_user_are_left_alone(tmp_path):
+    dispatch = WorkbookDispatch()
+    pool = ExcelPool(1, dispatch=dispatch)
+    user_workbook = pool.run(lambda excel: excel.app.Workbooks.Add())
+    for file in files(tmp_path, 2):
+        pool.run(process_workbook, file, Config(engine="com"))
+    pool.close()
+
+    assert len(dispatch.applications) == 1
+    assert not user_workbook.closed
+    assert all(wb.closed for wb in dispatch.workbooks)
+
+
+def test_recycled_when_excel_stops_answering(monkeypatch):
+    dispatch = WorkbookDispatch()
+    pool = ExcelPool(1, dispatch=dispatch)
+
+    def unavailable(self):
+        raise OSError("The RPC server is unavailable")
+
+    def crash(excel):
+        monkeypatch.setattr(FakeWorkbooks, "__iter__", unavailable)
+        raise RuntimeError("boom")
+
+    try:
+        pool.run(crash)
+    except RuntimeError:
+        pass
+    monkeypatch.undo()
+    pool.run(lambda excel: None)
+    pool.close()
+    assert len(dispatch.applications) == 2
+
+
+def test_one_excel_per_worker():
+    dispatch = WorkbookDispatch()
+    pool = ExcelPool(2, dispatch=dispatch)
+    # Both workers hold a task at the same time
+    both_busy = threading.Barrier(2, timeout=10)
+    futures = [pool.submit(lambda excel: both_busy.wait()) for _ in range(4)]
+    for future in futures:
+        future.result()
+    pool.close()
+    assert len(dispatch.applications) == 2
+    assert {session.starts for session in pool.sessions} == {1}
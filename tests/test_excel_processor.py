@@ -0,0 +1,26 @@
+import pytest
+
+from cancellation import ProcessingStopped
+from config import Config
+from excel_processor import ExcelProcessor
+
+
+@pytest.mark.parametrize("error", [ProcessingStopped, RuntimeError, KeyboardInterrupt])
+def test_previous_output_kept_when_processing_fails(tmp_path, error):
+    source = tmp_path / "book.xlsx"
+    source.write_bytes(b"new input")
+    output = tmp_path / "Deeva" / "book.xlsx"
+    output.parent.mkdir()
+    output.write_bytes(b"last output")
+
+    processor = ExcelProcessor(Config(engine="stream"))
+
+    def fail(source_path, output_file):
+        output_file.write_bytes(b"half written")
+        raise error()
+    processor._process_with_stream = fail
+
+    with pytest.raises(error):
+        processor.process_file(str(source))
+    assert output.read_bytes() == b"last output"
+    assert list(output.parent.glob("*.previous")) == []
@@ -0,0 +1,231 @@
+"""The stream engine lays sheets out like ``RestructureSheet`` in Excel.
+
+``restructure`` below is ``excel_processor.vbs`` ported line by line onto
+the fake COM model, whose inserts, pastes and deletes adjust formulas the
+way Excel does. Random sheets are processed by both and must come out the
+same, formulas included.
+"""
+import random
+import zipfile
+
+import pytest
+from openpyxl import load_workbook
+from openpyxl.comments import Comment
+from openpyxl.drawing.image import Image as Picture
+
+from config import Config
+from excel_processor_stream import ExcelProcessorStream, _prescan
+from fake_com import FakeApplication
+from test_plan_engines import (COLUMNS, YELLOW, check_linked_workbook, file_result, random_formula,
+                               write_linked_workbook, write_workbook)
+
+XL_SHIFT_DOWN = -4121
+XL_PASTE_ALL = -4104
+
+
+def process_sheet(sheet, header_color):
+    header_range = find_header(sheet, header_color)
+    if header_range is not None:
+        restructure(sheet, header_range)
+
+
+def find_header(sheet, header_color):
+    used_range = sheet.UsedRange
+    rows_count = used_range.Rows.Count
+    cols_count = used_range.Columns.Count
+    for row in range(1, rows_count + 1):
+        if row > 20:
+            break
+        for col in range(1, cols_count + 1):
+            if sheet.Cells(row, col).Interior.Color == header_color:
+                return find_header_range(sheet, row)
+    return None
+
+
+def find_header_range(sheet, header_row):
+    cols_count = sheet.UsedRange.Columns.Count
+    first_col = last_col = 0
+    for col in range(1, cols_count + 1):
+        if not is_empty(sheet.Cells(header_row, col)):
+            first_col = first_col or col
+            last_col = col
+    if first_col and last_col:
+        return sheet.Range(sheet.Cells(header_row, first_col), sheet.Cells(header_row, last_col))
+    return None
+
+
+def has_data_in_range(sheet, row, start_col, end_col):
+    return any(not is_empty(sheet.Cells(row, col)) for col in range(start_col, end_col + 1))
+
+
+def is_empty(cell):
+    # The fake does not calculate; in Excel a formula cell is never Empty
+    return cell.Formula == ""
+
+
+def restructure(sheet, header_range):
+    header_row = header_range.Row
+    start_col = header_range.Column
+    end_col = start_col + header_range.Columns.Count - 1
+    used_range = sheet.UsedRange
+    last_row = used_range.Row + used_range.Rows.Count - 1
+    header_height = sheet.Rows(header_row).RowHeight
+    row = header_row + 1
+    while row <= last_row:
+        if has_data_in_range(sheet, row, start_col, end_col):
+            sheet.Rows(row).Copy()
+            sheet.Rows(row + 1).Insert(XL_SHIFT_DOWN)
+            sheet.Rows(row + 1).PasteSpecial(XL_PASTE_ALL)
+            last_row += 1
+            row += 2
+
+            sheet.Rows(row).Clear()
+            sheet.Rows(row).RowHeight = 15
+
+            if row + 1 <= last_row and has_data_in_range(sheet, row + 1, start_col, end_col):
+                sheet.Rows(row + 1).Insert(XL_SHIFT_DOWN)
+                header_range.Copy()
+                sheet.Cells(row + 1, start_col).PasteSpecial(XL_PASTE_ALL)
+                sheet.Rows(row + 1).RowHeight = header_height
+                last_row += 1
+                row += 2
+            else:
+                break
+        else:
+            row += 1
+    used_range = sheet.UsedRange
+    last_row = used_range.Row + used_range.Rows.Count - 1
+    if last_row > header_row:
+        if sheet.Cells(last_row, start_col).Interior.Color == header_range.Cells(1, 1).Interior.Color:
+            sheet.Rows(last_row).Delete()
+    sheet.Application.CutCopyMode = False
+    sheet.Rows(header_row).RowHeight = header_height
+
+
+def random_rows(seed):
+    """A header, then data rows, blank rows and header colored rows below it."""
+    rnd = random.Random(seed)
+    rows = {}
+    header_row = 1
+    if rnd.random() < 0.5:
+        rows[1] = {1: ("Title", False), COLUMNS: (None, False)}
+        header_row = 3
+    rows[header_row] = {col: (f"H{col}", True) for col in range(1, COLUMNS + 1)}
+    if rnd.random() < 0.3:
+        rows[header_row][COLUMNS] = (None, True)
+
+    last_row = header_row + rnd.randint(1, 30)
+    for row in range(header_row + 1, last_row + 1):
+        kind = rnd.random()
+        if kind < 0.25:
+            continue
+        header = kind < 0.35 or row == last_row and rnd.random() < 0.3
+        rows[row] = {col: (f"H{col}" if header else rnd.randint(1, 99), header)
+                     for col in range(1, COLUMNS)}
+        rows[row][COLUMNS] = (None, header)
+
+    for row, cells in rows.items():
+        content, header = cells[COLUMNS]
+        if content is None:
+            formula = random_formula(rnd, row, last_row + 2)
+            if rnd.random() < 0.15:
+                formula = f"=Data!A{row}+Data!$A$2"
+            cells[COLUMNS] = (formula, header)
+    return rows
+
+
+def vbs_result(rows):
+    app = FakeApplication()
+    sheet = app.Workbooks.Add().Sheets(1)
+    for row, cells in rows.items():
+        for col, (content, header) in cells.items():
+            if isinstance(content, str) and content.startswith("="):
+                sheet.set_cell(row, col, formula=content, color=YELLOW if header else None)
+            else:
+                sheet.set_cell(row, col, value=content, color=YELLOW if header else None)
+    process_sheet(sheet, YELLOW)
+    return sheet.rows_snapshot()
+
+
+def stream_result(tmp_path, rows):
+    source = tmp_path / "in.xlsx"
+    write_workbook(source, rows)
+    output = tmp_path / "out.xlsx"
+    ExcelProcessorStream(Config()).process_file(source, output)
+    return file_result(output)
+
+
+@pytest.mark.parametrize("seed", range(80))
+def test_same_as_restructure_sheet(tmp_path, seed):
+    rows = random_rows(seed)
+    assert stream_result(tmp_path, rows) == vbs_result(rows)
+
+
+def test_reference_follows_its_own_row(tmp_path):
+    rows = {
+        1: {col: (f"H{col}", True) for col in range(1, 3)},
+        2: {1: (1, False), 2: (2, False)},
+        4: {1: (3, False), 2: (4, False)},
+        7: {1: (5, False), 2: ("=SUM(B2:B4)", False)},
+    }
+    result = stream_result(tmp_path, rows)
+    assert result == vbs_result(rows)
+    # B2 stays where it is, B4 moves down with the two rows inserted above it
+    assert result[10][2] == "=SUM(B2:B6)"
+
+
+def test_layout_pass_only_for_formulas(tmp_path):
+    rows = {1: {1: ("H1", True)}, 2: {1: (1, False)}}
+    write_workbook(tmp_path / "values.xlsx", rows)
+    rows[2][2] = ("=A2*2", False)
+    write_workbook(tmp_path / "formulas.xlsx", rows)
+    for name, has_formulas in (("values.xlsx", False), ("formulas.xlsx", True)):
+        with zipfile.ZipFile(tmp_path / name) as zf:
+            assert _prescan(zf, "xl/worksheets/sheet1.xml") == (set(), has_formulas)
+
+
+def test_pictures_and_comments_follow_their_rows(tmp_path):
+    # openpyxl needs Pillow to add pictures
+    Image = pytest.importorskip("PIL.Image")
+    rows = {
+        1: {col: (f"H{col}", True) for col in range(1, 3)},
+        2: {1: (1, False)},
+        4: {1: (2, False)},
+    }
+    source = tmp_path / "in.xlsx"
+    write_workbook(source, rows)
+    Image.new("RGB", (4, 4)).save(tmp_path / "dot.png")
+    wb = load_workbook(source)
+    ws = wb.active
+    ws.add_image(Picture(tmp_path / "dot.png"), "B4")
+    ws.add_image(Picture(tmp_path / "dot.png"), "C3")
+    ws["A4"].comment = Comment("record", "a")
+    ws["B3"].comment = Comment("cleared", "a")
+    wb.save(source)
+
+    output = tmp_path / "out.xlsx"
+    ExcelProcessorStream(Config()).process_file(source, output)
+    assert file_result(output) == vbs_result(rows)
+
+    ws = load_workbook(output).active
+    # Row 4 follows a header copy and is duplicated, row 3 was cleared
+    anchors = sorted((image.anchor._from.col, image.anchor._from.row + 1) for image in ws._images)
+    assert anchors == [(1, 6), (1, 7), (2, 4)]
+    comments = {cell.coordinate: cell.comment.text for row in ws.iter_rows()
+                for cell in row if cell.comment}
+    assert comments == {"A6": "record", "A7": "record"}
+
+
+def test_references_from_other_sheets_follow_their_rows(tmp_path):
+    rows = {
+        1: {col: (f"H{col}", True) for col in range(1, 3)},
+        2: {1: ("a", False)},
+        4: {1: ("b", False)},
+        6: {1: ("c", False)},
+    }
+    refs = {4: "b", 6: "c"}
+    source = tmp_path / "in.xlsx"
+    write_linked_workbook(source, rows, refs)
+    output = tmp_path / "out.xlsx"
+    ExcelProcessorStream(Config()).process_file(source, output)
+    check_linked_workbook(output, refs)
@@ -0,0 +1,133 @@
+"""V2 on the fake COM model: same sheets as the baseline, far fewer round trips.
+
+``baseline_v2`` is ``excel_processor_v2.py`` as it was before the bulk
+COM work, reading and writing one cell at a time.
+"""
+import random
+
+import pytest
+
+from baseline_v2 import ExcelProcessorV2 as BaselineV2
+from config import Config
+from excel_processor_v2 import ExcelProcessorV2
+from fake_com import FakeApplication
+from transform_plan import find_blocks, find_blocks_from_masks
+
+YELLOW = 65535
+
+
+def make_sheet(app, blocks=40, rows=8, cols=12, seed=1):
+    """Header blocks of up to ``rows`` data rows with a ``LEN`` formula each,
+    blank rows in between and a stray header copy at the bottom."""
+    rnd = random.Random(seed)
+    sheet = app.Workbooks.Add().Sheets(1)
+    row = 1
+    for _ in range(blocks):
+        for col in range(1, cols + 1):
+            sheet.set_cell(row, col, value=f"H{col}", color=YELLOW)
+        row += 1
+        for _ in range(rnd.randint(1, rows)):
+            for col in range(1, cols + 1):
+                sheet.set_cell(row, col, value=rnd.randint(1, 99))
+            sheet.set_cell(row, cols, formula=f"=LEN(A{row})")
+            row += 1
+        row += 1
+    for col in range(1, cols + 1):
+        sheet.set_cell(row, col, value=f"H{col}", color=YELLOW)
+    return sheet
+
+
+def run(processor_class, bulk_scan=True, shapes=False, seed=3):
+    """Process a sheet; return the calls of each step and the resulting sheet."""
+    app = FakeApplication()
+    sheet = make_sheet(app, seed=seed)
+    processor = processor_class(Config(bulk_scan=bulk_scan))
+
+    app.calls = 0
+    blocks = processor._find_all_blocks(sheet, sheet.UsedRange)
+    calls = {"scan": app.calls}
+    if shapes:
+        for block in blocks:
+            for group in block['data_groups']:
+                for row in group:
+                    sheet.add_shape(row, 3, dy=3.0, dx=5.0)
+
+    app.calls = 0
+    processor.process_sheet(sheet)
+    calls["process"] = app.calls
+
+    app.calls = 0
+    processor._remove_duplicate_headers(sheet)
+    calls["remove_headers"] = app.calls
+
+    result = (sheet.rows_snapshot(), sorted((s.Top_, s.Left_) for s in sheet.shapes))
+    return calls, result
+
+
+@pytest.mark.parametrize("shapes", [False, True])
+def test_same_result_as_baseline(shapes):
+    _, baseline = run(BaselineV2, shapes=shapes)
+    _, per_cell = run(ExcelProcessorV2, bulk_scan=False, shapes=shapes)
+    _, bulk = run(ExcelProcessorV2, shapes=shapes)
+    assert bulk == per_cell == baseline
+
+
+def test_bulk_scan_round_trips():
+    baseline, _ = run(BaselineV2)
+    bulk, _ = run(ExcelProcessorV2)
+    # About 8500 calls cell by cell, 800 in bulk
+    assert bulk["scan"] * 10 < baseline["scan"]
+    # A final check for header copies costs a handful of calls
+    assert bulk["remove_headers"] <= 12 < baseline["remove_headers"] // 100
+
+
+def test_duplication_round_trips():
+    baseline, _ = run(BaselineV2)
+    bulk, _ = run(ExcelProcessorV2)
+    # Scan, one insert and one copy per group, header deletion in one call
+    assert bulk["process"] * 10 < baseline["process"]
+
+
+def test_shape_copy_round_trips():
+    baseline, _ = run(BaselineV2, shapes=True)
+    bulk, _ = run(ExcelProcessorV2, shapes=True)
+    shape_calls = bulk["process"] - run(ExcelProcessorV2)[0]["process"]
+    baseline_shape_calls = baseline["process"] - run(BaselineV2)[0]["process"]
+    assert shape_calls * 10 < baseline_shape_calls
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_scattered_header_copies(seed):
+    rnd = random.Random(seed)
+
+    def build(app):
+        sheet = make_sheet(app, blocks=rnd.randint(1, 6), seed=seed)
+        last_row = sheet.UsedRange.Rows.Count
+        # Header copies between the blocks, some with a changed value
+        for row in rnd.sample(range(2, last_row + 5), 4):
+            sheet.Rows(row).Insert()
+            for col in range(1, 13):
+                sheet.set_cell(row, col, value=f"H{col}", color=YELLOW)
+            if rnd.random() < 0.3:
+                sheet.set_cell(row, rnd.randint(1, 12), value="other")
+        return sheet
+
+    results = []
+    for bulk_scan in (False, True):
+        rnd.seed(seed)
+        sheet = build(FakeApplication())
+        ExcelProcessorV2(Config(bulk_scan=bulk_scan)).process_sheet(sheet)
+        results.append(sheet.rows_snapshot())
+    assert results[0] == results[1]
+
+
+def test_masks_match_find_blocks():
+    rnd = random.Random(0)
+    for _ in range(3000):
+        count = rnd.randint(0, 40)
+        headers = [rnd.random() < 0.2 for _ in range(count)]
+        data = [rnd.random() < 0.6 for _ in range(count)]
+        expected = find_blocks(
+            count, lambda row: headers[row - 1], lambda row: data[row - 1] or headers[row - 1]
+        )
+        assert find_blocks_from_masks(headers, data) == expected
@@ -0,0 +1,57 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from openpyxl.styles.colors import COLOR_INDEX
+
+from excel_styles import INDEXED_COLORS, StyleResolver, apply_tint
+
+THEME_XML = b"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<a:theme xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" name="Office">
+<a:themeElements><a:clrScheme name="Office">
+<a:dk1><a:sysClr val="windowText" lastClr="000000"/></a:dk1>
+<a:lt1><a:sysClr val="window" lastClr="FFFFFF"/></a:lt1>
+<a:dk2><a:srgbClr val="44546A"/></a:dk2>
+<a:lt2><a:srgbClr val="E7E6E6"/></a:lt2>
+<a:accent1><a:srgbClr val="4472C4"/></a:accent1>
+<a:accent2><a:srgbClr val="ED7D31"/></a:accent2>
+<a:accent3><a:srgbClr val="A5A5A5"/></a:accent3>
+<a:accent4><a:srgbClr val="FFC000"/></a:accent4>
+<a:accent5><a:srgbClr val="5B9BD5"/></a:accent5>
+<a:accent6><a:srgbClr val="70AD47"/></a:accent6>
+<a:hlink><a:srgbClr val="0563C1"/></a:hlink>
+<a:folHlink><a:srgbClr val="954F72"/></a:folHlink>
+</a:clrScheme></a:themeElements></a:theme>"""
+
+
+def test_indexed_palette_matches_openpyxl():
+    assert INDEXED_COLORS == tuple(color[-6:] for color in COLOR_INDEX)
+
+
+def test_color_resolution():
+    resolver = StyleResolver(theme_xml=THEME_XML)
+    assert resolver.color_key({"rgb": "ff4472c4"}) == "4472C4"
+    assert resolver.color_key({"indexed": "13"}) == "FFFF00"
+    assert resolver.color_key({"indexed": "64"}) is None
+    # Excel swaps the first two pairs of the scheme
+    assert resolver.color_key({"theme": "0"}) == "FFFFFF"
+    assert resolver.color_key({"theme": "3"}) == "44546A"
+    assert resolver.color_key({"theme": "4"}) == "4472C4"
+    assert resolver.color_key({"theme": "12"}) is None
+    # "Accent 1, lighter 60%" and "darker 25%" as Excel reports them
+    assert resolver.color_key({"theme": "4", "tint": "0.5999938962981048"}) == "B4C7E7"
+    assert resolver.color_key({"theme": "4", "tint": "-0.249977111117893"}) == "2F5597"
+    assert resolver.color_key({"auto": "1"}) is None
+
+
+def test_tint_limits():
+    assert apply_tint("4472C4", 0) == "4472C4"
+    assert apply_tint("4472C4", 1) == "FFFFFF"
+    assert apply_tint("4472C4", -1) == "000000"
+
+
+def test_import_does_not_load_openpyxl():
+    code = "import sys, excel_styles; print('openpyxl' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=Path(__file__).resolve().parent.parent)
+    assert result.stdout.strip() == "False", result.stderr
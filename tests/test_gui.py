@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PySide6.QtWidgets")
+
+import gui
+from config import Config
+from gui import LOG_FLUSH_MS, LogView
+from test_excel_processor_stream import random_rows
+from test_plan_engines import write_workbook
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def run_events(app, seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.005)
+
+
+def test_log_lines_appear_in_order_on_the_timer(app):
+    view = LogView()
+    threads = [threading.Thread(target=lambda i=i: view.append_line(f"line {i}")) for i in range(3)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+    # Nothing is shown before the timer fires
+    assert view.toPlainText() == ""
+    run_events(app, LOG_FLUSH_MS * 5 / 1000)
+    assert view.toPlainText().splitlines() == ["line 0", "line 1", "line 2"]
+
+    view.append_line("line 3")
+    run_events(app, LOG_FLUSH_MS * 5 / 1000)
+    assert view.toPlainText().splitlines()[-2:] == ["line 2", "line 3"]
+
+
+def test_log_keeps_the_last_lines(app):
+    view = LogView()
+    limit = view.maximumBlockCount()
+    assert limit == gui.LOG_MAX_LINES
+    for i in range(limit * 2 + 10):
+        view.append_line(f"line {i}")
+        if i == limit:
+            view.flush()
+    view.flush()
+    lines = view.toPlainText().splitlines()
+    assert len(lines) == limit
+    assert lines == [f"line {i}" for i in range(limit + 10, limit * 2 + 10)]
+
+
+def test_clear_drops_pending_lines(app):
+    view = LogView()
+    view.append_line("old")
+    view.clear()
+    view.flush()
+    assert view.toPlainText() == ""
+
+
+def test_batch_run_reports_every_file(app, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the job journal lives in the working folder
+    files = []
+    for i in range(3):
+        folder = tmp_path / f"in{i}"
+        folder.mkdir()
+        files.append(str(folder / f"book{i}.xlsx"))
+        write_workbook(files[-1], random_rows(i))
+
+    thread = gui.ProcessorThread(files, Config(engine="stream", cache=False, workers=2))
+    names, finished = [], []
+    thread.file_processing.connect(names.append, gui.Qt.DirectConnection)
+    thread.finished.connect(finished.append, gui.Qt.DirectConnection)
+    thread._run()
+    assert sorted(names) == ["book0.xlsx", "book1.xlsx", "book2.xlsx"]
+    assert finished[0]["success"] == 3
@@ -0,0 +1,35 @@
+import json
+
+from config import Config
+from job_journal import JobJournal
+
+
+def test_resumes_finished_files(tmp_path):
+    files = [tmp_path / "a.xlsx", tmp_path / "b.xlsx"]
+    for file in files:
+        file.write_bytes(b"x")
+    journal = JobJournal(files, Config(), tmp_path / "journal")
+    journal.file_done(files[0], True, sheets=3)
+    journal.file_done(files[1], False, "boom")
+
+    resumed = JobJournal(files, Config(), tmp_path / "journal")
+    assert resumed.done_files(files) == [files[0]]
+    assert resumed.sheets_done(files[0]) == 3
+
+    files[0].write_bytes(b"changed")
+    assert not JobJournal(files, Config(), tmp_path / "journal").is_done(files[0])
+
+
+def test_torn_line_is_ignored(tmp_path):
+    file = tmp_path / "a.xlsx"
+    file.write_bytes(b"x")
+    journal = JobJournal([file], Config(), tmp_path / "journal")
+    journal.file_done(file, True, sheets=1)
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"event": "file", "fi')
+
+    resumed = JobJournal([file], Config(), tmp_path / "journal")
+    assert resumed.is_done(file)
+    resumed.file_done(file, True, sheets=2)
+    lines = journal.path.read_text(encoding="utf-8").splitlines()
+    assert json.loads(lines[-1])["sheets"] == 2
@@ -0,0 +1,68 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from logging.handlers import QueueHandler
+from multiprocessing import Manager
+
+import pytest
+
+from logger import (add_sink, forward_worker_logs, get_logger, log_to_queue, remove_sink,
+                    setup_logger, stop_logging)
+from test_batch import Collect
+
+
+@pytest.fixture
+def logging_started(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # setup_logger writes to ./logs
+    logger = get_logger()
+    handlers, level = list(logger.handlers), logger.level
+    yield setup_logger(logging.INFO)
+    stop_logging()
+    logger.handlers[:] = handlers
+    logger.setLevel(level)
+
+
+def log_in_worker(message):
+    get_logger().info(message)
+    return True
+
+
+def test_worker_records_reach_the_parent_sinks(logging_started):
+    sink = Collect()
+    add_sink(sink)
+    with Manager() as manager:
+        log_queue = manager.Queue()
+        stop_forwarding = forward_worker_logs(log_queue)
+        try:
+            with ProcessPoolExecutor(2, initializer=log_to_queue,
+                                     initargs=(log_queue, logging.INFO)) as pool:
+                assert all(pool.map(log_in_worker, ["from worker 1", "from worker 2"]))
+        finally:
+            stop_forwarding()
+    remove_sink(sink)
+    assert sorted(sink.messages) == ["from worker 1", "from worker 2"]
+
+
+def test_removed_sink_gets_nothing_more(logging_started):
+    logger = logging_started
+    sink = Collect()
+    add_sink(sink)
+    logger.info("before")
+    remove_sink(sink)
+    logger.info("after")
+    stop_logging()  # flushes what is still queued
+    assert sink.messages == ["before"]
+
+
+def test_setup_again_adds_no_handlers(logging_started):
+    logger = logging_started
+    handlers = list(logger.handlers)
+    assert sum(isinstance(h, QueueHandler) for h in handlers) == 1
+    assert setup_logger(logging.DEBUG) is logger
+    assert logger.handlers == handlers
+    assert logger.level == logging.DEBUG
+
+    sink = Collect()
+    add_sink(sink)
+    logger.info("once")
+    remove_sink(sink)
+    assert sink.messages == ["once"]
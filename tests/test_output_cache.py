@@ -0,0 +1,156 @@
+import logging
+import os
+import shutil
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from config import Config
+from excel_processor import ExcelProcessor
+from logger import LOGGER_NAME
+from output_cache import SHEETS_MANIFEST_NAME, OutputCache, SheetManifest, cache_key
+from test_plan_engines import YELLOW_FILL, file_result, write_workbook
+
+
+def rows_with(value):
+    return {1: {1: ("H1", True)}, 2: {1: (value, False)}}
+
+
+def run(source, **settings):
+    ExcelProcessor(Config(engine="stream", **settings)).process_file(str(source))
+    return source.parent / "Deeva" / source.name
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """The same file name holding two different workbooks."""
+    write_workbook(tmp_path / "a.xlsx", rows_with("AAA"))
+    write_workbook(tmp_path / "b.xlsx", rows_with("BBB"))
+    source = tmp_path / "book.xlsx"
+    shutil.copy2(tmp_path / "a.xlsx", source)
+    return source, tmp_path / "a.xlsx", tmp_path / "b.xlsx"
+
+
+def write_two_sheets(path, second):
+    wb = Workbook()
+    for ws, value in ((wb.active, "AAA"), (wb.create_sheet("Second"), second)):
+        ws.cell(1, 1, "H1").fill = YELLOW_FILL
+        ws.cell(2, 1, value)
+    wb.save(path)
+
+
+def test_unchanged_sheets_reused(tmp_path, caplog):
+    source = tmp_path / "book.xlsx"
+    write_two_sheets(source, "one")
+    run(source, cache=True)
+    # Only the second sheet changed: the output cache misses, the first is reused
+    write_two_sheets(source, "two")
+    with caplog.at_level(logging.INFO, logger=LOGGER_NAME):
+        output = run(source, cache=True)
+    assert "Sheet 'Sheet' unchanged since the last run, reused" in caplog.text
+    assert "Sheet 'Second' unchanged" not in caplog.text
+    wb = load_workbook(output)
+    assert [wb["Sheet"]["A2"].value, wb["Second"]["A2"].value] == ["AAA", "two"]
+
+
+def test_uncached_run_drops_fingerprints(sources):
+    source, a, b = sources
+    run(source, cache=True)
+    shutil.copy2(b, source)
+    run(source, cache=False)
+    assert SheetManifest(source.parent / "Deeva").get(source.name, source) == {}
+
+    shutil.copy2(a, source)
+    output = run(source, cache=True)
+    assert file_result(output)[2][1] == "AAA"
+
+
+def test_excel_engine_run_drops_fingerprints(sources, monkeypatch):
+    source, a, b = sources
+    run(source, cache=True)
+
+    def excel(self, source_path, output_file):
+        shutil.copy2(b, output_file)
+    monkeypatch.setattr(ExcelProcessor, "_process_with_vbscript", excel)
+    ExcelProcessor(Config(engine="vbs", cache=False)).process_file(str(source))
+
+    manifest = (source.parent / "Deeva" / SHEETS_MANIFEST_NAME).read_text()
+    assert source.name not in manifest
+    output = run(source, cache=True)
+    assert file_result(output)[2][1] == "AAA"
+
+
+def test_fingerprints_refused_for_other_output(sources):
+    source, a, b = sources
+    output = run(source, cache=True)
+    manifest = SheetManifest(output.parent)
+    assert manifest.get(output.name, output)
+
+    shutil.copy2(b, output)
+    assert manifest.get(output.name, output) == {}
+
+
+def test_identical_rerun_is_a_hit(sources, monkeypatch):
+    source, a, b = sources
+    output = run(source, cache=True)
+    first = output.read_bytes()
+
+    def engine(self, source_path, output_file):
+        raise AssertionError("processed again")
+    monkeypatch.setattr(ExcelProcessor, "_process_with_stream", engine)
+    run(source, cache=True)
+    assert output.read_bytes() == first
+
+
+def test_key_follows_input_and_settings(sources):
+    source, a, b = sources
+    key = cache_key(a, Config(engine="stream"))
+    assert cache_key(source, Config(engine="stream")) == key
+    assert cache_key(b, Config(engine="stream")) != key
+    assert cache_key(a, Config(engine="openpyxl")) != key
+    assert cache_key(a, Config(engine="stream", header_color=255)) != key
+
+
+def test_changed_input_is_processed(sources):
+    source, a, b = sources
+    run(source, cache=True)
+    shutil.copy2(b, source)
+    output = run(source, cache=True)
+    assert file_result(output)[2][1] == "BBB"
+
+
+@pytest.mark.parametrize("change", ["size", "mtime"])
+def test_entry_rejected_when_output_changed(tmp_path, change):
+    output = tmp_path / "out.xlsx"
+    output.write_bytes(b"output")
+    cache = OutputCache(tmp_path)
+    cache.store("key", output)
+    assert cache.lookup("key") == output.resolve()
+
+    stat = output.stat()
+    if change == "size":
+        output.write_bytes(b"edited output")
+        os.utime(output, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    else:
+        os.utime(output, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.lookup("key") is None
+    assert not cache.materialize("key", tmp_path / "other.xlsx")
+
+
+def test_materialized_output_is_never_written_through(sources, tmp_path):
+    source, a, b = sources
+    store = tmp_path / "store"
+    output = run(source, cache=True, cache_dir=str(store))
+    first = output.read_bytes()
+    key = cache_key(a, Config(engine="stream"))
+    stored = OutputCache(output.parent, store).lookup(key)
+    # The output is the stored file itself, or a copy of it
+    assert stored.read_bytes() == first
+
+    shutil.copy2(b, source)
+    run(source, cache=True, cache_dir=str(store))
+    assert stored.read_bytes() == first
+    assert OutputCache(output.parent, store).lookup(key) == stored
+
+    shutil.copy2(a, source)
+    assert run(source, cache=True, cache_dir=str(store)).read_bytes() == first
@@ -0,0 +1,208 @@
+"""The file engines apply V2 plans exactly like ExcelProcessorV2 in Excel.
+
+Random sheets are written with openpyxl and loaded into the fake COM
+model; V2 processes the fake sheet and the openpyxl engine processes the
+file, both in memory (``apply_plan``) and by streaming the sheet XML
+(``process_file``). Values and formulas must come out the same.
+"""
+import random
+import re
+import zipfile
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.comments import Comment
+from openpyxl.workbook.defined_name import DefinedName
+from openpyxl.styles import PatternFill
+
+from config import Config
+from excel_processor_openpyxl import ExcelProcessorOpenpyxl
+from excel_processor_v2 import ExcelProcessorV2
+from fake_com import FakeApplication
+
+YELLOW = 65535
+YELLOW_FILL = PatternFill("solid", fgColor="FFFF00")
+COLUMNS = 6
+
+
+def random_rows(seed):
+    """``{row: {col: (content, is_header)}}`` of header blocks and data groups."""
+    rnd = random.Random(seed)
+    rows = {}
+    row = 1
+    if rnd.random() < 0.5:
+        rows[row] = {1: ("Title", False)}
+        row += 2
+    for _ in range(rnd.randint(1, 5)):
+        rows[row] = {col: (f"H{col}", True) for col in range(1, COLUMNS + 1)}
+        row += 1
+        for _ in range(rnd.randint(1, 4)):
+            rows[row] = {col: (rnd.randint(1, 99), False) for col in range(1, COLUMNS)}
+            rows[row][COLUMNS] = (None, False)
+            row += 1
+        # Blank separator, or the next header right away
+        if rnd.random() < 0.7:
+            row += 1
+    last_row = row
+    for row, cells in rows.items():
+        if cells.get(COLUMNS, ("", True))[0] is None:
+            cells[COLUMNS] = (random_formula(rnd, row, last_row), False)
+    return rows
+
+
+def random_formula(rnd, row, last_row):
+    kind = rnd.randrange(5)
+    other = rnd.randint(1, last_row)
+    if kind == 0:
+        return f"=LEN(C{row})&B{row}"
+    if kind == 1:
+        return f"=A{other}+1"
+    if kind == 2:
+        first, last = sorted((rnd.randint(1, last_row), rnd.randint(1, last_row)))
+        return f"=SUM(B{first}:B{last})"
+    if kind == 3:
+        return f"=$A${other}*2"
+    return f"=B{row}-A{max(row - 1, 1)}"
+
+
+def write_workbook(path, rows):
+    wb = Workbook()
+    ws = wb.active
+    for row, cells in rows.items():
+        for col, (content, header) in cells.items():
+            cell = ws.cell(row, col, content)
+            if header:
+                cell.fill = YELLOW_FILL
+    wb.save(path)
+
+
+def v2_result(rows):
+    app = FakeApplication()
+    sheet = app.Workbooks.Add().Sheets(1)
+    for row, cells in rows.items():
+        for col, (content, header) in cells.items():
+            if isinstance(content, str) and content.startswith("="):
+                sheet.set_cell(row, col, formula=content)
+            else:
+                sheet.set_cell(row, col, value=content, color=YELLOW if header else None)
+    ExcelProcessorV2(Config()).process_sheet(sheet)
+    return sheet.rows_snapshot()
+
+
+def file_result(path):
+    ws = load_workbook(path).active
+    return {
+        cell.row: {c.column: c.value for c in row if c.value is not None}
+        for row in ws.iter_rows() for cell in row[:1]
+        if any(c.value is not None for c in row)
+    }
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_same_as_v2(tmp_path, seed):
+    rows = random_rows(seed)
+    source = tmp_path / "in.xlsx"
+    write_workbook(source, rows)
+    expected = v2_result(rows)
+
+    streamed = tmp_path / "streamed.xlsx"
+    ExcelProcessorOpenpyxl(Config()).process_file(source, streamed)
+    assert file_result(streamed) == expected
+
+    wb = load_workbook(source)
+    processor = ExcelProcessorOpenpyxl(Config())
+    plan = processor.plan_sheet(wb.active)
+    processor.apply_plan(wb.active, plan)
+    in_memory = tmp_path / "in_memory.xlsx"
+    wb.save(in_memory)
+    assert file_result(in_memory) == expected
+
+
+def test_copied_formula_rewritten_once(tmp_path):
+    rows = {
+        1: {col: (f"H{col}", True) for col in range(1, 4)},
+        2: {1: (1, False), 2: (2, False), 3: ("=LEN(C2)&B2", False)},
+        3: {1: (3, False), 2: (4, False), 3: ("=LEN(C3)&B3", False)},
+    }
+    source = tmp_path / "in.xlsx"
+    write_workbook(source, rows)
+    output = tmp_path / "out.xlsx"
+    ExcelProcessorOpenpyxl(Config()).process_file(source, output)
+    result = file_result(output)
+    assert result[4][3] == "=LEN(C4)&B4"
+    assert result[5][3] == "=LEN(C4)&B5"
+    assert result == v2_result(rows)
+
+
+def test_comments_follow_their_rows(tmp_path):
+    rows = {
+        1: {col: (f"H{col}", True) for col in range(1, 3)},
+        2: {1: (1, False), 2: (2, False)},
+        3: {1: (3, False), 2: (4, False)},
+        5: {1: (5, False)},
+    }
+    source = tmp_path / "in.xlsx"
+    write_workbook(source, rows)
+    wb = load_workbook(source)
+    wb.active["B3"].comment = Comment("grouped", "a")
+    wb.active["A5"].comment = Comment("below", "a")
+    wb.save(source)
+
+    output = tmp_path / "out.xlsx"
+    ExcelProcessorOpenpyxl(Config()).process_file(source, output)
+    ws = load_workbook(output).active
+    comments = {cell.coordinate: cell.comment.text for row in ws.iter_rows()
+                for cell in row if cell.comment}
+    # The group is duplicated below itself, the copy keeps the comment
+    assert comments == {"B3": "grouped", "B5": "grouped", "A7": "below"}
+    assert file_result(output) == v2_result(rows)
+
+    with zipfile.ZipFile(output) as zf:
+        vml = zf.read("xl/drawings/commentsDrawing1.vml").decode()
+    assert sorted(int(row) for row in re.findall(r":Row>(\d+)<", vml)) == [2, 4, 6]
+
+
+def write_linked_workbook(path, rows, refs):
+    """``rows`` on sheet 'My Data', a 'Summary' sheet and a defined name pointing into it.
+
+    ``refs`` are ``{row: value}``: 'Summary' and the name ``Picked`` refer to
+    the cells of column A holding those values.
+    """
+    write_workbook(path, rows)
+    wb = load_workbook(path)
+    data = wb.active
+    data.title = "My Data"
+    summary = wb.create_sheet("Summary")
+    for index, row in enumerate(refs, 1):
+        summary.cell(index, 1, f"='My Data'!A{row}")
+        # Qualified with its own sheet, the reference moves like an unqualified one
+        data.cell(row, 3, f"='my data'!$A${row}")
+    wb.defined_names["Picked"] = DefinedName("Picked", attr_text=f"'My Data'!$A${min(refs)}")
+    wb.save(path)
+
+
+def check_linked_workbook(path, refs):
+    wb = load_workbook(path)
+    data, summary = wb["My Data"], wb["Summary"]
+    for index, value in enumerate(refs.values(), 1):
+        row = int(re.search(r"A(\d+)$", summary.cell(index, 1).value).group(1))
+        assert data.cell(row, 1).value == value
+        assert data.cell(row, 3).value == f"='my data'!$A${row}"
+    name_row = int(re.search(r"\$A\$(\d+)$", wb.defined_names["Picked"].attr_text).group(1))
+    assert data.cell(name_row, 1).value == refs[min(refs)]
+
+
+def test_references_from_other_sheets_follow_their_rows(tmp_path):
+    rows = {
+        1: {col: (f"H{col}", True) for col in range(1, 3)},
+        2: {1: ("a", False), 2: (1, False)},
+        3: {1: ("b", False), 2: (2, False)},
+        5: {col: (f"H{col}", True) for col in range(1, 3)},
+        6: {1: ("c", False), 2: (3, False)},
+    }
+    refs = {3: "b", 6: "c"}
+    source = tmp_path / "in.xlsx"
+    write_linked_workbook(source, rows, refs)
+    output = tmp_path / "out.xlsx"
+    ExcelProcessorOpenpyxl(Config()).process_file(source, output)
+    check_linked_workbook(output, refs)
@@ -0,0 +1,80 @@
+from openpyxl import Workbook
+
+from config import Config
+from excel_processor_stream import ExcelProcessorStream
+from progress import FileWork, ProgressTracker, Throttle
+from test_plan_engines import YELLOW_FILL
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_throttle_keeps_first_and_last_updates():
+    clock = Clock()
+    calls = []
+    throttled = Throttle(lambda *args: calls.append(args), min_interval=0.25, clock=clock)
+    for now, done in [(0.0, 1), (0.1, 2), (0.2, 3), (0.3, 4), (0.4, 5), (0.45, 6)]:
+        clock.now = now
+        throttled(done, 6)
+    assert calls == [(1, 6), (4, 6), (6, 6)]
+
+
+def test_tracker_throttles_sheets_but_not_files():
+    clock = Clock()
+    tracker = ProgressTracker({"a": FileWork(100, 4)}, min_interval=0.25, clock=clock)
+    assert tracker.sheet_done("a", 1, 4)
+    clock.now = 0.1
+    assert not tracker.sheet_done("a", 2, 4)
+    clock.now = 0.2
+    assert tracker.file_done("a")
+    assert tracker.snapshot().percent == 100
+
+
+def test_percent_never_goes_back():
+    clock = Clock()
+    work = {"small": FileWork(100, 2), "big": FileWork(900, 3), "xls": FileWork(0, 1, rows_known=False)}
+    tracker = ProgressTracker(work, clock=clock)
+    percents = []
+    events = [
+        ("sheet", "big", 1, 3), ("sheet", "small", 1, 2), ("sheet", "big", 2, 3),
+        # A late, older report of the same file
+        ("sheet", "big", 1, 3), ("file", "small"), ("sheet", "xls", 1, 1),
+        ("sheet", "big", 3, 3), ("file", "big"), ("file", "xls"),
+    ]
+    for event in events:
+        clock.now += 1
+        if event[0] == "sheet":
+            tracker.sheet_done(*event[1:])
+        else:
+            tracker.file_done(event[1])
+        percents.append(tracker.snapshot().percent)
+    assert percents == sorted(percents)
+    assert percents[0] > 0 and percents[-1] == 100
+    # Files weigh their rows: a sheet of the big file moves more than the small file
+    assert percents[0] > percents[1] - percents[0]
+
+
+def test_stream_engine_reports_every_sheet(tmp_path):
+    path = tmp_path / "book.xlsx"
+    wb = Workbook()
+    for index in range(3):
+        ws = wb.active if index == 0 else wb.create_sheet(f"Sheet{index + 1}")
+        ws.cell(1, 1, "Head").fill = YELLOW_FILL
+        ws.cell(2, 1, index)
+    wb.save(path)
+
+    tracker = ProgressTracker({str(path): FileWork(6, 3)}, min_interval=0)
+    reports = []
+
+    def sheet_done(done, total):
+        tracker.sheet_done(str(path), done, total)
+        reports.append((done, total, tracker.snapshot().percent))
+    processor = ExcelProcessorStream(Config(engine="stream", cache=False))
+    processor.set_progress_callback(sheet_done)
+    processor.process_file(path, tmp_path / "out.xlsx")
+    assert reports == [(1, 3, 33), (2, 3, 66), (3, 3, 100)]
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import PatternFill
+
+from config import Config
+from excel_processor_openpyxl import ExcelProcessorOpenpyxl
+from sheet_scan import scan_workbook_blocks
+
+YELLOW = PatternFill("solid", fgColor="FFFF00")
+
+
+def make_workbook(path, rows, seed):
+    """Random headers, data rows, blank rows and colored blank cells."""
+    rnd = random.Random(seed)
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, rows + 1):
+        kind = rnd.choice("hhdddddbbx")
+        if kind == "h":
+            ws.cell(row, rnd.randint(1, 9), "Head").fill = YELLOW
+        elif kind == "d":
+            ws.cell(row, rnd.randint(1, 12), rnd.choice(["x", 5, '=A1&""', "  y "]))
+        elif kind == "x":
+            ws.cell(row, 2, " ").fill = YELLOW
+    ws.cell(1, 12, "w")
+    wb.save(path)
+
+
+def openpyxl_blocks(path):
+    ws = load_workbook(path).active
+    processor = ExcelProcessorOpenpyxl(Config())
+    return processor._find_all_blocks(processor._scan_rows(ws))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_chunks_match_whole_sheet(tmp_path, seed):
+    path = tmp_path / "scan.xlsx"
+    make_workbook(path, random.Random(seed).randint(1, 400), seed)
+
+    whole = scan_workbook_blocks(path, 65535)
+    assert list(whole.values()) == [openpyxl_blocks(path)]
+    for chunk_bytes in (50, 200, 1000):
+        assert scan_workbook_blocks(path, 65535, chunk_bytes=chunk_bytes) == whole
+
+
+def test_chunks_in_worker_processes(tmp_path):
+    path = tmp_path / "scan.xlsx"
+    make_workbook(path, 400, seed=1)
+    assert scan_workbook_blocks(path, 65535, workers=2, chunk_bytes=200) == \
+        scan_workbook_blocks(path, 65535)
@@ -0,0 +1,24 @@
+from openpyxl import Workbook
+
+from test_plan_engines import YELLOW, YELLOW_FILL
+from triage import triage_workbook
+
+
+def test_engines_pick_their_own_sheets(tmp_path):
+    wb = Workbook()
+    # Headers below row 20 are found by ExcelProcessorV2 but not by FindHeader
+    late = wb.active
+    late.cell(1, 1, "Title")
+    for row in (30, 40):
+        late.cell(row, 1, "Head").fill = YELLOW_FILL
+        late.cell(row + 1, 1, 1)
+    # A single header is found by FindHeader but ExcelProcessorV2 needs two
+    single = wb.create_sheet()
+    single.cell(1, 1, "Head").fill = YELLOW_FILL
+    single.cell(2, 1, 1)
+    path = tmp_path / "triage.xlsx"
+    wb.save(path)
+
+    triage = triage_workbook(path, YELLOW)
+    assert [sheet.index for sheet in triage.v2_sheets] == [1]
+    assert [sheet.index for sheet in triage.sheets_to_process] == [2]
@@ -0,0 +1,395 @@
+import json
+import re
+from bisect import bisect_left
+from dataclasses import asdict, dataclass, field
+from itertools import accumulate
+from typing import List
+
+from formula_refs import rewrite_row_refs
+from ooxml import column_letter
+
+LEN_RE = re.compile(r'(LEN|ДЛСТР)\s*\([^)]+\)', re.IGNORECASE)
+
+
+@dataclass
+class RowTarget:
+    """Where a source row ends up in the processed sheet."""
+    row: int
+    copy_index: int = -1  # -1 for the original row
+    paste_offset: int = 0  # how far the copy was pasted below its source
+    group_end: int = 0  # last source row of the copied group
+
+
+@dataclass
+class FormulaFixup:
+    """A copied ``LEN(``/``ДЛСТР(`` formula that must point at ``ref_row``."""
+    row: int
+    column: int
+    ref_row: int
+
+
+@dataclass
+class ShapeCopy:
+    """A shape anchored in ``source_row`` that is copied to ``target_row``."""
+    source_row: int
+    target_row: int
+
+
+@dataclass
+class TransformPlan:
+    """Complete row transformation of one sheet, computed from a single scan.
+
+    Source rows are the rows of the unprocessed sheet, target rows are the
+    rows of the processed one. Every data group is duplicated right below
+    itself and ``removed_rows`` (duplicated headers) are dropped afterwards.
+    """
+    last_row: int
+    groups: List[List[int]] = field(default_factory=list)
+    removed_rows: List[int] = field(default_factory=list)
+    formula_fixups: List[FormulaFixup] = field(default_factory=list)
+    shape_copies: List[ShapeCopy] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.groups = [list(group) for group in self.groups]
+        self.removed_rows = sorted(self.removed_rows)
+        self.formula_fixups = [
+            f if isinstance(f, FormulaFixup) else FormulaFixup(**f) for f in self.formula_fixups
+        ]
+        self.shape_copies = [
+            s if isinstance(s, ShapeCopy) else ShapeCopy(**s) for s in self.shape_copies
+        ]
+
+        ordered = sorted(self.groups, key=lambda group: group[-1])
+        self._group_ends = [group[-1] for group in ordered]
+        self._inserted_before = [0] + list(accumulate(len(group) for group in ordered))
+        self._group_of = {row: group for group in self.groups for row in group}
+
+        removed = set()
+        for row in self.removed_rows:
+            removed.update(target for target, _, _ in self._pre_targets(row))
+        self._removed_pre = sorted(removed)
+        self._fixup_index = None
+
+    @property
+    def inserted_rows(self):
+        return self._inserted_before[-1]
+
+    @property
+    def removed_count(self):
+        return len(self._removed_pre)
+
+    @property
+    def removed_pre_rows(self):
+        """Rows to delete once every group has been duplicated."""
+        return list(self._removed_pre)
+
+    @property
+    def final_last_row(self):
+        return self.last_row + self.inserted_rows - self.removed_count
+
+    def targets(self, source_row):
+        """Return the ``RowTarget`` list of a source row, original first."""
+        group = self._group_of.get(source_row)
+        result = []
+        for pre, copy_index, offset in self._pre_targets(source_row):
+            row = self.final_row(pre)
+            if row:
+                result.append(RowTarget(row, copy_index, offset, group[-1] if group else 0))
+        return result
+
+    def cell_targets(self, source_row):
+        """``targets`` of the cell contents, such as comments, of a source row."""
+        return self.targets(source_row)
+
+    def map_reference(self, row, absolute=False, target=None):
+        """Map a row referenced by a formula to its processed position.
+
+        Relative references of a copy (``target`` with a ``copy_index``)
+        are shifted the way the paste shifted them. Returns 0 for rows that
+        were removed.
+        """
+        if absolute or target is None or target.copy_index < 0:
+            return self.final_row(self.pre_row(row))
+        return self.final_row(self._pasted_pre_row(row, target))
+
+    def _pasted_pre_row(self, row, target):
+        # Groups are duplicated bottom-up: when a group is pasted the groups
+        # below it, and itself, are inserted already and the ones above not
+        index = bisect_left(self._group_ends, target.group_end)
+        inserted = self._inserted_before[index]
+        below = self._inserted_before[bisect_left(self._group_ends, row)] - inserted
+        current = row + max(below, 0) + target.paste_offset
+        return current + self._inserted_before[min(index, bisect_left(self._group_ends, current))]
+
+    def rewrite_formula(self, formula, target, column, sheet_name=None, other_sheets=None):
+        """Adjust a formula moved or copied to ``target`` in ``column``.
+
+        References follow the rows they point at, the way Excel adjusts
+        them on insert and delete, and relative references of copies are
+        shifted like a paste. References naming ``sheet_name`` are on this
+        sheet, those into other sheets follow ``other_sheets``, an
+        ``OtherSheets``. Planned ``LEN(`` fixups are applied last.
+        """
+        offset = target.paste_offset
+
+        def remap(row, absolute, other_sheet):
+            if other_sheet:
+                return other_sheet_row(other_sheets, other_sheet, row, absolute, offset)
+            return self.map_reference(row, absolute, target)
+
+        formula = rewrite_row_refs(formula, remap, sheet_name=sheet_name)
+        ref_row = self._fixups().get((target.row, column))
+        if ref_row:
+            col_letter = column_letter(column)
+            formula = LEN_RE.sub(lambda m: f"{m.group(1)}({col_letter}{ref_row})", formula)
+        return formula
+
+    def _fixups(self):
+        if self._fixup_index is None:
+            self._fixup_index = {(f.row, f.column): f.ref_row for f in self.formula_fixups}
+        return self._fixup_index
+
+    def pre_row(self, source_row):
+        """Row of the original after duplication, before headers are removed."""
+        return source_row + self._inserted_before[bisect_left(self._group_ends, source_row)]
+
+    def final_row(self, pre_row):
+        index = bisect_left(self._removed_pre, pre_row)
+        if index < len(self._removed_pre) and self._removed_pre[index] == pre_row:
+            return 0
+        return pre_row - index
+
+    def _pre_targets(self, source_row):
+        pre = self.pre_row(source_row)
+        targets = [(pre, -1, 0)]
+        group = self._group_of.get(source_row)
+        if group:
+            insert_row = self.pre_row(group[-1]) + 1
+            i = source_row - group[0]
+            targets.append((insert_row + i, i, len(group)))
+        return targets
+
+    def to_dict(self):
+        return {
+            "last_row": self.last_row,
+            "groups": self.groups,
+            "removed_rows": self.removed_rows,
+            "formula_fixups": [asdict(f) for f in self.formula_fixups],
+            "shape_copies": [asdict(s) for s in self.shape_copies],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+
+class OtherSheets:
+    """Row maps of the other sheets whose rows move, by sheet name.
+
+    ``maps`` is ``{name: (row_map, before)}``, where a row map answers
+    ``map_reference(row, True)`` like a ``TransformPlan`` and ``before``
+    tells that the sheet is processed before the sheet holding the
+    formulas. Sheet names compare case-insensitively, as in Excel.
+    """
+
+    def __init__(self, maps):
+        self.maps = {name.lower(): entry for name, entry in maps.items()}
+
+    def remap(self, sheet, row, absolute, shift=0):
+        """Row a reference into ``sheet`` points at, ``None`` if its rows stay.
+
+        ``shift`` is the paste offset of a copied formula. Excel moves the
+        reference when the other sheet's rows move and shifts it when the
+        formula is pasted, in the order the sheets are processed.
+        """
+        entry = self.maps.get(sheet.lower())
+        if entry is None:
+            return None
+        row_map, before = entry
+        if absolute or not shift:
+            return row_map.map_reference(row, True)
+        if before:
+            moved = row_map.map_reference(row, True)
+            return moved + shift if moved else 0
+        return row_map.map_reference(row + shift, True)
+
+
+def other_sheet_row(other_sheets, sheet, row, absolute, shift=0):
+    """``OtherSheets.remap`` that keeps rows of unmapped sheets, shifted like a paste."""
+    moved = other_sheets.remap(sheet, row, absolute, shift) if other_sheets else None
+    if moved is not None:
+        return moved
+    return row if absolute else row + shift
+
+
+def find_blocks(last_row, is_header, has_data, first_row=1):
+    """Group rows into header blocks and blank-separated data groups.
+
+    ``is_header(row)`` and ``has_data(row)`` answer for a single row, so the
+    same scan serves per-cell COM access, bulk-read grids and openpyxl.
+    Returns ``[{'header_row': int, 'data_groups': [[row, ...], ...]}, ...]``.
+    """
+    blocks = []
+    current_row = first_row
+
+    while current_row <= last_row:
+        if not is_header(current_row):
+            current_row += 1
+            continue
+
+        block = {
+            'header_row': current_row,
+            'data_groups': []
+        }
+
+        current_row += 1
+        current_group = []
+
+        while current_row <= last_row:
+            if is_header(current_row):
+                break
+
+            if not has_data(current_row):
+                current_row += 1
+                break
+
+            current_group.append(current_row)
+            current_row += 1
+
+        if current_group:
+            block['data_groups'].append(current_group)
+
+        if block['data_groups']:
+            blocks.append(block)
+
+    return blocks
+
+
+def find_blocks_from_masks(is_header, has_data, first_row=1):
+    """Vectorized ``find_blocks`` over per-row boolean masks.
+
+    ``is_header[i]`` and ``has_data[i]`` describe row ``first_row + i``.
+    Every header starts a block whose group is the run of data rows right
+    below it, up to the next header or blank row, so the groups are the
+    data runs (found with ``np.diff``) that start right after a header.
+    Falls back to ``find_blocks`` when NumPy is not installed.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return find_blocks(
+            first_row + len(is_header) - 1,
+            lambda row: is_header[row - first_row],
+            lambda row: has_data[row - first_row],
+            first_row,
+        )
+
+    headers = np.asarray(is_header, dtype=bool)
+    data = np.asarray(has_data, dtype=bool) & ~headers
+
+    # +1 where a run of data rows starts, -1 right after it ends
+    edges = np.diff(np.concatenate(([0], data.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    after_header = np.zeros(len(starts), dtype=bool)
+    after_header[starts > 0] = headers[starts[starts > 0] - 1]
+
+    return [
+        {
+            'header_row': first_row + start - 1,
+            'data_groups': [list(range(first_row + start, first_row + end))]
+        }
+        for start, end in zip(starts[after_header].tolist(), ends[after_header].tolist())
+    ]
+
+
+@dataclass
+class ChunkRuns:
+    """Data runs of one chunk of rows, for scanning a sheet in pieces.
+
+    A run is ``[start, end, header_before]``. ``header_before`` is ``None``
+    for a run that starts on the chunk's first row, because the row above
+    it belongs to the previous chunk; ``stitch_blocks`` settles it.
+    """
+    first_row: int = 0  # 0 while the chunk holds no rows
+    last_row: int = 0
+    last_is_header: bool = False
+    runs: List[list] = field(default_factory=list)
+
+    def add_row(self, row, is_header, has_data):
+        """Add the next row in sheet order; rows never added are blank."""
+        if not self.first_row:
+            self.first_row = row
+        if has_data and not is_header:
+            if self.runs and self.runs[-1][1] == row - 1:
+                self.runs[-1][1] = row
+            elif row == self.first_row:
+                self.runs.append([row, row, None])
+            else:
+                header_before = self.last_is_header and self.last_row == row - 1
+                self.runs.append([row, row, header_before])
+        self.last_row = row
+        self.last_is_header = is_header
+
+
+def stitch_blocks(chunks):
+    """Join the ``ChunkRuns`` of consecutive chunks into ``find_blocks`` output.
+
+    A run cut by a chunk boundary continues the run that ends on the last
+    row of the previous chunk; any other run at a chunk start follows a
+    header only if that last row is one.
+    """
+    runs = []
+    last_row, last_is_header = 0, False
+    for chunk in chunks:
+        for start, end, header_before in chunk.runs:
+            if header_before is None:
+                if runs and runs[-1][1] == start - 1:
+                    runs[-1][1] = end
+                    continue
+                header_before = last_is_header and last_row == start - 1
+            runs.append([start, end, header_before])
+        if chunk.last_row:
+            last_row, last_is_header = chunk.last_row, chunk.last_is_header
+
+    return [
+        {
+            'header_row': start - 1,
+            'data_groups': [list(range(start, end + 1))]
+        }
+        for start, end, header_before in runs if header_before
+    ]
+
+
+def build_plan(blocks, last_row, removed_rows=(), formula_cells=(), shape_rows=()):
+    """Build a ``TransformPlan`` from ``_find_all_blocks`` output.
+
+    ``formula_cells`` lists the ``(row, column)`` of cells whose formula
+    contains ``LEN(``/``ДЛСТР(``; their copies get a ``FormulaFixup`` with
+    the row ``ExcelProcessorV2._duplicate_block_rows`` would point them at.
+    ``shape_rows`` lists the rows holding the top left corner of a shape.
+    """
+    groups = [group for block in blocks for group in block['data_groups'] if group]
+    plan = TransformPlan(last_row, groups, removed_rows)
+
+    for row, column in formula_cells:
+        for pre, copy_index, _ in plan._pre_targets(row)[1:]:
+            ref_pre = pre - 1 if copy_index > 0 else pre
+            target, ref_row = plan.final_row(pre), plan.final_row(ref_pre)
+            if target and ref_row:
+                plan.formula_fixups.append(FormulaFixup(target, column, ref_row))
+    plan._fixup_index = None
+
+    for row in shape_rows:
+        for target in plan.targets(row)[1:]:
+            plan.shape_copies.append(ShapeCopy(row, target.row))
+
+    return plan
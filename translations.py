@@ -20,6 +20,7 @@ translations = {
         'files_loaded': '{count} files loaded',
         'processing': 'Processing: {filename}',
         'sheets_progress': 'Sheets: {processed}/{total}',
+        'progress_rate': '{rows} rows/s, {eta} left',
         'summary': '<b>Summary:</b><br>',
         'total_files': 'Total files: {total}<br>',
         'success': '\u2713 Success: {count}<br>',
@@ -34,6 +35,8 @@ translations = {
         'menu_check_updates': 'Check for Updates',
         'menu_about': 'About',
         'menu_language': 'Language',
+        'menu_parallel_files': 'Parallel Files',
+        'workers_all': 'All Cores',
         'lang_en': 'English',
         'lang_ru': 'Русский',
         'about_title': 'About',
@@ -108,6 +111,7 @@ translations = {
         'files_loaded': 'Загружено файлов: {count}',
         'processing': 'Обработка: {filename}',
         'sheets_progress': 'Листы: {processed}/{total}',
+        'progress_rate': '{rows} строк/с, осталось {eta}',
         'summary': '<b>Сводка:</b><br>',
         'total_files': 'Всего файлов: {total}<br>',
         'success': '\u2713 Успешно: {count}<br>',
@@ -122,6 +126,8 @@ translations = {
         'menu_check_updates': 'Проверить обновления',
         'menu_about': 'О программе',
         'menu_language': 'Язык',
+        'menu_parallel_files': 'Параллельные файлы',
+        'workers_all': 'Все ядра',
         'lang_en': 'English',
         'lang_ru': 'Русский',
         'about_title': 'О программе',
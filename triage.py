@@ -0,0 +1,240 @@
+import xml.etree.ElementTree as ET
+import zipfile
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from excel_colors import bgr_to_rgb
+from excel_styles import StyleResolver
+from ooxml import MAIN_NS, REL_NS, SheetStreamParser, part_rels, split_cell_ref
+
+# Rows FindHeader in excel_processor.vbs looks at
+VBS_HEADER_ROWS = 20
+# Rows and columns ExcelProcessorV2.can_process looks at
+V2_HEADER_ROWS = 49
+V2_HEADER_COLUMNS = 9
+
+
+@dataclass
+class SheetTriage:
+    index: int  # position in the workbook, as in ``wb.Sheets(index)``
+    name: str
+    part: Optional[str]  # None for chart and dialog sheets
+    has_header: bool = False  # FindHeader would find a header
+    header_rows: int = 0  # header rows in the rows can_process looks at
+    rows: int = 0  # rows spanned according to the part's <dimension>, 0 if unknown
+
+    @property
+    def can_process(self):
+        return self.header_rows >= 2
+
+
+@dataclass
+class WorkbookTriage:
+    path: str
+    sheets: List[SheetTriage] = field(default_factory=list)
+
+    @property
+    def sheet_count(self):
+        return len(self.sheets)
+
+    @property
+    def sheets_to_process(self):
+        """Sheets excel_processor.vbs restructures."""
+        return [sheet for sheet in self.sheets if sheet.has_header]
+
+    @property
+    def needs_processing(self):
+        return bool(self.sheets_to_process)
+
+    @property
+    def v2_sheets(self):
+        """Sheets ExcelProcessorV2 processes."""
+        return [sheet for sheet in self.sheets if sheet.can_process]
+
+
+class _EnoughRows(Exception):
+    pass
+
+
+def triage_workbook(path, header_color):
+    """Report what processing would do without opening Excel.
+
+    Only the zip directory, ``workbook.xml``, ``styles.xml`` and the first
+    rows of each worksheet part are read. Returns ``None`` for files that
+    are not OOXML packages (``.xls``, ``.xlsb``), which need Excel.
+    """
+    if not zipfile.is_zipfile(path):
+        return None
+
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+        if "xl/workbook.xml" not in names:
+            return None
+
+        styles = StyleResolver.from_zip(zf)
+        header_styles = styles.header_styles(bgr_to_rgb(header_color))
+        rels = part_rels(zf, "xl/workbook.xml")
+        root = ET.fromstring(zf.read("xl/workbook.xml"))
+
+        result = WorkbookTriage(str(path))
+        pending = []
+        for index, sheet in enumerate(root.iter(f"{{{MAIN_NS}}}sheet"), 1):
+            rel = rels.get(sheet.get(f"{{{REL_NS}}}id"))
+            part = rel[1] if rel and rel[0].endswith("/worksheet") else None
+            if part and not part.endswith(".xml"):
+                return None
+
+            triage = SheetTriage(index, sheet.get("name"), part)
+            result.sheets.append(triage)
+            if part in names and header_styles:
+                scanner = _HeaderScanner(header_styles)
+                with zf.open(part) as stream:
+                    scanner.scan(stream)
+                triage.has_header = scanner.has_header
+                triage.rows = scanner.rows_count or 0
+                pending.append((triage, scanner))
+
+        shared = _read_shared_strings(
+            zf, max((s.max_shared_index for _, s in pending), default=-1)
+        )
+        for triage, scanner in pending:
+            triage.header_rows = scanner.count_header_rows(shared)
+
+    return result
+
+
+class _HeaderScanner:
+    """Collect header information from the first rows of a worksheet part."""
+
+    def __init__(self, header_styles):
+        self.header_styles = header_styles
+        self.rows_count = None
+        self.cols_count = None
+        self.has_header = False
+        self.max_shared_index = -1
+
+        self._next_row = 1
+        self._vbs_done = False
+        # row -> values of non-empty header colored cells in the V2 columns
+        self._v2_candidates = {}
+
+    def scan(self, stream):
+        parser = SheetStreamParser(
+            lambda *args: None, lambda *args: None, lambda *args: None,
+            self._on_element, self._on_row
+        )
+        try:
+            parser.parse(stream)
+        except _EnoughRows:
+            pass
+
+    def count_header_rows(self, shared):
+        count = 0
+        for values in self._v2_candidates.values():
+            for value in values:
+                if isinstance(value, int):
+                    value = shared[value] if value < len(shared) else ""
+                if value.strip():
+                    count += 1
+                    break
+        return count
+
+    def _on_element(self, node):
+        if node.tag == "dimension":
+            corners = [split_cell_ref(part) for part in node.attrs.get("ref", "").split(":")]
+            if corners and None not in corners:
+                self.cols_count = corners[-1][0] - corners[0][0] + 1
+                self.rows_count = corners[-1][1] - corners[0][1] + 1
+
+    def _on_row(self, node):
+        row = int(node.attrs.get("r", self._next_row))
+        self._next_row = row + 1
+        if row > max(VBS_HEADER_ROWS, V2_HEADER_ROWS) or (self.rows_count and row > self.rows_count):
+            raise _EnoughRows()
+
+        cols_count = self.cols_count or float("inf")
+        row_style = node.attrs.get("s") if node.attrs.get("customFormat") in ("1", "true") else None
+        cells = []
+        col = 0
+        for cell in node.elements():
+            ref = split_cell_ref(cell.attrs.get("r"))
+            col = ref[0] if ref else col + 1
+            if col <= cols_count:
+                cells.append((col, cell))
+
+        if row <= VBS_HEADER_ROWS and not self._vbs_done:
+            self._check_vbs_header(cells, row_style, cols_count)
+        if row <= V2_HEADER_ROWS:
+            self._collect_v2_candidates(row, cells)
+
+    def _check_vbs_header(self, cells, row_style, cols_count):
+        colored = any(self._is_header_style(cell.attrs.get("s")) for _, cell in cells)
+        # Cells missing from the XML take the row format
+        if not colored and row_style is not None and self._is_header_style(row_style):
+            colored = len(cells) < cols_count
+        if colored:
+            # FindHeader stops at the first colored row; FindHeaderRange then
+            # needs a value in that row
+            self._vbs_done = True
+            self.has_header = any(_has_value(cell) for _, cell in cells)
+
+    def _collect_v2_candidates(self, row, cells):
+        values = []
+        for col, cell in cells:
+            if col > V2_HEADER_COLUMNS or not self._is_header_style(cell.attrs.get("s")):
+                continue
+            value = _cell_text(cell)
+            if isinstance(value, int):
+                self.max_shared_index = max(self.max_shared_index, value)
+            if value is not None:
+                values.append(value)
+        if values:
+            self._v2_candidates[row] = values
+
+    def _is_header_style(self, style):
+        return int(style or 0) in self.header_styles
+
+
+def _has_value(cell):
+    return any(child.tag in ("v", "is", "f") for child in cell.elements())
+
+
+def _cell_text(cell):
+    """Text of a cell value, the shared string index, or ``None``."""
+    if cell.attrs.get("t") == "inlineStr":
+        inline = cell.find("is")
+        if inline is None:
+            return ""
+        # Plain text or rich text runs; phonetic runs are not part of the value
+        runs = [inline] + [node for node in inline.elements() if node.tag == "r"]
+        return "".join(
+            node.text() for run in runs for node in run.elements() if node.tag == "t"
+        )
+    value = cell.find("v")
+    if value is None:
+        return None
+    if cell.attrs.get("t") == "s":
+        return int(value.text())
+    if cell.attrs.get("t") in (None, "n", "b", "e"):
+        # Numbers, booleans and errors are never blank
+        return value.text() or "0"
+    return value.text()
+
+
+def _read_shared_strings(zf, max_index):
+    """Read shared strings up to ``max_index`` only."""
+    strings = []
+    if max_index < 0 or "xl/sharedStrings.xml" not in zf.namelist():
+        return strings
+
+    ns = {"m": MAIN_NS}
+    with zf.open("xl/sharedStrings.xml") as stream:
+        for _, element in ET.iterparse(stream):
+            if element.tag != f"{{{MAIN_NS}}}si":
+                continue
+            texts = element.findall("m:t", ns) + element.findall("m:r/m:t", ns)
+            strings.append("".join(text.text or "" for text in texts))
+            element.clear()
+            if len(strings) > max_index:
+                break
+    return strings
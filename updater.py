@@ -1,18 +1,15 @@
 # updater.py
 import json
-import urllib.request
-import urllib.error
 import os
 import sys
-import subprocess
-import tempfile
 import hashlib
 import types
-from packaging import version
 from PySide6.QtWidgets import QMessageBox, QProgressDialog
 from PySide6.QtCore import QThread, Signal, QTimer
 from translations import tr
 
+# urllib.request, packaging and pgpy are imported where they are used: the
+# window imports this module at startup, long before any update is checked
 CURRENT_VERSION = "1.2.1"
 GITHUB_API_URL = "https://api.github.com/repos/Slipfaith/DM/releases/latest"
 
@@ -82,6 +79,7 @@ class DownloadThread(QThread):
         self.save_path = save_path
 
     def run(self):
+        import urllib.request
         try:
             response = urllib.request.urlopen(self.url)
             total_size = int(response.headers.get('Content-Length', 0))
@@ -117,6 +115,8 @@ class UpdateChecker:
         self.signature_asset = None
 
     def check_for_updates(self, silent=False):
+        import urllib.request
+        from packaging import version
         try:
             with urllib.request.urlopen(GITHUB_API_URL, timeout=5) as response:
                 data = json.loads(response.read().decode())
@@ -184,6 +184,7 @@ class UpdateChecker:
             self._download_update(exe_asset)
 
     def _download_update(self, asset):
+        import tempfile
         download_url = asset['browser_download_url']
         temp_file = os.path.join(tempfile.gettempdir(), asset['name'])
 
@@ -205,6 +206,7 @@ class UpdateChecker:
         self.download_thread.start()
 
     def _on_download_finished(self, file_path):
+        import urllib.request
         self.progress_dialog.close()
 
         sig_path = file_path + '.asc'
@@ -305,6 +307,8 @@ class UpdateChecker:
             raise Exception(f'Signature verification failed: {e}')
 
     def _install_update(self, new_exe_path):
+        import subprocess
+        import tempfile
         current_exe = sys.executable
 
         if getattr(sys, 'frozen', False):
@@ -0,0 +1,89 @@
+import struct
+import zipfile
+
+from ooxml import CHUNK_SIZE
+
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_DATA_DESCRIPTOR_FLAG = 0x08
+
+
+class ZipPassthroughWriter:
+    """Write a new package from ``source``, copying untouched members as is.
+
+    ``copy`` moves a member's compressed bytes into the output without
+    inflating and deflating them again, so images, pivot caches and VBA
+    projects cost no more than a file copy. Only members written through
+    ``open``/``writestr`` are compressed anew.
+    """
+
+    def __init__(self, source, output_path):
+        self.source = source
+        self._zout = zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._zout.close()
+
+    def copy(self, info, source=None):
+        """Copy member ``info`` of the source package byte for byte.
+
+        ``source`` is another open ``ZipFile`` to copy ``info`` from, such as
+        a part rewritten by a worker process.
+        """
+        fp = (source or self.source).fp
+        fp.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(fp.read(_LOCAL_HEADER.size))
+        name_length, extra_length = header[-2], header[-1]
+        fp.seek(info.header_offset + _LOCAL_HEADER.size + name_length + extra_length)
+
+        target = self._target(info)
+        target.flag_bits = info.flag_bits & ~_DATA_DESCRIPTOR_FLAG
+        target.CRC = info.CRC
+        target.compress_size = info.compress_size
+        target.file_size = info.file_size
+
+        zout = self._zout
+        zip64 = max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT
+        target.header_offset = zout.fp.tell()
+        zout.fp.write(target.FileHeader(zip64))
+
+        remaining = info.compress_size
+        while remaining:
+            chunk = fp.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated member {info.filename}")
+            zout.fp.write(chunk)
+            remaining -= len(chunk)
+
+        # Register the member the way ZipFile.write does
+        zout.filelist.append(target)
+        zout.NameToInfo[target.filename] = target
+        zout.start_dir = zout.fp.tell()
+        zout._didModify = True
+
+    def open(self, name):
+        """Return a writable stream for a member that is regenerated."""
+        info = self.source.NameToInfo.get(name)
+        if info is None:
+            target = zipfile.ZipInfo(name)
+            target.compress_type = zipfile.ZIP_DEFLATED
+        else:
+            target = self._target(info)
+        return self._zout.open(target, "w", force_zip64=True)
+
+    def writestr(self, name, data):
+        with self.open(name) as dst:
+            dst.write(data)
+
+    @staticmethod
+    def _target(info):
+        target = zipfile.ZipInfo(info.filename, info.date_time)
+        target.compress_type = info.compress_type
+        target.external_attr = info.external_attr
+        target.create_system = info.create_system
+        return target